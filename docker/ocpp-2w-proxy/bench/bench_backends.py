@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Backend benchmark: every installed combination of event loop and JSON library ([backend]).
+#
+# Runs the proxy once per combination between load generator processes and a fake CSMS, and
+# reports answered Calls per second (each one is two frames through the proxy) and the Call ->
+# CallResult round trip latency as seen by the chargers.
+#
+#   python bench/bench_backends.py --chargers 100 --duration 10 --frame MeterValues
+
+import argparse
+import importlib.util
+import os
+import tempfile
+import time
+
+from fakes import free_port, start_proxy, write_ini
+from load import load, percentile, start_csms
+from samples import ocpp16_frames
+
+
+def installed(*modules: str) -> list[str]:
+    return [m for m in modules if importlib.util.find_spec(m) is not None]
+
+
+def measure(loop: str, json: str, args, csms_port: int, frame: str):
+    with tempfile.TemporaryDirectory() as workdir:
+        proxy_port = free_port()
+        ini = os.path.join(workdir, "proxy.ini")
+        write_ini(
+            ini,
+            {
+                "logging": {"proxy": "WARNING"},
+                "host": {"addr": "127.0.0.1", "port": proxy_port, "ping_timeout": 60},
+                "ext-server": {"server": f"ws://127.0.0.1:{csms_port}/ocpp"},
+                "backend": {"loop": loop, "json": json},
+            },
+        )
+        proxy = start_proxy(ini, proxy_port)
+        try:
+            return load(
+                proxy_port, args.chargers, args.client_procs, frame, args.duration
+            )
+        finally:
+            proxy.terminate()
+            proxy.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proxy throughput per backend")
+    parser.add_argument("--chargers", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--client-procs", type=int, default=2)
+    parser.add_argument("--csms-procs", type=int, default=2)
+    parser.add_argument(
+        "--frame", default="StatusNotification", choices=ocpp16_frames().keys()
+    )
+    args = parser.parse_args()
+    frame = ocpp16_frames()[args.frame]
+
+    csms_port = free_port()
+    csms = start_csms(csms_port, args.csms_procs)
+    time.sleep(1)
+
+    print(f"{args.chargers} chargers, {args.frame} ({len(frame)} bytes)")
+    for loop in ["asyncio"] + installed("uvloop"):
+        for json in ["json"] + installed("ujson", "orjson"):
+            answered, latencies = measure(loop, json, args, csms_port, frame)
+            print(
+                f"{loop:>8} + {json:<7}: {2 * answered / args.duration:>9.0f} frames/s"
+                f" | p50 {percentile(latencies, 50) * 1000:6.2f} ms"
+                f" | p99 {percentile(latencies, 99) * 1000:6.2f} ms"
+            )
+
+    for p in csms:
+        p.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# Microbenchmark: header-only frame decoding vs. full json.loads
+#
+#   python bench/bench_frames.py [--number N]
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ocpp2w.frames import decode_full, decode_header  # noqa: E402
+from samples import ocpp16_frames, ocpp201_frames  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare OCPP frame decoders")
+    parser.add_argument(
+        "--number", type=int, default=20000, help="Iterations per frame"
+    )
+    args = parser.parse_args()
+
+    print(f"{'frame':<28} {'bytes':>7} {'full us':>9} {'header us':>10} {'speedup':>8}")
+    for version, frames in (("1.6", ocpp16_frames()), ("2.0.1", ocpp201_frames())):
+        for name, frame in frames.items():
+            assert decode_header(frame) == decode_full(frame), name
+            assert decode_header(frame.encode()) == decode_full(frame), name
+            full = min(
+                timeit.repeat(lambda: decode_full(frame), number=args.number, repeat=3)
+            )
+            header = min(
+                timeit.repeat(
+                    lambda: decode_header(frame), number=args.number, repeat=3
+                )
+            )
+            full_us = full / args.number * 1e6
+            header_us = header / args.number * 1e6
+            print(
+                f"{version + ' ' + name:<28} {len(frame):>7} {full_us:>9.2f} {header_us:>10.2f} {full_us / header_us:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
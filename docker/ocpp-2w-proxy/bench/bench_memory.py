@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# Memory benchmark: bytes per charger session, idle and active.
+#
+# The proxy runs in a child process of its own (as in bench_passthrough.py), with the fake CSMS
+# and the chargers in others. For each session count, the chargers connect and stay idle, then
+# send Calls back to back for a while. The proxy's resident set size and, with --trace, its
+# Python heap (tracemalloc) are sampled with no sessions, with all sessions idle, and halfway
+# through the active phase. Reported is the increase per session.
+#
+# Each session holds two sockets in the proxy (charger and primary CSMS), so the proxy's open file
+# limit caps the session count. Counts above it are skipped.
+#
+#   python bench/bench_memory.py --sessions 100 1000 10000
+#   python bench/bench_memory.py --set host.compression=none --set ext-server.compression=none
+
+import argparse
+import asyncio
+import gc
+import json
+import multiprocessing
+import resource
+import signal
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import websockets
+
+from fakes import free_port, load_proxy
+from harness import rss
+from load import start_csms
+from samples import ocpp16_frames
+
+
+def serve(args):
+    """Child process: run the proxy. SIGUSR1 prints a memory sample."""
+    proxy = load_proxy()
+    proxy.config.read_dict(json.loads(args.ini))
+    proxy.select_loop("auto")
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if args.trace:
+        tracemalloc.start()
+
+    def sample():
+        gc.collect()
+        print(
+            json.dumps(
+                {
+                    "sessions": len(proxy.OCPP2WProxy.proxy_list),
+                    "rss": rss("self"),
+                    "heap": tracemalloc.get_traced_memory()[0] if args.trace else 0,
+                }
+            ),
+            flush=True,
+        )
+
+    async def run():
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, sample)
+        await proxy.main(
+            argparse.Namespace(
+                config=None, workers=None, worker_of=None, worker_index=None
+            )
+        )
+
+    asyncio.run(run())
+
+
+def run_chargers(proxy_port, first, count, frame, active, stop, results):
+    """Process target: chargers first..first+count-1. They connect and report how many did, idle
+    until active is set, send Calls back to back until stop is set, report, and stay connected.
+    """
+
+    async def main():
+        handshakes = asyncio.Semaphore(50)
+        going = asyncio.Event()
+        stopping = asyncio.Event()
+        attempted = asyncio.Event()
+        counts = {"attempted": 0, "connected": 0}
+        prefix, _, suffix = frame.split('"', 2)
+
+        async def charger(n: int):
+            try:
+                async with handshakes:
+                    ws = await websockets.connect(
+                        f"ws://127.0.0.1:{proxy_port}/MEM{n}",
+                        subprotocols=["ocpp1.6"],
+                        max_size=None,
+                        open_timeout=120,
+                        ping_interval=None,
+                    )
+                counts["connected"] += 1
+            except (OSError, TimeoutError, websockets.exceptions.WebSocketException):
+                return
+            finally:
+                counts["attempted"] += 1
+                if counts["attempted"] == count:
+                    attempted.set()
+            await going.wait()
+            calls = 0
+            while not stopping.is_set():
+                await ws.send(f'{prefix}"{n}-{calls}"{suffix}')
+                await ws.recv()
+                calls += 1
+            await asyncio.Future()  # Keep the connection until terminated
+
+        tasks = [asyncio.create_task(charger(n)) for n in range(first, first + count)]
+        await attempted.wait()
+        results.put(counts["connected"])
+        while not active.is_set():
+            await asyncio.sleep(0.05)
+        going.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        stopping.set()
+        results.put(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+
+def measure(args, sessions: int, csms_port: int, frame: str) -> dict:
+    proxy_port = free_port()
+    ini = {
+        "logging": {"proxy": "WARNING", "websockets.server": "ERROR"},
+        "host": {"addr": "127.0.0.1", "port": proxy_port, "ping_timeout": 60},
+        "ext-server": {"server": f"ws://127.0.0.1:{csms_port}/ocpp"},
+    }
+    for setting in args.set:
+        name, _, value = setting.partition("=")
+        section, _, option = name.rpartition(".")
+        ini.setdefault(section, {})[option] = value
+    child = subprocess.Popen(
+        [sys.executable, __file__, "--serve", "--ini", json.dumps(ini)]
+        + (["--trace"] if args.trace else []),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    def sample() -> dict:
+        child.send_signal(signal.SIGUSR1)
+        return json.loads(child.stdout.readline())
+
+    active = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    procs = []
+    try:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                asyncio.run(asyncio.open_connection("127.0.0.1", proxy_port))
+                break
+            except OSError:
+                time.sleep(0.05)
+        baseline = sample()
+
+        per_process = -(-sessions // args.client_procs)
+        for first in range(0, sessions, per_process):
+            procs.append(
+                multiprocessing.Process(
+                    target=run_chargers,
+                    args=(
+                        proxy_port,
+                        first,
+                        min(per_process, sessions - first),
+                        frame,
+                        active,
+                        stop,
+                        results,
+                    ),
+                    daemon=True,
+                )
+            )
+        start = time.monotonic()
+        for p in procs:
+            p.start()
+        connected = sum(results.get() for _ in procs)
+        connect_time = time.monotonic() - start
+        # Let the upstream connections settle too
+        while (idle := sample())["sessions"] < connected and (
+            time.monotonic() - start < connect_time + 30
+        ):
+            time.sleep(0.5)
+
+        active.set()
+        time.sleep(args.duration / 2)
+        busy = sample()
+        time.sleep(args.duration / 2)
+        stop.set()
+        for _ in procs:
+            results.get()
+    finally:
+        for p in procs:
+            p.terminate()
+        child.kill()
+        child.wait()
+
+    n = max(idle["sessions"], 1)
+    return {
+        "sessions": idle["sessions"],
+        "connect_s": connect_time,
+        "idle_rss": (idle["rss"] - baseline["rss"]) / n,
+        "active_rss": (busy["rss"] - baseline["rss"]) / n,
+        "idle_heap": (idle["heap"] - baseline["heap"]) / n,
+        "active_heap": (busy["heap"] - baseline["heap"]) / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proxy memory per charger session")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--duration", type=float, default=4, help="Active phase (s)")
+    parser.add_argument("--client-procs", type=int, default=4)
+    parser.add_argument("--csms-procs", type=int, default=2)
+    parser.add_argument(
+        "--frame", default="MeterValues", choices=ocpp16_frames().keys()
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Also measure the Python heap with tracemalloc (slower)",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="SECTION.OPTION=VALUE",
+        help="Proxy ini setting, e.g. host.max_queue=4. Repeatable",
+    )
+    # Child process options
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--ini", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    csms_port = free_port()
+    csms = start_csms(csms_port, args.csms_procs)
+    time.sleep(1)
+    frame = ocpp16_frames()[args.frame]
+    # Two sockets per session, plus some for the proxy itself
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+
+    print(
+        f"{'sessions':>8} {'connect s':>9} {'idle B/ses':>11} {'active B/ses':>13}"
+        + (f" {'idle heap':>10} {'active heap':>12}" if args.trace else "")
+    )
+    for sessions in args.sessions:
+        if 2 * sessions + 64 > limit:
+            print(
+                f"{sessions:>8} skipped: needs {2 * sessions + 64} files, limit {limit}"
+            )
+            continue
+        r = measure(args, sessions, csms_port, frame)
+        line = (
+            f"{r['sessions']:>8} {r['connect_s']:>9.1f}"
+            f" {r['idle_rss']:>11.0f} {r['active_rss']:>13.0f}"
+        )
+        if args.trace:
+            line += f" {r['idle_heap']:>10.0f} {r['active_heap']:>12.0f}"
+        print(line, flush=True)
+
+    for p in csms:
+        p.terminate()
+
+
+if __name__ == "__main__":
+    main()
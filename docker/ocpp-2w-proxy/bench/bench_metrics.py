@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# Microbenchmark: cost of the per-frame metric updates, compared to the rest of the per-frame work
+#
+#   python bench/bench_metrics.py [--number N]
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ocpp2w.frames import decode_header  # noqa: E402
+from ocpp2w.metrics import ProxyMetrics  # noqa: E402
+from samples import ocpp16_frames  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame metrics overhead")
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    metrics = ProxyMetrics()
+    frame = ocpp16_frames()["StatusNotification"]
+
+    def charger_call():
+        # What receive_charger_messages + the primary writer do for one charger Call
+        metrics.frame(("charger", "rx"), frame)
+        metrics.calls.inc(("charger", "StatusNotification"))
+        metrics.frame(("primary", "tx"), frame)
+
+    def charger_result():
+        # What receive_charger_messages does for one CallResult
+        metrics.frame(("charger", "rx"), frame)
+        metrics.rtt.observe(0.042, ("primary",))
+        metrics.frame(("primary", "tx"), frame)
+
+    cases = {
+        "decode_header (reference)": lambda: decode_header(frame),
+        "metrics: charger Call": charger_call,
+        "metrics: charger CallResult": charger_result,
+    }
+    print(f"{'case':<30} {'ns/frame':>9}")
+    for name, fn in cases.items():
+        t = min(timeit.repeat(fn, number=args.number, repeat=5))
+        print(f"{name:<30} {t / args.number * 1e9:>9.0f}")
+    # Rendering is per scrape, not per frame. Shown for completeness.
+    t = min(timeit.repeat(metrics.render, number=1000, repeat=3))
+    print(f"{'render (per scrape)':<30} {t / 1000 * 1e9:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# Passthrough benchmark: frames forwarded as str (decode + re-encode per hop) vs. as raw bytes
+# ([host] passthrough = true).
+#
+# The proxy runs in a child process of its own, with the fake CSMS and the charger in others, so
+# what is measured is the proxy only: CPU time per Call (each Call and its CallResult cross the
+# proxy once) and, with tracemalloc, the peak memory allocated while forwarding. One charger sends
+# Calls back to back, so that peak is what a single frame in flight costs.
+#
+#   python bench/bench_passthrough.py --sizes 1000 16000 256000 --duration 5
+
+import argparse
+import asyncio
+import json
+import signal
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from fakes import free_port, load_proxy
+from load import load, start_csms
+
+
+def data_transfer(size: int) -> str:
+    """A DataTransfer Call of about size bytes"""
+    frame = '[2,"id","DataTransfer",{"vendorId":"bench","data":""}]'
+    return frame.replace('""}', '"' + "x" * max(size - len(frame), 0) + '"}')
+
+
+def serve(args):
+    """Child process: run the proxy. SIGUSR1 starts measuring, SIGUSR2 prints the result."""
+    proxy = load_proxy()
+    proxy.config.read_dict(
+        {
+            "logging": {"proxy": "WARNING"},
+            "host": {
+                "addr": "127.0.0.1",
+                "port": args.serve,
+                "ping_timeout": 60,
+                "passthrough": args.passthrough,
+            },
+            "ext-server": {"server": f"ws://127.0.0.1:{args.csms_port}/ocpp"},
+        }
+    )
+    proxy.select_loop(args.loop)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = {}
+        stopped = asyncio.Event()
+
+        def start():
+            if args.trace:
+                tracemalloc.start()
+            started["cpu"] = time.process_time()
+
+        loop.add_signal_handler(signal.SIGUSR1, start)
+        loop.add_signal_handler(signal.SIGUSR2, stopped.set)
+        server = asyncio.create_task(
+            proxy.main(
+                argparse.Namespace(
+                    config=None, workers=None, worker_of=None, worker_index=None
+                )
+            )
+        )
+        await stopped.wait()
+        cpu = time.process_time() - started["cpu"]
+        peak = tracemalloc.get_traced_memory()[1] if args.trace else 0
+        print(json.dumps({"cpu": cpu, "peak": peak}), flush=True)
+        server.cancel()
+
+    asyncio.run(run())
+
+
+def measure(args, csms_port: int, frame: str, passthrough: bool, trace: bool):
+    """Returns (answered Calls, proxy CPU seconds, peak traced bytes)"""
+    proxy_port = free_port()
+    child = subprocess.Popen(
+        [
+            sys.executable,
+            __file__,
+            "--serve",
+            str(proxy_port),
+            "--csms-port",
+            str(csms_port),
+            "--passthrough",
+            str(passthrough).lower(),
+            "--loop",
+            args.loop,
+        ]
+        + (["--trace"] if trace else []),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                asyncio.run(asyncio.open_connection("127.0.0.1", proxy_port))
+                break
+            except OSError:
+                time.sleep(0.05)
+        child.send_signal(signal.SIGUSR1)
+        answered, _ = load(proxy_port, 1, 1, frame, args.duration)
+        child.send_signal(signal.SIGUSR2)
+        result = json.loads(child.stdout.readline())
+    finally:
+        child.kill()
+        child.wait()
+    return answered, result["cpu"], result["peak"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="str vs. raw bytes forwarding")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 16000, 256000])
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--loop", default="asyncio", help="[backend] loop")
+    # Child process options
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--csms-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--passthrough", help=argparse.SUPPRESS)
+    parser.add_argument("--trace", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    csms_port = free_port()
+    csms = start_csms(csms_port, 1)
+    time.sleep(1)
+
+    print(
+        f"{'bytes':>7} {'mode':<11} {'Calls/s':>8} {'CPU us/Call':>12} {'peak KiB':>9}"
+    )
+    for size in args.sizes:
+        frame = data_transfer(size)
+        baseline = None
+        for passthrough in (False, True):
+            answered, cpu, _ = measure(args, csms_port, frame, passthrough, False)
+            _, _, peak = measure(args, csms_port, frame, passthrough, True)
+            cpu_us = cpu / max(answered, 1) * 1e6
+            line = (
+                f"{len(frame):>7} {'passthrough' if passthrough else 'str':<11}"
+                f" {answered / args.duration:>8.0f} {cpu_us:>12.1f} {peak / 1024:>9.0f}"
+            )
+            if baseline:
+                line += f"  (CPU {cpu_us / baseline[0]:.2f}x, peak {peak / baseline[1]:.2f}x)"
+            else:
+                baseline = (cpu_us, peak)
+            print(line)
+
+    for p in csms:
+        p.terminate()
+
+
+if __name__ == "__main__":
+    main()
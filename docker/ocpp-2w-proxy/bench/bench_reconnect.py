@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Reconnect storm load generator.
+#
+# Starts a local TLS stand-in CSMS and the proxy, then lets N simulated chargers connect at the
+# same time. Each charger sends a BootNotification and counts as live once the CallResult is back.
+# Reports the time until all sessions are live and how many upstream TLS sessions were resumed.
+#
+#   python bench/bench_reconnect.py --chargers 500 --max-handshakes 20 --rounds 2
+
+import argparse
+import asyncio
+import os
+import ssl
+import statistics
+import sys
+import tempfile
+import time
+
+import websockets
+
+from fakes import FakeCSMS, free_port, make_cert, start_proxy, write_ini
+
+BOOT = '[2,"boot-{n}","BootNotification",{{"chargePointVendor":"Bench","chargePointModel":"Sim"}}]'
+
+
+class Storm:
+    def __init__(self, chargers: int):
+        self.chargers = chargers
+        self.live = 0
+        self.all_live = asyncio.Event()
+
+    async def charger(self, proxy_port: int, n: int) -> float:
+        """Connect and boot. Returns seconds until the BootNotification was answered.
+        Stays connected until every charger is live, like a real fleet would."""
+        start = time.monotonic()
+        async with websockets.connect(
+            f"ws://127.0.0.1:{proxy_port}/BENCH{n}",
+            subprotocols=["ocpp1.6"],
+            open_timeout=120,
+        ) as ws:
+            await ws.send(BOOT.format(n=n))
+            while not (await ws.recv()).startswith(f'[3,"boot-{n}"'):
+                pass
+            elapsed = time.monotonic() - start
+            self.live += 1
+            if self.live == self.chargers:
+                self.all_live.set()
+            await self.all_live.wait()
+        return elapsed
+
+    async def run(self, proxy_port: int) -> list[float]:
+        return await asyncio.gather(
+            *(self.charger(proxy_port, n) for n in range(self.chargers))
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Reconnect storm against the proxy")
+    parser.add_argument("--chargers", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=2, help="Storms to run")
+    parser.add_argument("--max-handshakes", type=int, default=20)
+    parser.add_argument(
+        "--csms-delay", type=float, default=0, help="CSMS answer delay (s)"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cert, key = make_cert(workdir)
+        server_ssl = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_ssl.load_cert_chain(cert, key)
+        csms_port = free_port()
+        csms = await FakeCSMS("primary", delay=args.csms_delay).start(
+            csms_port, server_ssl
+        )
+
+        proxy_port = free_port()
+        ini = os.path.join(workdir, "proxy.ini")
+        write_ini(
+            ini,
+            {
+                "logging": {"proxy": "WARNING"},
+                "host": {"addr": "127.0.0.1", "port": proxy_port, "ping_timeout": 60},
+                "ext-server": {
+                    "server": f"wss://localhost:{csms_port}/ocpp",
+                    "ca_file": cert,
+                    "max_handshakes": args.max_handshakes,
+                },
+            },
+        )
+        proxy = start_proxy(ini, proxy_port)
+        try:
+            for i in range(args.rounds):
+                before = (csms.connections, csms.resumed)
+                start = time.monotonic()
+                times = await Storm(args.chargers).run(proxy_port)
+                total = time.monotonic() - start
+                times.sort()
+                print(
+                    f"round {i + 1}: {args.chargers} chargers live in {total:.2f}s"
+                    f" | per charger p50 {statistics.median(times) * 1000:.0f}ms"
+                    f" p99 {times[int(len(times) * 0.99) - 1] * 1000:.0f}ms"
+                    f" | upstream TLS resumed {csms.resumed - before[1]}"
+                    f"/{csms.connections - before[0]}"
+                )
+                # Let the proxy tear down the sessions before the next storm
+                await asyncio.sleep(1)
+        finally:
+            proxy.terminate()
+            proxy.wait()
+            csms.server.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Throughput benchmark: 1 worker vs. N workers (--workers).
+#
+# Fake CSMS processes and load generator processes run next to the proxy, so that neither is the
+# bottleneck. Each simulated charger sends Calls back to back and waits for each CallResult.
+# Reports answered Calls per second for each worker count.
+#
+#   python bench/bench_workers.py --workers 1 4 --chargers 200 --duration 10
+
+import argparse
+import os
+import tempfile
+import time
+
+from fakes import free_port, start_proxy, write_ini
+from load import load, start_csms
+from samples import ocpp16_frames
+
+
+def measure(workers: int, args, csms_port: int, frame: str) -> float:
+    with tempfile.TemporaryDirectory() as workdir:
+        proxy_port = free_port()
+        ini = os.path.join(workdir, "proxy.ini")
+        write_ini(
+            ini,
+            {
+                "logging": {"proxy": "WARNING"},
+                "host": {
+                    "addr": "127.0.0.1",
+                    "port": proxy_port,
+                    "ping_timeout": 60,
+                    "control_socket": os.path.join(workdir, "control.sock"),
+                },
+                "ext-server": {"server": f"ws://127.0.0.1:{csms_port}/ocpp"},
+            },
+        )
+        proxy = start_proxy(ini, proxy_port, args=["--workers", str(workers)])
+        # Let all workers bind before load starts
+        time.sleep(1 + 0.2 * workers)
+        try:
+            total, _ = load(
+                proxy_port, args.chargers, args.client_procs, frame, args.duration
+            )
+        finally:
+            proxy.terminate()
+            proxy.wait()
+    return total / args.duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proxy throughput vs. worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--chargers", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--client-procs", type=int, default=4)
+    parser.add_argument("--csms-procs", type=int, default=4)
+    parser.add_argument(
+        "--frame", default="StatusNotification", choices=ocpp16_frames().keys()
+    )
+    args = parser.parse_args()
+    frame = ocpp16_frames()[args.frame]
+
+    csms_port = free_port()
+    csms = start_csms(csms_port, args.csms_procs)
+    time.sleep(1)
+
+    baseline = None
+    for workers in args.workers:
+        rate = measure(workers, args, csms_port, frame)
+        baseline = baseline or rate
+        print(
+            f"workers {workers:>2}: {rate:>9.0f} Calls/s ({rate / baseline:.2f}x)"
+            f" | {args.chargers} chargers, {args.frame} ({len(frame)} bytes)"
+        )
+
+    for p in csms:
+        p.terminate()
+
+
+if __name__ == "__main__":
+    main()
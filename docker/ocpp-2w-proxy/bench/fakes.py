@@ -0,0 +1,135 @@
+# Local stand-ins for the benchmarks: a fake CSMS, a proxy launcher and TLS material.
+# Everything runs on localhost.
+
+import asyncio
+import configparser
+import importlib.util
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import time
+
+import websockets
+
+PROXY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PROXY_SCRIPT = os.path.join(PROXY_DIR, "ocpp-2w-proxy.py")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_cert(workdir: str) -> tuple[str, str]:
+    """Create a self-signed certificate for localhost. Returns (cert, key) paths."""
+    cert = os.path.join(workdir, "localhost.crt")
+    key = os.path.join(workdir, "localhost.key")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "ec",
+            "-pkeyopt",
+            "ec_paramgen_curve:prime256v1",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=DNS:localhost",
+            "-keyout",
+            key,
+            "-out",
+            cert,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+class FakeCSMS:
+    """Answers every Call with an empty CallResult and counts what it sees"""
+
+    def __init__(self, name: str, delay: float = 0):
+        self.name = name
+        self.delay = delay
+        self.connections = 0
+        self.resumed = 0
+        self.frames = 0
+        self.bytes = 0
+        self.server = None
+
+    async def handler(self, ws):
+        self.connections += 1
+        ssl_object = ws.transport.get_extra_info("ssl_object")
+        if ssl_object is not None and ssl_object.session_reused:
+            self.resumed += 1
+        try:
+            async for message in ws:
+                self.frames += 1
+                self.bytes += len(message)
+                if message[:3] == "[2,":
+                    if self.delay:
+                        await asyncio.sleep(self.delay)
+                    message_id = message.split('"', 2)[1]
+                    await ws.send(f'[3,"{message_id}",{{}}]')
+        except websockets.exceptions.ConnectionClosed:
+            pass  # Proxy went away, e.g. killed at the end of a benchmark
+
+    async def start(
+        self, port: int, ssl_context: ssl.SSLContext = None, reuse_port: bool = False
+    ):
+        self.server = await websockets.serve(
+            self.handler,
+            "localhost" if ssl_context else "127.0.0.1",
+            port,
+            ssl=ssl_context,
+            subprotocols=["ocpp1.6", "ocpp2.0.1"],
+            max_size=None,
+            reuse_port=reuse_port,
+        )
+        return self
+
+
+def write_ini(path: str, sections: dict[str, dict[str, str]]):
+    ini = configparser.ConfigParser()
+    ini.read_dict(sections)
+    with open(path, "w") as f:
+        ini.write(f)
+
+
+def load_proxy():
+    """Import ocpp-2w-proxy.py as a module, to run the proxy in-process (proxy.main)"""
+    sys.path.insert(0, PROXY_DIR)
+    spec = importlib.util.spec_from_file_location("ocpp_2w_proxy", PROXY_SCRIPT)
+    proxy = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(proxy)
+    return proxy
+
+
+def start_proxy(
+    ini_path: str, port: int, timeout: float = 10, args: list[str] = ()
+) -> subprocess.Popen:
+    """Start ocpp-2w-proxy.py on ini_path and wait until it listens on port"""
+    proc = subprocess.Popen(
+        [sys.executable, PROXY_SCRIPT, "--config", ini_path, *args],
+        cwd=PROXY_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("Proxy did not start")
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# Replay and load-test harness for the proxy. Runs on localhost only.
+#
+# Starts ocpp-2w-proxy.py on a generated ini, a fake primary and secondary CSMS, and N simulated
+# chargers replaying OCPP traffic: the charger Calls from a capture file ([capture] in the ini),
+# or sample frames when there is none. Three phases:
+#   connect    all chargers connect; connect times and proxy memory per session
+#   load       chargers replay Calls for --duration; throughput and per-hop latencies
+#   reconnect  the --outage-peer CSMS goes away for --outage seconds while the chargers carry
+#              on; charger disconnects, time until every charger is through again, lost Calls
+#
+# Chargers send on schedule and do not wait for the answer before the next Call. Fake CSMSes and
+# chargers share this process's clock, so one-way hop latencies are measured directly (they
+# include this process's own scheduling delays).
+#
+# Results go to --output as JSON. --compare prints the change against an earlier result file.
+#
+#   python bench/harness.py --chargers 200 --rate 2 --duration 30 --output before.json
+#   python bench/harness.py --chargers 200 --rate 2 --duration 30 --compare before.json
+#   python bench/harness.py --capture frames.jsonl --speed 10 --set journal.dir=/tmp/journal
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+from fakes import PROXY_DIR, FakeCSMS, free_port, start_proxy, write_ini
+from load import percentile
+from samples import ocpp16_frames
+
+# Charger Calls replayed when there is no capture file
+SAMPLE_CALLS = ("Heartbeat", "StatusNotification", "MeterValues", "DataTransfer")
+
+
+def split_call(frame: str) -> tuple[str, str]:
+    """Split a Call into the text before and after its id, to send it under new ids"""
+    _, _, action, payload = json.loads(frame)
+    return '[2,"', '",' + json.dumps(action) + "," + json.dumps(payload) + "]"
+
+
+def load_traffic(capture: str) -> list[list[tuple[float, str, str]]]:
+    """Charger Calls per captured charger: [(seconds since its first Call, before, after)]"""
+    if not capture:
+        frames = ocpp16_frames()
+        return [[(0, *split_call(frames[name])) for name in SAMPLE_CALLS]]
+    chargers = {}
+    with open(capture) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["dir"] == "^" and json.loads(record["frame"])[0] == 2:
+                chargers.setdefault(record["charger"], []).append(
+                    (record["ts"], *split_call(record["frame"]))
+                )
+    if not chargers:
+        sys.exit(f"No charger Calls in {capture}")
+    return [
+        [(ts - calls[0][0], before, after) for ts, before, after in calls]
+        for calls in chargers.values()
+    ]
+
+
+def summary(values: list[float]) -> dict:
+    """Latency percentiles in ms"""
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3) if values else None,
+        "p90_ms": round(percentile(values, 90) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 99) * 1000, 3) if values else None,
+        "max_ms": round(values[-1] * 1000, 3) if values else None,
+    }
+
+
+def rss(pid: int) -> int:
+    """Resident set size of a process in bytes"""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class RecordingCSMS(FakeCSMS):
+    """FakeCSMS recording when each frame arrives, and able to go away and come back"""
+
+    def __init__(self, name: str, harness: "Harness"):
+        super().__init__(name)
+        self.harness = harness
+        self.port = free_port()
+        self.open = set()
+        # charger -> first frame received since the last restart
+        self.seen_since_restart: dict[str, float] = {}
+        self.restarted = 0.0
+
+    async def handler(self, ws):
+        charger = ws.request.path.strip("/").rpartition("/")[2]
+        self.connections += 1
+        self.open.add(ws)
+        harness = self.harness
+        hop = f"charger->{self.name}"
+        try:
+            async for message in ws:
+                now = time.perf_counter()
+                self.frames += 1
+                self.bytes += len(message)
+                self.seen_since_restart.setdefault(charger, now)
+                if message[:3] != "[2,":
+                    continue
+                message_id = message.split('"', 2)[1]
+                sent = harness.sent.get(message_id)
+                if sent is not None and harness.recording:
+                    harness.latencies[hop].append(now - sent)
+                if self.name == "primary":
+                    harness.answered_at[message_id] = time.perf_counter()
+                    await ws.send(f'[3,"{message_id}",{{}}]')
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.open.discard(ws)
+
+    async def start(self):
+        await super().start(self.port)
+        self.restarted = time.perf_counter()
+        self.seen_since_restart = {}
+        return self
+
+    async def stop(self):
+        self.server.close()
+        for ws in list(self.open):
+            await ws.close()
+        await self.server.wait_closed()
+
+
+class Harness:
+    def __init__(self, args, traffic: list):
+        self.args = args
+        self.traffic = traffic
+        self.sent: dict[str, float] = {}
+        self.answered_at: dict[str, float] = {}
+        self.latencies = {
+            "charger->primary": [],
+            "charger->secondary": [],
+            "primary->charger": [],
+            "call_rtt": [],
+        }
+        self.recording = False
+        self.connect_times = []
+        self.connected = set()
+        self.disconnects = 0
+        self.calls_sent = 0
+        self.calls_answered = 0
+        self.stopping = False
+        # Next Call per charger, carried over reconnects
+        self.seq = [0] * args.chargers
+
+    async def charger(self, proxy_port: int, n: int):
+        """One simulated charger: connect, replay its Calls, reconnect with backoff if dropped"""
+        calls = self.traffic[n % len(self.traffic)]
+        delay = 0.5
+        while not self.stopping:
+            start = time.perf_counter()
+            try:
+                async with websockets.connect(
+                    f"ws://127.0.0.1:{proxy_port}/HARNESS{n}",
+                    subprotocols=["ocpp1.6"],
+                    max_size=None,
+                    open_timeout=60,
+                ) as ws:
+                    if n not in self.connected:
+                        self.connect_times.append(time.perf_counter() - start)
+                    self.connected.add(n)
+                    delay = 0.5
+                    tasks = [
+                        asyncio.create_task(self.receive(ws)),
+                        asyncio.create_task(self.send(ws, n, calls)),
+                    ]
+                    try:
+                        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        for task in tasks:
+                            task.cancel()
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                websockets.exceptions.WebSocketException,
+            ):
+                pass
+            if self.stopping:
+                return
+            self.disconnects += 1
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, 10)
+
+    async def send(self, ws, n: int, calls: list):
+        """Replay calls in a loop, at the captured pace (--speed) or at --rate Calls/s"""
+        # Spread the chargers over the first interval
+        interval = 1 / self.args.rate
+        await asyncio.sleep(random.uniform(0, interval))
+        while not self.stopping:
+            ts, before, after = calls[self.seq[n] % len(calls)]
+            message_id = f"{n}-{self.seq[n]}"
+            self.sent[message_id] = time.perf_counter()
+            await ws.send(f"{before}{message_id}{after}")
+            self.calls_sent += 1
+            self.seq[n] += 1
+            if self.args.speed and len(calls) > 1:
+                following = calls[self.seq[n] % len(calls)][0]
+                await asyncio.sleep(max(following - ts, 0) / self.args.speed)
+            else:
+                await asyncio.sleep(interval)
+
+    async def receive(self, ws):
+        async for message in ws:
+            now = time.perf_counter()
+            if message[:3] == "[3,":
+                message_id = message.split('"', 2)[1]
+                self.calls_answered += 1
+                if self.recording:
+                    sent = self.sent.get(message_id)
+                    answered = self.answered_at.get(message_id)
+                    if sent is not None:
+                        self.latencies["call_rtt"].append(now - sent)
+                    if answered is not None:
+                        self.latencies["primary->charger"].append(now - answered)
+            elif message[:3] == "[2,":
+                # A CSMS Call: answer it
+                await ws.send(f'[3,"{message.split(chr(34), 2)[1]}",{{}}]')
+
+    def reset_counters(self):
+        for values in self.latencies.values():
+            values.clear()
+        self.sent.clear()
+        self.answered_at.clear()
+        self.calls_sent = self.calls_answered = self.disconnects = 0
+
+    async def run(self, proxy_port: int, pid: int, csms: dict) -> dict:
+        args = self.args
+        results = {}
+
+        # Connect
+        rss_idle = rss(pid)
+        start = time.perf_counter()
+        chargers = [
+            asyncio.create_task(self.charger(proxy_port, n))
+            for n in range(args.chargers)
+        ]
+        while len(self.connected) < args.chargers:
+            if time.perf_counter() - start > 120:
+                break
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(1)
+        rss_connected = rss(pid)
+        results["connect"] = {
+            "chargers": len(self.connected),
+            "seconds": round(time.perf_counter() - start, 3),
+            "connect_time": summary(self.connect_times),
+            "rss_idle_bytes": rss_idle,
+            "rss_per_session_bytes": (rss_connected - rss_idle)
+            // max(args.chargers, 1),
+        }
+
+        # Load
+        self.reset_counters()
+        self.recording = True
+        start = time.perf_counter()
+        frames_before = {name: c.frames for name, c in csms.items()}
+        await asyncio.sleep(args.duration)
+        elapsed = time.perf_counter() - start
+        self.recording = False
+        results["load"] = {
+            "seconds": round(elapsed, 3),
+            "calls_sent_per_s": round(self.calls_sent / elapsed, 1),
+            "calls_answered_per_s": round(self.calls_answered / elapsed, 1),
+            "frames_per_s": {
+                name: round((c.frames - frames_before[name]) / elapsed, 1)
+                for name, c in csms.items()
+            },
+            "latency": {hop: summary(v) for hop, v in self.latencies.items()},
+            "rss_loaded_bytes": rss(pid),
+            "rss_per_session_bytes": (rss(pid) - rss_idle) // max(args.chargers, 1),
+        }
+
+        # Reconnect
+        if args.outage:
+            peer = csms[args.outage_peer]
+            self.reset_counters()
+            await peer.stop()
+            await asyncio.sleep(args.outage)
+            await peer.start()
+            await asyncio.sleep(args.settle)
+            seen = peer.seen_since_restart
+            recovered = [
+                seen[c] - peer.restarted for c in seen if c.startswith("HARNESS")
+            ]
+            lost = [
+                message_id
+                for message_id, sent in self.sent.items()
+                if message_id not in self.answered_at and sent < peer.restarted
+            ]
+            results["reconnect"] = {
+                "peer": args.outage_peer,
+                "outage_s": args.outage,
+                "charger_disconnects": self.disconnects,
+                "chargers_recovered": len(recovered),
+                "recovery_s": summary(recovered),
+                "calls_sent_during_outage": sum(
+                    1 for sent in self.sent.values() if sent < peer.restarted
+                ),
+                "calls_unanswered": (
+                    len(lost) if args.outage_peer == "primary" else None
+                ),
+            }
+
+        self.stopping = True
+        for task in chargers:
+            task.cancel()
+        await asyncio.gather(*chargers, return_exceptions=True)
+        return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROXY_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(baseline: dict, results: dict):
+    old, new = flatten(baseline["results"]), flatten(results["results"])
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('time')})")
+    for key, value in new.items():
+        if key in old and old[key]:
+            print(
+                f"  {key:<48} {old[key]:>12} -> {value:>12}"
+                f" ({(value - old[key]) / old[key] * 100:+.1f}%)"
+            )
+
+
+def proxy_ini(args, proxy_port: int, csms: dict) -> dict:
+    sections = {
+        "logging": {"proxy": "WARNING"},
+        "host": {"addr": "127.0.0.1", "port": proxy_port, "ping_timeout": 60},
+        "ext-server": {
+            "server": f"ws://127.0.0.1:{csms['primary'].port}",
+            "secondary_server": f"ws://127.0.0.1:{csms['secondary'].port}",
+            "primary_backoff_min": 0.5,
+            "primary_backoff_max": 5,
+            "secondary_backoff_min": 0.5,
+            "secondary_backoff_max": 5,
+        },
+    }
+    for setting in args.set:
+        name, _, value = setting.partition("=")
+        section, _, option = name.rpartition(".")
+        sections.setdefault(section, {})[option] = value
+    return sections
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay and load-test the proxy")
+    parser.add_argument("--chargers", type=int, default=100)
+    parser.add_argument(
+        "--capture", help="Capture file to replay ([capture] in the ini)"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=1, help="Calls/s per charger (default 1)"
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        help="Replay at the captured pace, this many times faster (instead of --rate)",
+    )
+    parser.add_argument("--duration", type=float, default=10, help="Load phase (s)")
+    parser.add_argument(
+        "--outage", type=float, default=5, help="CSMS outage (s). 0: skip the phase"
+    )
+    parser.add_argument(
+        "--outage-peer", choices=("primary", "secondary"), default="secondary"
+    )
+    parser.add_argument(
+        "--settle", type=float, default=10, help="Time given to recover (s)"
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="SECTION.OPTION=VALUE",
+        help="Proxy ini setting, e.g. host.passthrough=true. Repeatable",
+    )
+    parser.add_argument("--output", default="harness.json", help="Result file")
+    parser.add_argument("--compare", help="Earlier result file to compare with")
+    args = parser.parse_args()
+
+    traffic = load_traffic(args.capture)
+    harness = Harness(args, traffic)
+    csms = {
+        "primary": RecordingCSMS("primary", harness),
+        "secondary": RecordingCSMS("secondary", harness),
+    }
+    for c in csms.values():
+        await c.start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        proxy_port = free_port()
+        sections = proxy_ini(args, proxy_port, csms)
+        ini = os.path.join(workdir, "proxy.ini")
+        write_ini(ini, sections)
+        proxy = start_proxy(ini, proxy_port)
+        try:
+            results = await harness.run(proxy_port, proxy.pid, csms)
+        finally:
+            proxy.terminate()
+            proxy.wait()
+
+    output = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "args": vars(args),
+        "ini": sections,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2, default=str)
+    print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+# Load generation shared by the throughput benchmarks.
+#
+# Simulated chargers send a Call, wait for its CallResult, and repeat until the deadline. They run
+# in separate processes (run_load) so the load generator is not what limits the proxy.
+
+import asyncio
+import multiprocessing
+import time
+
+import websockets
+
+from fakes import FakeCSMS
+
+
+def run_csms(port: int):
+    """Process target: fake CSMS sharing port with its siblings"""
+
+    async def serve():
+        await FakeCSMS("primary").start(port, reuse_port=True)
+        await asyncio.Future()
+
+    asyncio.run(serve())
+
+
+def start_csms(port: int, processes: int) -> list[multiprocessing.Process]:
+    procs = [
+        multiprocessing.Process(target=run_csms, args=(port,), daemon=True)
+        for _ in range(processes)
+    ]
+    for p in procs:
+        p.start()
+    return procs
+
+
+async def charger(
+    proxy_port: int, n: int, frame: str, deadline: float, latencies: list
+) -> int:
+    """Calls back to back until deadline. Appends each Call's round trip time to latencies."""
+    prefix, _, suffix = frame.split('"', 2)
+    answered = 0
+    async with websockets.connect(
+        f"ws://127.0.0.1:{proxy_port}/BENCH{n}",
+        subprotocols=["ocpp1.6"],
+        max_size=None,
+        open_timeout=60,
+    ) as ws:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            await ws.send(f'{prefix}"{n}-{answered}"{suffix}')
+            await ws.recv()
+            latencies.append(time.perf_counter() - start)
+            answered += 1
+    return answered
+
+
+def run_load(proxy_port: int, first: int, count: int, frame: str, duration, results):
+    """Process target: chargers first..first+count-1. Puts (answered, latencies) on results."""
+
+    async def main():
+        latencies = []
+        deadline = time.monotonic() + duration
+        counts = await asyncio.gather(
+            *(
+                charger(proxy_port, n, frame, deadline, latencies)
+                for n in range(first, first + count)
+            )
+        )
+        results.put((sum(counts), latencies))
+
+    asyncio.run(main())
+
+
+def load(
+    proxy_port: int, chargers: int, processes: int, frame: str, duration: float
+) -> tuple[int, list[float]]:
+    """Run chargers spread over processes. Returns (answered Calls, sorted latencies)"""
+    results = multiprocessing.Queue()
+    per_process = max(chargers // processes, 1)
+    procs = [
+        multiprocessing.Process(
+            target=run_load,
+            args=(proxy_port, i * per_process, per_process, frame, duration, results),
+        )
+        for i in range(processes)
+    ]
+    for p in procs:
+        p.start()
+    answered, latencies = 0, []
+    for _ in procs:
+        count, lat = results.get()
+        answered += count
+        latencies.extend(lat)
+    for p in procs:
+        p.join()
+    latencies.sort()
+    return answered, latencies
+
+
+def percentile(values: list[float], p: float) -> float:
+    """p-th percentile of sorted values"""
+    if not values:
+        return float("nan")
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
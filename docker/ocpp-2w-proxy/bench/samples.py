@@ -0,0 +1,123 @@
+# Realistic OCPP 1.6 and 2.0.1 frames used by the benchmarks.
+
+import json
+import uuid
+
+
+def _sampled_values(measurands: int) -> list:
+    return [
+        {
+            "value": f"{1234.5 + i:.1f}",
+            "context": "Sample.Periodic",
+            "format": "Raw",
+            "measurand": m,
+            "phase": phase,
+            "location": "Outlet",
+            "unit": unit,
+        }
+        for i, (m, phase, unit) in enumerate(
+            [
+                ("Energy.Active.Import.Register", None, "Wh"),
+                ("Power.Active.Import", "L1", "W"),
+                ("Power.Active.Import", "L2", "W"),
+                ("Power.Active.Import", "L3", "W"),
+                ("Current.Import", "L1", "A"),
+                ("Current.Import", "L2", "A"),
+                ("Current.Import", "L3", "A"),
+                ("Voltage", "L1-N", "V"),
+                ("Voltage", "L2-N", "V"),
+                ("Voltage", "L3-N", "V"),
+                ("Temperature", None, "Celsius"),
+                ("SoC", None, "Percent"),
+            ][:measurands]
+        )
+    ]
+
+
+def ocpp16_frames() -> dict[str, str]:
+    """Typical OCPP 1.6 traffic, keyed by a short name"""
+    mid = lambda: str(uuid.uuid4())  # noqa: E731
+    meter_values = {
+        "connectorId": 1,
+        "transactionId": 1742,
+        "meterValue": [
+            {
+                "timestamp": f"2024-05-01T12:{i:02d}:00Z",
+                "sampledValue": _sampled_values(12),
+            }
+            for i in range(10)
+        ],
+    }
+    return {
+        "Heartbeat": json.dumps([2, mid(), "Heartbeat", {}]),
+        "StatusNotification": json.dumps(
+            [
+                2,
+                mid(),
+                "StatusNotification",
+                {"connectorId": 1, "errorCode": "NoError", "status": "Charging"},
+            ]
+        ),
+        "MeterValues": json.dumps([2, mid(), "MeterValues", meter_values]),
+        "DataTransfer": json.dumps(
+            [
+                2,
+                mid(),
+                "DataTransfer",
+                {"vendorId": "com.example", "messageId": "diag", "data": "x" * 16384},
+            ]
+        ),
+        "CallResult": json.dumps([3, mid(), {"currentTime": "2024-05-01T12:00:00Z"}]),
+        "CallError": json.dumps([4, mid(), "NotImplemented", "Unknown action", {}]),
+    }
+
+
+def ocpp201_frames() -> dict[str, str]:
+    """Typical OCPP 2.0.1 traffic, keyed by a short name"""
+    mid = lambda: str(uuid.uuid4())  # noqa: E731
+    transaction_event = {
+        "eventType": "Updated",
+        "timestamp": "2024-05-01T12:00:00Z",
+        "triggerReason": "MeterValuePeriodic",
+        "seqNo": 42,
+        "transactionInfo": {
+            "transactionId": str(uuid.uuid4()),
+            "chargingState": "Charging",
+        },
+        "evse": {"id": 1, "connectorId": 1},
+        "meterValue": [
+            {
+                "timestamp": f"2024-05-01T12:{i:02d}:00Z",
+                "sampledValue": _sampled_values(12),
+            }
+            for i in range(5)
+        ],
+    }
+    notify_report = {
+        "requestId": 7,
+        "generatedAt": "2024-05-01T12:00:00Z",
+        "seqNo": 0,
+        "tbc": True,
+        "reportData": [
+            {
+                "component": {"name": f"Component{i}", "evse": {"id": 1}},
+                "variable": {"name": "Enabled"},
+                "variableAttribute": [
+                    {"type": "Actual", "value": "true", "mutability": "ReadWrite"}
+                ],
+                "variableCharacteristics": {
+                    "dataType": "boolean",
+                    "supportsMonitoring": False,
+                },
+            }
+            for i in range(100)
+        ],
+    }
+    return {
+        "Heartbeat": json.dumps([2, mid(), "Heartbeat", {}]),
+        "TransactionEvent": json.dumps(
+            [2, mid(), "TransactionEvent", transaction_event]
+        ),
+        "NotifyReport": json.dumps([2, mid(), "NotifyReport", notify_report]),
+        "CallResult": json.dumps([3, mid(), {"currentTime": "2024-05-01T12:00:00Z"}]),
+    }
@@ -2,16 +2,43 @@
 # src: https://github.com/ocpp-balanz/ocpp-2w-proxy
 
 import asyncio
+import functools
+import json
 import logging
+import os
+import random
+import signal
+import sys
 import time
-from typing import Tuple
-import json
+from typing import Optional, Tuple
 
 import websockets
 import websockets.asyncio
 import websockets.asyncio.server
 
-from enum import IntEnum
+from ocpp2w.backends import select_json, select_loop
+from ocpp2w.compression import Deflate, PayloadProfile
+from ocpp2w.edge import BOOT_NOTIFICATION, EdgeCache
+from ocpp2w.flow import (
+    POLICY_CLOSE,
+    Sender,
+    SlowPeerSweeper,
+    buffered,
+    check_policy,
+    write_limit,
+)
+from ocpp2w.frames import Frame, OCPPMessageType, call_result, decode_header
+from ocpp2w.httpd import HTTPServer
+from ocpp2w.journal import Journal
+from ocpp2w.logs import FrameCapture, FrameLogger, start_queue_listener
+from ocpp2w.metrics import Callback, ProxyMetrics
+from ocpp2w.outbound import OutboundQueue
+from ocpp2w.pending import PendingCalls
+from ocpp2w.routing import RoutingTable
+from ocpp2w.tracing import OUTCOMES, Tracer
+from ocpp2w.upstream import UpstreamConnector
+from ocpp2w.watchdog import StaleSweeper
+from ocpp2w.workers import RegistryClient, supervise
 import ssl
 import argparse
 import configparser
@@ -20,6 +47,32 @@ __version__ = "0.1.0"
 
 config = configparser.ConfigParser()
 
+# Shared by all sessions for connecting to the CSMSes. Created in main() once config is read.
+upstream: UpstreamConnector = None
+# Optional capture of all frames to file. Created in main() if configured.
+capture: FrameCapture = None
+# Metrics, updated by all sessions. Served over HTTP if metrics_port is configured.
+metrics = ProxyMetrics()
+# Closes sessions whose charger went quiet. Created in main().
+watchdog: StaleSweeper = None
+# Cross-worker session registry, when running as one of several workers (--workers)
+registry: RegistryClient = None
+# Detection of peers slow to take what is sent to them (see ocpp2w.flow)
+slow_peers: SlowPeerSweeper = None
+# Routing of the charger's Calls per upstream, by action ([routing-primary], [routing-secondary])
+routing: dict[str, RoutingTable] = {
+    "primary": RoutingTable(),
+    "secondary": RoutingTable(),
+}
+# Charger Calls answered by the proxy itself ([edge-cache]). Disabled unless configured.
+edge = EdgeCache()
+# Payload sizes and compression per action, of a sample of the sessions ([profile])
+payload_profile: PayloadProfile = None
+# Spans of the Calls through the proxy ([tracing]). Created in main() if enabled.
+tracer: Tracer = None
+# Sessions moving to changed CSMS URLs after a config reload, if any
+migration: asyncio.Task = None
+
 logging.basicConfig(
     format="%(asctime)s %(levelname)s %(name)s: %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
@@ -31,23 +84,45 @@ class OCPP2WProxy:  # Forward declaration
     pass
 
 
-class OCPPMessageType(IntEnum):
-    Call = 2
-    CallResult = 3
-    CallError = 4
-
-
 # main class
 class OCPP2WProxy:
     # Static dict of OCPP2WProxy instances. key is charger_id
     proxy_list: dict[str, OCPP2WProxy] = {}
 
+    # Thousands of sessions may be live at once: no per-instance __dict__
+    __slots__ = (
+        "ws",
+        "charger_id",
+        "primary_call_ids",
+        "secondary_call_ids",
+        "primary_queue",
+        "secondary_queue",
+        "charger_sender",
+        "recv_decode",
+        "primary_connection",
+        "secondary_connection",
+        "secondary_enabled",
+        "upstream_urls",
+        "moving",
+        "journal",
+        "frame_log",
+        "profile",
+        "route_counts",
+        "edge_answered",
+        "boot_id",
+        "tasks",
+        "background_tasks",
+        "last_seen",
+        "closed",
+        "_connect_kwargs",
+    )
+
     # Utility functions
     @staticmethod
-    def decode_ocpp_message(message: str) -> Tuple[OCPPMessageType, str]:
-        """Decode an OCPP message from a string"""
-        j = json.loads(message)
-        return [j[0], j[1]]
+    def decode_ocpp_message(message: Frame) -> Tuple[OCPPMessageType, str]:
+        """Decode the type and unique id of an OCPP message. The payload is not parsed."""
+        message_type, message_id, _ = decode_header(message)
+        return [message_type, message_id]
 
     def __init__(
         self, websocket: websockets.asyncio.server.ServerConnection, charger_id: str
@@ -59,35 +134,143 @@ class OCPP2WProxy:
 
         # Chech that charger id looks reasonable
         if not charger_id.isalnum():
-            logger.error(f"Charger ID '{charger_id}' is not alphanumeric")
+            logger.error("Charger ID '%s' is not alphanumeric", charger_id)
             raise Exception("Charger ID is not alphanumeric")
 
-        # Initialize table of CSMS call ids sent to the charger in order to respond back
-        self.primary_call_ids = set()
-        self.secondary_call_ids = set()
+        # Initialize table of CSMS call ids sent to the charger in order to respond back.
+        # Entries expire after call_timeout, like the CSMS's own wait for the response.
+        call_timeout = config.getfloat("ext-server", "call_timeout", fallback=30)
+        max_pending = config.getint("ext-server", "max_pending_calls", fallback=1000)
+        self.primary_call_ids = PendingCalls(
+            f"{charger_id} prim", ttl=call_timeout, max_size=max_pending
+        )
+        self.secondary_call_ids = PendingCalls(
+            f"{charger_id} sec", ttl=call_timeout, max_size=max_pending
+        )
+
+        # Outbound queues towards the CSMSes. Primary blocks when full (nothing lost), secondary drops
+        # the oldest frame so a slow secondary never holds up the charger.
+        self.primary_queue = OutboundQueue(
+            f"{charger_id} prim",
+            maxsize=config.getint("ext-server", "primary_queue_size", fallback=100),
+            policy=config.get("ext-server", "primary_queue_policy", fallback="block"),
+            peer="primary",
+            metrics=metrics,
+        )
+        self.secondary_queue = OutboundQueue(
+            f"{charger_id} sec",
+            maxsize=config.getint("ext-server", "secondary_queue_size", fallback=100),
+            policy=config.get(
+                "ext-server", "secondary_queue_policy", fallback="drop_oldest"
+            ),
+            peer="secondary",
+            metrics=metrics,
+        )
+
+        if tracer is not None:
+            self.primary_queue.on_sent = functools.partial(self.trace_sent, "primary")
+            self.secondary_queue.on_sent = functools.partial(
+                self.trace_sent, "secondary"
+            )
+
+        # Frames to the charger, from either CSMS. While a send waits for a slow charger, nothing
+        # more is read from that CSMS.
+        self.charger_sender = Sender(f"{charger_id} chg", "charger")
+
+        # Passthrough: frames are received as the raw UTF-8 bytes and forwarded as such (recv()
+        # decode=False, send() text=True), saving a decode and an encode per hop
+        self.recv_decode = (
+            False if config.getboolean("host", "passthrough", fallback=False) else None
+        )
+
+        # Upstream connections. The secondary one comes and goes (see upstream_link), and so
+        # does the primary one when Calls are journaled while it is down.
+        self.primary_connection = None
+        self.secondary_connection = None
+        self.secondary_enabled = config.has_option("ext-server", "secondary_server")
+        # Per live upstream connection: the URL it was made to, and the future resolved to move
+        # it to the configured one (after a config reload)
+        self.upstream_urls: dict[str, str] = {}
+        self.moving: dict[str, asyncio.Future] = {}
+
+        # Store-and-forward of the charger's Calls while the primary is down (optional)
+        self.journal = None
+        if config.has_option("journal", "dir"):
+            self.journal = Journal(
+                os.path.join(config.get("journal", "dir"), f"{charger_id}.journal"),
+                max_size=config.getint(
+                    "journal", "max_size", fallback=16 * 1024 * 1024
+                ),
+                sync_interval=config.getfloat("journal", "sync_interval", fallback=1),
+            )
+
+        # Frame log lines (sampled/rate limited per charger) and capture
+        self.frame_log = FrameLogger(
+            charger_id,
+            max_length=config.getint("frame-log", "max_length", fallback=1000),
+            sample=config.getint("frame-log", "sample", fallback=1),
+            rate=config.getfloat("frame-log", "rate", fallback=0),
+            burst=config.getint("frame-log", "burst", fallback=20),
+            capture=capture,
+        )
+
+        # Payload profile of this session, if profiling and in the sample
+        self.profile = None
+        if payload_profile is not None:
+            self.profile = payload_profile.session()
+
+        # Calls per (peer, action) seen by the "every N" routing rules
+        self.route_counts: dict[tuple[str, str], int] = {}
+
+        # Calls answered by the edge cache and sent on to the primary, whose answers are dropped
+        # (created on the first one), and the BootNotification waiting for the primary's answer
+        self.edge_answered: PendingCalls = None
+        self.boot_id: str = None
+
+        # Session tasks. Any of self.tasks completing ends the session. Background tasks do not.
+        self.tasks = []
+        self.background_tasks = []
+
+        # Last frame from the charger (time.monotonic()), for the watchdog
+        self.last_seen = time.monotonic()
+        self.closed = False
 
         # Insert new OCPP2WProxy instance in the (static) dict of instances.
         self.proxy_list[charger_id] = self
 
     async def close(self):
         """Close all connections to the charger and primary, secondary server"""
-        try:
-            await self.ws.close()
-            await self.primary_connection.close()
-            if self.secondary_connection:
-                await self.secondary_connection.close()
-        except Exception as e:
-            pass  # Ignore exceptions
+        self.closed = True
+        for task in self.background_tasks:
+            task.cancel()
+        for connection in (self.ws, self.primary_connection, self.secondary_connection):
+            try:
+                if connection is not None:
+                    await connection.close()
+            except Exception:
+                pass  # Ignore exceptions
+        if self.journal is not None:
+            await self.journal.close()
 
     @staticmethod
     async def check_delete_old(charger_id: str):
         """Check if there are any old instances of this charger in the proxy list"""
         if charger_id in OCPP2WProxy.proxy_list:
-            logger.info(f"Charger ID {charger_id} already exists. Closing and deleting")
+            logger.info(
+                "Charger ID %s already exists. Closing and deleting", charger_id
+            )
             proxy: OCPP2WProxy = OCPP2WProxy.proxy_list[charger_id]
             await proxy.close()
             del OCPP2WProxy.proxy_list[charger_id]
 
+    @staticmethod
+    def evict(charger_id: str):
+        """The charger has connected to another worker. Close and delete our session, if any"""
+        proxy = OCPP2WProxy.proxy_list.pop(charger_id, None)
+        if proxy is not None:
+            logger.info("%s reconnected to another worker. Closing", charger_id)
+            asyncio.create_task(proxy.close())
+
     async def run(self):
         """Main loop for this proxy. This is where all the magic happens."""
 
@@ -96,81 +279,95 @@ class OCPP2WProxy:
         headers = {}
         if "Authorization" in self.ws.request.headers:
             headers["Authorization"] = self.ws.request.headers["Authorization"]
-            logger.debug(f"Authorization header set to {headers['Authorization']}")
+            logger.debug("Authorization header set to %s", headers["Authorization"])
         user_agent = self.ws.request.headers.get("User-Agent", None)
         subprotocols = self.ws.request.headers.get(
             "Sec-WebSocket-Protocol", ["ocpp1.6"]
         )
-        primary_url = config.get("ext-server", "server") + "/" + self.charger_id
-        if config.has_option("ext-server", "secondary_server"):
-            secondary_url = (
-                config.get("ext-server", "secondary_server") + "/" + self.charger_id
-            )
-        else:
-            secondary_url = None
+        self._connect_kwargs = dict(
+            user_agent_header=user_agent,
+            additional_headers=headers,
+            subprotocols=[subprotocols],
+            **ws_options("upstream"),
+        )
 
         try:
-            self.primary_connection = await websockets.connect(
-                uri=primary_url,
-                user_agent_header=user_agent,
-                additional_headers=headers,
-                subprotocols=[subprotocols],
-            )
-            logger.info(f"Connected to primary server @ {primary_url}")
-
-            # Connect to secondary server if it is enabled.
-            if secondary_url:
-                self.secondary_connection = await websockets.connect(
-                    uri=secondary_url,
-                    user_agent_header=user_agent,
-                    additional_headers=headers,
-                    subprotocols=[subprotocols],
-                )
-                logger.info(
-                    f"{self.charger_id} Connected to secondary server @ {secondary_url}"
-                )
+            if self.journal is not None:
+                await self.open_journal()
+                if self.closed:
+                    return  # Taken over by a newer session meanwhile
+
+            # The primary CSMS link. Without a journal, losing it ends the session. With one, it
+            # comes and goes like the secondary, and Calls from the charger are journaled meanwhile.
+            primary = asyncio.create_task(self.upstream_link("primary"))
+            if self.journal is None:
+                self.tasks.append(primary)
             else:
-                self.secondary_connection = None
-                logger.info(f"{self.charger_id} Secondary server not enabled")
-
-            # Create tasks to handle the charger. Each task each to handle receiving messages from
-            # the charger, and the (one or two) CSMSes, and finally a watch dog task to take down
-            # connections if connection goes stale.
-            self._last_charger_update = time.time()
-            self.tasks = []
+                self.background_tasks.append(primary)
+
+            # Create a task to handle the charger. It ending ends the session. The (proxy wide)
+            # watch dog takes down the connections if the charger goes stale.
+            self.last_seen = time.monotonic()
             self.tasks.append(asyncio.create_task(self.receive_charger_messages()))
-            self.tasks.append(asyncio.create_task(self.receive_primary_messages()))
-            if self.secondary_connection is not None:
-                self.tasks.append(
-                    asyncio.create_task(self.receive_secondary_messages())
+            if watchdog is not None:
+                watchdog.watch(self)
+
+            # The secondary CSMS is connected in the background, so it never holds up the primary
+            # path. Its loss does not end the session either.
+            if self.secondary_enabled:
+                self.background_tasks.append(
+                    asyncio.create_task(self.upstream_link("secondary"))
                 )
-            # self.tasks.append(asyncio.create_task(self.watchdog()))
+            else:
+                logger.info("%s Secondary server not enabled", self.charger_id)
 
             # Wait for tasks to complete
             done, pending = await asyncio.wait(
                 self.tasks, return_when=asyncio.FIRST_COMPLETED
             )
-            logger.debug(f"{self.charger_id} Task(s) completed: {done}, {pending}")
+            logger.debug("%s Task(s) completed: %s, %s", self.charger_id, done, pending)
 
             for task in done:
                 e = task.exception()
                 if e:
                     logger.warning(
-                        f"{self.charger_id} (Not serious - likely connection loss) Task {task} raised exception {e} related to charger "
+                        "%s (Not serious - likely connection loss) Task %s raised exception %s related to charger ",
+                        self.charger_id,
+                        task,
+                        e,
                     )
 
             # Cancel any remaining tasks
             for task in pending:
                 task.cancel()
 
+            logger.info(
+                "%s Queue stats prim %s sec %s",
+                self.charger_id,
+                self.primary_queue.stats(),
+                self.secondary_queue.stats(),
+            )
+            logger.info(
+                "%s Pending call stats prim %s sec %s",
+                self.charger_id,
+                self.primary_call_ids.stats(),
+                self.secondary_call_ids.stats(),
+            )
+            if self.journal is not None:
+                logger.info(
+                    "%s Journal stats %s", self.charger_id, self.journal.stats()
+                )
+
         except websockets.exceptions.InvalidURI:
-            logger.error(f"{self.charger_id} Invalid URI")
+            logger.error("%s Invalid URI", self.charger_id)
         except websockets.exceptions.ConnectionClosedError as e:
-            logger.error(f"{self.charger_id} Connection closed unexpectedly: {e}")
+            logger.error("%s Connection closed unexpectedly: %s", self.charger_id, e)
         except websockets.exceptions.InvalidHandshake:
-            logger.error(f"{self.charger_id} Handshake with the external server failed")
+            logger.error(
+                "%s Handshake with the external server failed", self.charger_id
+            )
         except Exception as e:
-            logger.error(f"{self.charger_id} Unexpected error: {e}")
+            logger.error("%s Unexpected error: %s", self.charger_id, e)
         finally:
             # Always close stuff. close is well tempered, so can close even if not stablished
             await self.close()
@@ -179,123 +376,793 @@ class OCPP2WProxy:
         try:
             while True:
                 # Wait for a message from the charger
-                message = await self.ws.recv()
+                message = await self.ws.recv(self.recv_decode)
+                self.last_seen = time.monotonic()
                 # Process the received message
-                logger.info(f"{self.charger_id} ^ : {message}")
+                self.frame_log.log("^", message)
+                metrics.frame(("charger", "rx"), message)
+                if self.profile is not None:
+                    self.profile.frame("charger", message)
 
                 # Now, if this is an OCPP CallResult (3) or CallError (4), we need to send it back to the
                 # CSMS (primary or secondary) that issued the command
-                [message_type, message_id] = OCPP2WProxy.decode_ocpp_message(message)
+                message_type, message_id, action = decode_header(message)
 
-                # If it is a Call (2), we will send it to both primary and secondary (if connected)
+                # If it is a Call (2), we will send it to both primary and secondary (if connected).
+                # Frames are queued; the writer tasks do the actual sending.
                 if message_type == OCPPMessageType.Call:
-                    await self.primary_connection.send(message)
-                    if self.secondary_connection:
-                        await self.secondary_connection.send(message)
+                    metrics.calls.inc(("charger", action))
+                    if tracer is not None:
+                        tracer.open(self.charger_id, "charger", message_id, action)
+                    # The edge cache may answer the charger at once
+                    local = (
+                        edge.answer(self.charger_id, action, message_id)
+                        if edge
+                        else None
+                    )
+                    if local is not None:
+                        await self.charger_sender.send(self.ws, local)
+                        metrics.edge_answers.inc((action,))
+                        if tracer is not None:
+                            tracer.close(
+                                self.charger_id, "charger", message_id, "local"
+                            )
+                    if not self.routed("primary", action):
+                        if local is None:
+                            # The charger still waits for an answer
+                            await self.charger_sender.send(
+                                self.ws, call_result(message_id)
+                            )
+                            if tracer is not None:
+                                tracer.close(
+                                    self.charger_id, "charger", message_id, "not routed"
+                                )
+                    else:
+                        await self.to_primary(
+                            message_id, action, message, local is not None
+                        )
+                    if self.secondary_enabled and self.routed("secondary", action):
+                        # Buffered (or dropped when full) while the secondary is down
+                        await self.secondary_queue.put(message)
                 elif (
                     message_type == OCPPMessageType.CallResult
                     or message_type == OCPPMessageType.CallError
                 ):
-                    if message_id in self.primary_call_ids:
-                        logger.info(
-                            f"{self.charger_id} ^ : Result/Error forwarded to primary"
+                    if (rtt := self.primary_call_ids.pop(message_id)) is not None:
+                        metrics.rtt.observe(rtt, ("primary",))
+                        if tracer is not None:
+                            tracer.answered(self.charger_id, "primary", message_id)
+                        logger.debug(
+                            "%s ^ : Result/Error forwarded to primary (%.0fms)",
+                            self.charger_id,
+                            rtt * 1000,
                         )
-                        self.primary_call_ids.remove(message_id)
-                        await self.primary_connection.send(message)
-                    elif message_id in self.secondary_call_ids:
-                        logger.info(
-                            f"{self.charger_id} ^ : Result/Error forwarded to secondary"
+                        await self.primary_queue.put(message)
+                    elif (rtt := self.secondary_call_ids.pop(message_id)) is not None:
+                        metrics.rtt.observe(rtt, ("secondary",))
+                        if tracer is not None:
+                            tracer.answered(self.charger_id, "secondary", message_id)
+                        logger.debug(
+                            "%s ^ : Result/Error forwarded to secondary (%.0fms)",
+                            self.charger_id,
+                            rtt * 1000,
                         )
-                        self.secondary_call_ids.remove(message_id)
-                        await self.secondary_connection.send(message)
+                        await self.secondary_queue.put(message)
                     else:
+                        metrics.unknown_ids.inc()
                         logger.error(
-                            f"{self.charger_id} ^: Received CallResult/CallError against unknown message id {message_id}"
+                            "%s ^: Received CallResult/CallError against unknown message id %s",
+                            self.charger_id,
+                            message_id,
                         )
                 else:
                     logger.error(
-                        f"{self.charger_id} ^: Unknown message type {message_type}"
+                        "%s ^: Unknown message type %s", self.charger_id, message_type
                     )
         except Exception as e:
-            logger.error(f"{self.charger_id} Error in receive_charger_messages: {e}")
+            logger.error("%s Error in receive_charger_messages: %s", self.charger_id, e)
 
     async def receive_primary_messages(self):
         try:
             while True:
                 # Wait for a message from the primary server
-                message = await self.primary_connection.recv()
-                logger.info(f"{self.charger_id} v (prim) : {message}")
+                message = await self.primary_connection.recv(self.recv_decode)
+                self.frame_log.log("v (prim)", message)
+                metrics.frame(("primary", "rx"), message)
+                if self.profile is not None:
+                    self.profile.frame("primary", message)
 
-                [message_type, message_id] = OCPP2WProxy.decode_ocpp_message(message)
+                message_type, message_id, action = decode_header(message)
                 if message_type == OCPPMessageType.Call:
                     # Record the message_id
                     self.primary_call_ids.add(message_id)
+                    metrics.calls.inc(("primary", action))
+                    if tracer is not None:
+                        tracer.open(self.charger_id, "primary", message_id, action)
+                else:
+                    if tracer is not None:
+                        tracer.answered(self.charger_id, "charger", message_id)
+                    if self.journal is not None:
+                        # Answer to a replayed Call: done with it
+                        self.journal.ack(message_id)
+                    if message_id == self.boot_id:
+                        edge.store_boot(self.charger_id, message)
+                        self.boot_id = None
+                    if (
+                        self.edge_answered is not None
+                        and self.edge_answered.pop(message_id) is not None
+                    ):
+                        # The charger was answered by the edge cache already
+                        continue
 
                 # Send message to the charger
-                await self.ws.send(message)
+                await self.charger_sender.send(self.ws, message)
+                metrics.frame(("charger", "tx"), message)
+                if tracer is not None:
+                    if message_type == OCPPMessageType.Call:
+                        tracer.forwarded(self.charger_id, "primary", message_id)
+                    else:
+                        tracer.close(
+                            self.charger_id,
+                            "charger",
+                            message_id,
+                            OUTCOMES.get(message_type),
+                        )
         except Exception as e:
-            logger.error(f"{self.charger_id} Error in receive_primary_messages: {e}")
+            logger.error("%s Error in receive_primary_messages: %s", self.charger_id, e)
 
     async def receive_secondary_messages(self):
         try:
             while True:
                 # Wait for a message from the secondary server
-                message = await self.secondary_connection.recv()
-                logger.info(f"{self.charger_id} v (sec) : {message}")
+                message = await self.secondary_connection.recv(self.recv_decode)
+                self.frame_log.log("v (sec)", message)
+                metrics.frame(("secondary", "rx"), message)
 
-                [message_type, message_id] = OCPP2WProxy.decode_ocpp_message(message)
+                message_type, message_id, action = decode_header(message)
                 if message_type == OCPPMessageType.Call:
                     # Record the message_id
                     self.secondary_call_ids.add(message_id)
+                    metrics.calls.inc(("secondary", action))
+                    if tracer is not None:
+                        tracer.open(self.charger_id, "secondary", message_id, action)
                     # Send it to the charger
-                    await self.ws.send(message)
+                    await self.charger_sender.send(self.ws, message)
+                    metrics.frame(("charger", "tx"), message)
+                    if tracer is not None:
+                        tracer.forwarded(self.charger_id, "secondary", message_id)
                 # Note! We do not forward CallResults or CallErrors from the secondary server
                 # These are silently ignored.
         except Exception as e:
-            logger.error(f"{self.charger_id} Error in receive_primary_messages: {e}")
+            logger.error(
+                "%s Error in receive_secondary_messages: %s", self.charger_id, e
+            )
 
-    async def watchdog(self):
-        """Watch time vs. timestamp updated by receiving messages from charger."""
-        while True:
-            # And ... sleep
-            await asyncio.sleep(config.getint("host", "watchdog_interval", 30))
+    async def open_journal(self):
+        """Open the charger's journal. If that fails, the session runs without one."""
+        try:
+            await self.journal.open()
+        except OSError as e:
+            logger.error(
+                "%s Cannot open journal %s: %s. Continuing without",
+                self.charger_id,
+                self.journal.path,
+                e,
+            )
+            self.journal = None
+
+    async def replay(self):
+        """Send the journaled Calls to the primary, oldest first, at a bounded rate"""
+        interval = 1 / config.getfloat("journal", "replay_rate", fallback=10)
+        replayed = 0
+        while (message := self.journal.next()) is not None:
+            await self.primary_queue.put(message)
+            replayed += 1
+            await asyncio.sleep(interval)
+        # From here on, Calls go straight to the primary queue again
+        if replayed:
+            logger.info("%s Replayed %d journaled Call(s)", self.charger_id, replayed)
+
+    async def to_primary(
+        self, message_id: str, action: str, message: Frame, answered: bool
+    ):
+        """Queue a charger Call for the primary, or journal it while the primary is down (or
+        journaled Calls are still to be replayed first). answered: the edge cache answered it.
+
+        Such a Call is not journaled: replayed later, its answer could come after edge_answered
+        forgot the id, and reach the charger unsolicited."""
+        if self.journal is not None and (
+            self.primary_connection is None or self.journal.unsent
+        ):
+            if not answered:
+                self.track_edge(message_id, action, False)
+                await self.journal.append(message_id, message)
+        else:
+            self.track_edge(message_id, action, answered)
+            await self.primary_queue.put(message)
+
+    async def journal_queued(self):
+        """Primary lost: journal the Calls still queued for it, so they are not lost"""
+        for message in self.primary_queue.drain():
+            message_type, message_id, _ = decode_header(message)
+            if message_type != OCPPMessageType.Call:
+                continue
+            if (
+                self.edge_answered is not None
+                and self.edge_answered.pop(message_id) is not None
+            ):
+                # Answered by the edge cache already (see to_primary)
+                continue
+            # Replayed Calls are in the journal already
+            if message_id not in self.journal.records:
+                await self.journal.append(message_id, message)
+
+    def routed(self, peer: str, action: str) -> bool:
+        """Whether a charger Call with action goes to peer, as per its routing table"""
+        table = routing[peer]
+        if not table or action is None:
+            return True
+        every = table.rule(action).every
+        if every == 1:
+            return True
+        if every:
+            key = (peer, action)
+            count = self.route_counts.get(key, 0)
+            self.route_counts[key] = count + 1
+            if count % every == 0:
+                return True
+        metrics.calls_not_routed.inc((peer, action))
+        return False
 
-            elapsed = time.time() - self._last_charger_update
-            if elapsed > config.getint("host", "watchdog_stale", 300):
-                logger.error(
-                    f"{self.charger_id} Watch dog no for {elapsed} seconds. Closing connections"
+    def trace_sent(self, peer: str, message: Frame):
+        """Outbound queue hook: a frame from the charger went out to peer"""
+        message_type, message_id, _ = decode_header(message)
+        if message_type != OCPPMessageType.Call:
+            tracer.close(self.charger_id, peer, message_id, OUTCOMES.get(message_type))
+        elif peer == "primary":
+            tracer.forwarded(self.charger_id, "charger", message_id)
+
+    def track_edge(self, message_id: str, action: str, answered: bool):
+        """A charger Call goes to the primary. Note whether the charger has its answer already,
+        and whether the answer is one for the edge cache to keep."""
+        if answered:
+            if self.edge_answered is None:
+                self.edge_answered = PendingCalls(
+                    f"{self.charger_id} edge",
+                    ttl=config.getfloat("ext-server", "call_timeout", fallback=30),
+                    max_size=config.getint(
+                        "ext-server", "max_pending_calls", fallback=1000
+                    ),
                 )
+            self.edge_answered.add(message_id)
+        if action == BOOT_NOTIFICATION and edge.boot_notification:
+            self.boot_id = message_id
+
+    def upstream_url(self, peer: str) -> str:
+        """This charger's URL on an upstream CSMS ("primary" or "secondary"), as configured"""
+        option = "server" if peer == "primary" else "secondary_server"
+        return config.get("ext-server", option) + "/" + self.charger_id
+
+    def idle(self, peer: str) -> bool:
+        """Nothing queued for the upstream, and no Call of it waiting for the charger's answer"""
+        return not getattr(self, f"{peer}_queue").busy and not len(
+            getattr(self, f"{peer}_call_ids")
+        )
+
+    def move_upstream(self, peer: str) -> bool:
+        """Reconnect the upstream if its configured URL changed. Returns True if it will."""
+        url = self.upstream_urls.get(peer)
+        move = self.moving.get(peer)
+        if url is None or move is None or url == self.upstream_url(peer):
+            return False
+        if not move.done():
+            move.set_result(None)
+        return True
+
+    async def upstream_link(self, peer: str):
+        """Keep an upstream CSMS ("primary" or "secondary") connected, reconnecting with
+        exponential backoff. An unjournaled primary link ends on the first failure instead.
+        On move_upstream(), the link reconnects to the configured URL once idle."""
+        backoff_min = config.getfloat("ext-server", f"{peer}_backoff_min", fallback=1)
+        backoff_max = config.getfloat("ext-server", f"{peer}_backoff_max", fallback=300)
+        queue = getattr(self, f"{peer}_queue")
+        call_ids = getattr(self, f"{peer}_call_ids")
+        receive = getattr(self, f"receive_{peer}_messages")
+        journaled = peer == "primary" and self.journal is not None
+        reconnects = peer == "secondary" or journaled
+        delay = backoff_min
+        connected_before = False
+        while True:
+            url = self.upstream_url(peer)
+            connection = None
+            replay = None
+            moved = False
+            try:
+                connection = await upstream.connect(url, **self._connect_kwargs)
+                if journaled:
+                    # Before any new Call can go straight to the queue
+                    self.journal.rewind()
+                setattr(self, f"{peer}_connection", connection)
+                self.upstream_urls[peer] = url
+                move = self.moving[peer] = asyncio.get_running_loop().create_future()
+                if connected_before:
+                    metrics.reconnects.inc((peer,))
+                connected_before = True
+                logger.info(
+                    "%s Connected to %s server @ %s", self.charger_id, peer, url
+                )
+                delay = backoff_min
+                tasks = [
+                    asyncio.create_task(receive()),
+                    asyncio.create_task(queue.run(connection)),
+                ]
+                if journaled:
+                    replay = asyncio.create_task(self.replay())
+                try:
+                    await asyncio.wait(
+                        tasks + [move], return_when=asyncio.FIRST_COMPLETED
+                    )
+                    moved = move.done()
+                    if moved:
+                        # Let the old connection finish what is in flight, within reason
+                        deadline = time.monotonic() + config.getfloat(
+                            "ext-server", "move_timeout", fallback=10
+                        )
+                        while not self.idle(peer) and time.monotonic() < deadline:
+                            if any(task.done() for task in tasks):
+                                break
+                            await asyncio.sleep(0.1)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                if moved:
+                    logger.info(
+                        "%s Moving to %s server @ %s",
+                        self.charger_id,
+                        peer,
+                        self.upstream_url(peer),
+                    )
+                else:
+                    logger.warning(
+                        "%s Lost connection to %s server", self.charger_id, peer
+                    )
+            except websockets.exceptions.InvalidURI:
+                logger.error("%s Invalid %s URI. Giving up", self.charger_id, peer)
                 return
+            except Exception as e:
+                logger.warning(
+                    "%s Connection to %s server failed: %s", self.charger_id, peer, e
+                )
+            finally:
+                if replay is not None:
+                    replay.cancel()
+                setattr(self, f"{peer}_connection", None)
+                self.upstream_urls.pop(peer, None)
+                self.moving.pop(peer, None)
+                if connection is not None:
+                    await connection.close()
+                # Calls issued on the old connection can no longer be answered to it
+                call_ids.clear()
+                if journaled:
+                    await self.journal_queued()
+
+            if moved:
+                continue
+            if not reconnects:
+                return
+            # Jitter, so many chargers losing the upstream together do not retry together
+            wait = random.uniform(delay / 2, delay)
+            logger.info("%s Reconnecting to %s in %.1fs", self.charger_id, peer, wait)
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, backoff_max)
+
+    async def close_stale(self, elapsed: float):
+        """Called by the watch dog when nothing was received from the charger for too long."""
+        logger.error(
+            "%s Watch dog no for %.0f seconds. Closing connections",
+            self.charger_id,
+            elapsed,
+        )
+        await self.close()
+
+    def senders(self):
+        """(peer, Sender) for each peer frames are sent to"""
+        yield "charger", self.charger_sender
+        yield "primary", self.primary_queue.sender
+        yield "secondary", self.secondary_queue.sender
+
+    def buffered(self, peer: str) -> int:
+        """Bytes waiting for peer: in the outbound queue, and in the websocket write buffer"""
+        if peer == "charger":
+            return buffered(self.ws)
+        return getattr(self, f"{peer}_queue").bytes + buffered(
+            getattr(self, f"{peer}_connection")
+        )
+
+    async def slow_peer(self, sender: Sender, waited: float):
+        """Called by the slow peer sweeper when a send waited too long for its peer"""
+        metrics.slow_peers.inc((sender.peer,))
+        side = "charger" if sender.peer == "charger" else "upstream"
+        policy = config.get("flow", f"{side}_slow_policy", fallback="pause")
+        connection = (
+            self.ws if side == "charger" else getattr(self, f"{sender.peer}_connection")
+        )
+        logger.warning(
+            "%s Slow %s: send waiting for %.0fs, %d byte(s) buffered. %s",
+            self.charger_id,
+            sender.peer,
+            waited,
+            self.buffered(sender.peer),
+            "Closing" if policy == POLICY_CLOSE else "Pausing",
+        )
+        if policy == POLICY_CLOSE and connection is not None:
+            # The peer does not take what is sent: a close handshake would wait behind it
+            connection.transport.abort()
 
 
 # Connection handler (charger connects)
 async def on_connect(websocket: websockets.asyncio.server.ServerConnection):
-    logger.debug("Connection request", websocket.request)
+    logger.debug("Connection request %s", websocket.request)
     # Determine charger_id (final part of path)
     path = websocket.request.path
     charger_id = path.strip("/")
-    logger.info(f"{charger_id} connection request")
+    logger.info("%s connection request", charger_id)
 
+    proxy = None
     try:
         # Delete any existing charger setup
         if charger_id in OCPP2WProxy.proxy_list:
             await OCPP2WProxy.proxy_list[charger_id].close()
-            del OCPP2WProxy.proxy_list[charger_id]
+            OCPP2WProxy.proxy_list.pop(charger_id, None)
 
         # Setup
         proxy = OCPP2WProxy(websocket=websocket, charger_id=charger_id)
+        if registry is not None:
+            # Evicts any session of this charger held by another worker
+            registry.claim(charger_id)
 
         # Connect and run proxy operations
         await proxy.run()
 
     except Exception as e:
-        logger.error(f"{charger_id} Error creating OCPP2WProxy: {e}")
+        logger.error("%s Error creating OCPP2WProxy: %s", charger_id, e)
     finally:
-        logger.info("f{charger_id} closed/done")
+        # Unregister, unless a newer session of this charger has taken over already
+        if proxy is not None and OCPP2WProxy.proxy_list.get(charger_id) is proxy:
+            del OCPP2WProxy.proxy_list[charger_id]
+            if registry is not None:
+                registry.release(charger_id)
+        logger.info("%s closed/done", charger_id)
+
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def register_session_metrics():
+    """Gauges read from the live sessions at scrape time"""
+    sessions = OCPP2WProxy.proxy_list.values
+
+    def per_peer(fn) -> dict:
+        return {
+            ("primary",): sum(fn(p, "primary") for p in sessions()),
+            ("secondary",): sum(fn(p, "secondary") for p in sessions()),
+        }
+
+    metrics.add(
+        Callback(
+            "ocpp_proxy_chargers_connected",
+            "Chargers with a live session",
+            lambda: {(): len(OCPP2WProxy.proxy_list)},
+        )
+    )
+    metrics.add(
+        Callback(
+            "ocpp_proxy_watchdog_closed_total",
+            "Sessions closed by the watch dog for a stale charger",
+            lambda: {(): watchdog.closed_stale},
+            kind="counter",
+        )
+    )
+    metrics.add(
+        Callback(
+            "ocpp_proxy_upstreams_connected",
+            "Live upstream CSMS connections",
+            lambda: per_peer(
+                lambda p, peer: getattr(p, f"{peer}_connection") is not None
+            ),
+            ("peer",),
+        )
+    )
+    metrics.add(
+        Callback(
+            "ocpp_proxy_queue_depth",
+            "Frames waiting in the outbound queues, all chargers",
+            lambda: per_peer(lambda p, peer: getattr(p, f"{peer}_queue").depth),
+            ("peer",),
+        )
+    )
+    metrics.add(
+        Callback(
+            "ocpp_proxy_pending_calls",
+            "CSMS Calls waiting for the charger's answer, all chargers",
+            lambda: per_peer(lambda p, peer: len(getattr(p, f"{peer}_call_ids"))),
+            ("peer",),
+        )
+    )
+
+    def per_sender(fn, total=sum) -> dict:
+        values = {("charger",): [], ("primary",): [], ("secondary",): []}
+        for p in sessions():
+            for peer, sender in p.senders():
+                values[(peer,)].append(fn(p, peer, sender))
+        return {key: total(v) for key, v in values.items()}
+
+    metrics.add(
+        Callback(
+            "ocpp_proxy_buffered_bytes",
+            "Bytes waiting to be sent to a peer (outbound queue and write buffer), all chargers",
+            lambda: per_sender(lambda p, peer, sender: p.buffered(peer)),
+            ("peer",),
+        )
+    )
+    metrics.add(
+        Callback(
+            "ocpp_proxy_buffered_max_bytes",
+            "Bytes waiting to be sent to a peer, largest of any charger",
+            lambda: per_sender(
+                lambda p, peer, sender: p.buffered(peer),
+                lambda v: max(v, default=0),
+            ),
+            ("peer",),
+        )
+    )
+    metrics.add(
+        Callback(
+            "ocpp_proxy_sends_waiting",
+            "Sends waiting for a peer to take the data (charger: CSMS reads paused)",
+            lambda: per_sender(
+                lambda p, peer, sender: sender.waiting_since is not None
+            ),
+            ("peer",),
+        )
+    )
+
+    def journals() -> list:
+        return [p.journal for p in sessions() if p.journal is not None]
+
+    metrics.add(
+        Callback(
+            "ocpp_proxy_journal_calls",
+            "Journaled charger Calls not answered by the primary yet, all chargers",
+            lambda: {(): sum(j.pending for j in journals())},
+        )
+    )
+    metrics.add(
+        Callback(
+            "ocpp_proxy_journal_bytes",
+            "Size of the live part of the journals, all chargers",
+            lambda: {(): sum(j.size for j in journals())},
+        )
+    )
+    for name, help in (
+        ("connects", "Upstream CSMS connections opened"),
+        ("failures", "Upstream CSMS connection attempts failed"),
+        ("resumed", "Upstream CSMS connections with a resumed TLS session"),
+    ):
+        metrics.add(
+            Callback(
+                f"ocpp_proxy_upstream_{name}_total",
+                help,
+                lambda name=name: {(): getattr(upstream, name)},
+                kind="counter",
+            )
+        )
+
+
+def trace_routes() -> dict:
+    """HTTP routes dumping the trace, as JSON:
+    /traces?charger=&action=&limit=   last closed spans, newest first
+    /traces/open?charger=             spans waiting for their answer
+    /traces/slowest?n=&window=        slowest spans of the last window seconds (max 3600)
+    """
+
+    def dump(spans: list) -> tuple[str, str]:
+        return "application/json", json.dumps(spans, indent=1)
+
+    return {
+        "/traces": lambda query: dump(
+            tracer.spans(
+                query.get("charger"),
+                query.get("action"),
+                int(query.get("limit", 100)),
+            )
+        ),
+        "/traces/open": lambda query: dump(tracer.open_spans(query.get("charger"))),
+        "/traces/slowest": lambda query: dump(
+            tracer.slowest(int(query.get("n", 10)), float(query.get("window", 3600)))
+        ),
+    }
+
+
+# Section with the websocket settings of each side
+WS_SECTIONS = {"charger": "host", "upstream": "ext-server"}
+
+
+def deflate(side: str) -> Optional[Deflate]:
+    """permessage-deflate settings of the charger or the upstream side, None if off"""
+    return Deflate.from_section(config[WS_SECTIONS[side]])
+
+
+def ws_options(side: str) -> dict:
+    """websockets options for the connections to the charger or the upstream side: max frame
+    size and incoming queue ([host]/[ext-server] max_size, max_queue; 0 for no limit),
+    compression (see ocpp2w.compression) and the [flow] write buffer watermarks"""
+    section = WS_SECTIONS[side]
+    settings = deflate(side)
+    return dict(
+        max_size=config.getint(section, "max_size", fallback=1024 * 1024) or None,
+        max_queue=config.getint(section, "max_queue", fallback=16) or None,
+        write_limit=write_limit(
+            config.getint("flow", f"{side}_write_high", fallback=32768),
+            config.getint("flow", f"{side}_write_low", fallback=None),
+        ),
+        **(
+            {"compression": None}
+            if settings is None
+            else settings.ws_options(server=side == "charger")
+        ),
+    )
+
+
+def load_routing(ini: configparser.ConfigParser) -> dict[str, RoutingTable]:
+    """Routing tables per upstream from ini. Raises ValueError on a bad rule."""
+    tables = {}
+    for peer in ("primary", "secondary"):
+        section = f"routing-{peer}"
+        tables[peer] = RoutingTable.from_section(
+            ini[section] if ini.has_section(section) else {}
+        )
+        if peer == "primary":
+            # What the primary doesn't get, the proxy answers with an empty CallResult
+            tables[peer].check_empty_result()
+        if tables[peer]:
+            logger.warning("Routing to %s: %s", peer, tables[peer].describe())
+    return tables
+
+
+def edge_settings(ini: configparser.ConfigParser) -> dict:
+    """Edge cache settings from ini. Raises ValueError on a bad value."""
+    return dict(
+        heartbeat=ini.getboolean("edge-cache", "heartbeat", fallback=False),
+        boot_notification=ini.getboolean(
+            "edge-cache", "boot_notification", fallback=False
+        ),
+        boot_max_age=ini.getfloat("edge-cache", "boot_max_age", fallback=300),
+    )
+
+
+def configure_edge(settings: dict):
+    edge.configure(**settings)
+    if edge:
+        logger.warning(
+            "Edge cache: heartbeat %s, boot_notification %s (max age %.0fs)",
+            edge.heartbeat,
+            edge.boot_notification,
+            edge.boot_max_age,
+        )
+
+
+def apply_log_levels():
+    for logger_name in config["logging"]:
+        logger.warning(
+            "Setting log level for %s to %s",
+            logger_name,
+            config.get("logging", logger_name),
+        )
+        logging.getLogger(logger_name).setLevel(
+            level=config.get("logging", logger_name)
+        )
 
 
-# Main. Decode arguments, setup handler
-async def main():
+# [ext-server] URL options, and the upstream each one is for
+URLS = {"server": "primary", "secondary_server": "secondary"}
+
+
+def reload_config(path: str):
+    """SIGHUP: re-read the config file. Log levels apply at once, new sessions use the new
+    settings, and live sessions move to changed CSMS URLs at [ext-server] migration_rate.
+    """
+    global routing
+    fresh = configparser.ConfigParser()
+    try:
+        if not fresh.read(path):
+            raise OSError(f"Cannot read {path}")
+        fresh_routing = load_routing(fresh)
+        fresh_edge = edge_settings(fresh)
+    except (OSError, configparser.Error, ValueError) as e:
+        logger.error("Config reload failed, keeping the current config: %s", e)
+        return
+    logger.warning("Reloading config from %s", path)
+    routing = fresh_routing
+    configure_edge(fresh_edge)
+    old = {option: config.get("ext-server", option, fallback=None) for option in URLS}
+    config.clear()
+    config.read_dict(fresh)
+    apply_log_levels()
+    watchdog.stale = config.getfloat("host", "watchdog_stale", fallback=300)
+    watchdog.interval = config.getfloat("host", "watchdog_interval", fallback=30)
+    slow_peers.slow_after = config.getfloat("flow", "slow_peer_timeout", fallback=30)
+
+    changed = []
+    for option, peer in URLS.items():
+        url = config.get("ext-server", option, fallback=None)
+        if url != old[option]:
+            logger.warning("%s server changed from %s to %s", peer, old[option], url)
+            changed.append(peer)
+    global migration
+    if changed:
+        if migration is not None:
+            migration.cancel()
+        migration = asyncio.create_task(migrate_sessions(changed))
+
+
+async def migrate_sessions(peers: list[str]):
+    """Move the live sessions to the configured URLs of peers, a few per second, so the CSMS does
+    not see all chargers reconnect at once"""
+    rate = config.getfloat("ext-server", "migration_rate", fallback=10)
+    sessions = list(OCPP2WProxy.proxy_list.values())
+    logger.warning(
+        "Moving %d session(s) to the new %s server at %.1f/s",
+        len(sessions),
+        "/".join(peers),
+        rate,
+    )
+    moved = 0
+    for proxy in sessions:
+        if proxy.closed:
+            continue
+        moves = [proxy.move_upstream(peer) for peer in peers]
+        if any(moves):
+            moved += 1
+            if rate > 0:
+                await asyncio.sleep(1 / rate)
+    logger.warning("Moved %d session(s)", moved)
+
+
+async def drain(server: websockets.asyncio.server.Server):
+    """SIGTERM: stop accepting chargers, let the pending Calls and queued frames of the live
+    sessions finish, then close the sessions in staggered batches, so the chargers do not all
+    reconnect elsewhere at once"""
+    timeout = config.getfloat("host", "drain_timeout", fallback=10)
+    batch = max(config.getint("host", "drain_batch", fallback=50), 1)
+    interval = config.getfloat("host", "drain_interval", fallback=1)
+
+    server.close(close_connections=False)
+    sessions = list(OCPP2WProxy.proxy_list.values())
+    logger.warning("Draining %d session(s)", len(sessions))
+
+    deadline = time.monotonic() + timeout
+    busy = sessions
+    while busy and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        busy = [
+            p
+            for p in busy
+            if not p.closed and not (p.idle("primary") and p.idle("secondary"))
+        ]
+    if busy:
+        logger.warning("%d session(s) still busy after %.0fs", len(busy), timeout)
+
+    for i in range(0, len(sessions), batch):
+        if i:
+            await asyncio.sleep(interval)
+        await asyncio.gather(*(p.close() for p in sessions[i : i + batch]))
+    await server.wait_closed()
+    logger.warning("Drained")
+
+
+# Decode arguments
+def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="ocpp-2w-proxy: A two way OCPP proxy")
     parser.add_argument(
         "--version", action="version", version=f"%(prog)s {__version__}"
@@ -306,20 +1173,157 @@ async def main():
         default="ocpp-2w-proxy.ini",
         help="Configuration file (INI format). Default ocpp-2w-proxy.ini",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes sharing the port (SO_REUSEPORT). Default from [host] workers, or 1",
+    )
+    # Set by the supervisor when starting a worker
+    parser.add_argument("--worker-of", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-index", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
 
-    # Read config. config object is then available (via config import) to all.
-    logger.warning(f"Reading config from {args.config}")
-    config.read(args.config)
 
+# Main. Setup handler
+async def main(args: argparse.Namespace):
     # Adjust log levels
-    for logger_name in config["logging"]:
+    apply_log_levels()
+
+    # Several workers: this process only supervises them
+    workers = args.workers or config.getint("host", "workers", fallback=1)
+    if workers > 1 and args.worker_of is None:
+        control_socket = config.get(
+            "host", "control_socket", fallback="/tmp/ocpp-2w-proxy.sock"
+        )
+        logger.warning("Starting %d workers", workers)
+        await supervise(workers, [sys.argv[0], "--config", args.config], control_socket)
+        return
+
+    worker = args.worker_of is not None
+    if worker:
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(
+                logging.Formatter(
+                    f"%(asctime)s %(levelname)s %(name)s[w{args.worker_index}]: %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S",
+                )
+            )
+
+    # From here on, log records are written by a separate thread
+    start_queue_listener(logging.getLogger())
+
+    # Join the session registry of the supervisor
+    global registry
+    if worker:
+        registry = RegistryClient(args.worker_of, on_evict=OCPP2WProxy.evict)
+        await registry.connect()
+
+    # Optional capture of all frames, separate from the log
+    global capture
+    if config.has_option("capture", "file"):
+        capture = FrameCapture(
+            config.get("capture", "file"),
+            max_bytes=config.getint("capture", "max_bytes", fallback=50_000_000),
+            backup_count=config.getint("capture", "backup_count", fallback=5),
+        )
+        logger.warning("Capturing frames to %s", config.get("capture", "file"))
+
+    # Which charger Calls go to which upstream
+    global routing
+    routing = load_routing(config)
+    configure_edge(edge_settings(config))
+
+    # Journals of Calls waiting for the primary, kept from earlier runs
+    if config.has_option("journal", "dir"):
+        os.makedirs(config.get("journal", "dir"), exist_ok=True)
+        logger.warning("Journaling Calls in %s", config.get("journal", "dir"))
+
+    # JSON library (the event loop is selected before main runs)
+    json_backend = select_json(config.get("backend", "json", fallback="auto"))
+    logger.warning(
+        "Backends: loop %s, json %s",
+        type(asyncio.get_running_loop()).__module__.split(".")[0],
+        json_backend,
+    )
+
+    # Shared upstream connection manager
+    global upstream
+    upstream = UpstreamConnector(
+        max_handshakes=config.getint("ext-server", "max_handshakes", fallback=20),
+        dns_ttl=config.getfloat("ext-server", "dns_ttl", fallback=300),
+        ca_file=config.get("ext-server", "ca_file", fallback=None),
+    )
+
+    # Watch dog for stale chargers, one for the whole proxy
+    global watchdog
+    watchdog = StaleSweeper(
+        stale=config.getfloat("host", "watchdog_stale", fallback=300),
+        interval=config.getfloat("host", "watchdog_interval", fallback=30),
+        on_stale=OCPP2WProxy.close_stale,
+    )
+    watchdog_task = asyncio.create_task(watchdog.run())
+
+    # Slow peer detection, one for the whole proxy too
+    for side in ("charger", "upstream"):
+        check_policy(config.get("flow", f"{side}_slow_policy", fallback="pause"))
+    global slow_peers
+    slow_peers = SlowPeerSweeper(
+        lambda: (
+            (p, sender)
+            for p in list(OCPP2WProxy.proxy_list.values())
+            for _, sender in p.senders()
+        ),
+        slow_after=config.getfloat("flow", "slow_peer_timeout", fallback=30),
+        interval=config.getfloat("flow", "check_interval", fallback=1),
+        on_slow=OCPP2WProxy.slow_peer,
+    )
+    slow_peers_task = asyncio.create_task(slow_peers.run())
+
+    # Payload profiling, reported on the metrics endpoint
+    global payload_profile
+    if config.getboolean("profile", "payloads", fallback=False):
+        payload_profile = PayloadProfile(
+            {"charger": deflate("charger"), "upstream": deflate("upstream")},
+            sample=config.getint("profile", "sample", fallback=10),
+        )
         logger.warning(
-            f"Setting log level for {logger_name} to {config.get('logging', logger_name)}"
+            "Profiling the payloads of 1 in %d session(s)", payload_profile.sample
         )
-        logging.getLogger(logger_name).setLevel(
-            level=config.get("logging", logger_name)
+
+    # Call tracing, dumped on the metrics endpoint
+    global tracer
+    if config.getboolean("tracing", "enabled", fallback=False):
+        tracer = Tracer(
+            size=config.getint("tracing", "size", fallback=10000),
+            timeout=config.getfloat(
+                "tracing",
+                "timeout",
+                fallback=config.getfloat("ext-server", "call_timeout", fallback=30),
+            ),
+            max_open=config.getint("tracing", "max_open", fallback=10000),
+            keep_slowest=config.getint("tracing", "keep_slowest", fallback=20),
         )
+        logger.warning("Tracing Calls, last %d kept", tracer.size)
+
+    # Metrics endpoint
+    metrics_port = config.getint("host", "metrics_port", fallback=None)
+    if metrics_port:
+        if worker:
+            # One endpoint per worker: metrics_port, metrics_port + 1, ...
+            metrics_port += args.worker_index
+        register_session_metrics()
+        metrics_addr = config.get("host", "metrics_addr", fallback="0.0.0.0")
+        routes = {"/metrics": lambda query: (METRICS_CONTENT_TYPE, metrics.render())}
+        if tracer is not None:
+            routes.update(trace_routes())
+        if payload_profile is not None:
+            routes["/profile"] = lambda query: (
+                "application/json",
+                json.dumps(payload_profile.report(), indent=1),
+            )
+        await HTTPServer(routes).start(metrics_addr, metrics_port)
+        logger.warning("Metrics on http://%s:%s/metrics", metrics_addr, metrics_port)
 
     # Get host config
     host = config.get("host", "addr")
@@ -327,7 +1331,11 @@ async def main():
     cert_chain = config.get("host", "cert_chain", fallback=None)
     cert_key = config.get("host", "cert_key", fallback=None)
     logger.debug(
-        f"host: {host}, port: {port}, cert_chain: {cert_chain}, cert_key: {cert_key}"
+        "host: %s, port: %s, cert_chain: %s, cert_key: %s",
+        host,
+        port,
+        cert_chain,
+        cert_key,
     )
 
     # Start server, either ws:// or wss://
@@ -341,6 +1349,8 @@ async def main():
             subprotocols=["ocpp1.6", "ocpp2.0.1"],
             ssl=ssl_context,
             ping_timeout=config.getint("host", "ping_timeout"),
+            reuse_port=worker,
+            **ws_options("charger"),
         )
     else:
         server = await websockets.serve(
@@ -349,14 +1359,34 @@ async def main():
             port,
             subprotocols=["ocpp1.6", "ocpp2.0.1"],
             ping_timeout=config.getint("host", "ping_timeout"),
+            reuse_port=worker,
+            **ws_options("charger"),
         )
 
+    # SIGHUP reloads the config, SIGTERM drains
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGHUP, reload_config, args.config)
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+
     logger.info("Proxy ready. Waiting for new connections...")
-    await server.wait_closed()
+    await stopping.wait()
+    await drain(server)
+    watchdog_task.cancel()
+    slow_peers_task.cancel()
 
 
 if __name__ == "__main__":
+    args = parse_args()
+
+    # Read config. config object is then available (via config import) to all.
+    logger.warning("Reading config from %s", args.config)
+    config.read(args.config)
+
+    # The event loop must be chosen before it is created
+    select_loop(config.get("backend", "loop", fallback="auto"))
+
     try:
-        asyncio.run(main())
+        asyncio.run(main(args))
     except KeyboardInterrupt:
         exit(0)
@@ -0,0 +1 @@
+# Support modules for ocpp-2w-proxy.py
@@ -0,0 +1,62 @@
+# Optional faster backends, chosen in the [backend] section and detected at startup.
+#
+#   loop = auto | uvloop | asyncio
+#   json = auto | orjson | ujson | json
+#
+# "auto" takes the fastest one installed. The stdlib (asyncio, json) is always the fallback, so
+# none of the optional packages is required.
+
+import asyncio
+import importlib
+import json
+import logging
+
+logger = logging.getLogger("proxy")
+
+# JSON functions used by the proxy. Replaced by select_json().
+json_loads = json.loads
+json_dumps = json.dumps
+
+
+def select_loop(name: str = "auto") -> str:
+    """Install the event loop policy. Call before asyncio.run(). Returns the loop used."""
+    if name in ("auto", "uvloop"):
+        try:
+            import uvloop
+        except ImportError:
+            if name == "uvloop":
+                logger.warning("uvloop is not installed. Using asyncio")
+            return "asyncio"
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return "uvloop"
+    if name != "asyncio":
+        logger.warning("Unknown loop backend '%s'. Using asyncio", name)
+    return "asyncio"
+
+
+def select_json(name: str = "auto") -> str:
+    """Select the JSON library behind json_loads/json_dumps. Returns the one used."""
+    global json_loads, json_dumps
+    candidates = ("orjson", "ujson") if name == "auto" else (name,)
+    for candidate in candidates:
+        if candidate == "json":
+            break
+        try:
+            module = importlib.import_module(candidate)
+        except ImportError:
+            if name != "auto":
+                logger.warning("%s is not installed. Using json", candidate)
+            continue
+        if candidate == "orjson":
+            json_loads = module.loads
+            json_dumps = lambda obj: module.dumps(obj).decode()  # noqa: E731
+        elif candidate == "ujson":
+            json_loads = module.loads
+            json_dumps = module.dumps
+        else:
+            logger.warning("Unknown json backend '%s'. Using json", candidate)
+            break
+        return candidate
+    json_loads = json.loads
+    json_dumps = json.dumps
+    return "json"
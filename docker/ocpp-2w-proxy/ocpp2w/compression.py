@@ -0,0 +1,237 @@
+# permessage-deflate settings per side, and a profile of payload sizes and compression per action.
+#
+# [host] (the charger side) and [ext-server] (the upstream side) take:
+#   compression = deflate | none
+#   compression_window_bits = 9..15        LZ77 window, both directions (2^(bits + 2) bytes each)
+#   compression_memory_level = 1..9        zlib memLevel of the compressor (2^(level + 9) bytes)
+#   compression_level = -1..9              zlib level: 1 fastest, 9 smallest, -1 zlib's default
+#   compression_no_context_takeover = bool each frame compressed on its own: the compressor is
+#                                          freed in between, at the cost of a lower ratio
+# Settings not given keep the websockets defaults: a 12 bit window on the charger side (the
+# upstream CSMS decides on the other), memory level 5.
+#
+# The payload profile measures what these settings buy. For a sample of the charger sessions, it
+# compresses every frame to and from the charger and the primary as the websocket would on each
+# link, with one compressor per link and direction, and adds up the sizes per OCPP action. A
+# Call's answer is counted under "<Action>Response" (or "<Action>Error").
+
+import zlib
+from bisect import bisect_left
+from typing import Mapping, Optional
+
+from websockets.extensions.permessage_deflate import (
+    ClientPerMessageDeflateFactory,
+    ServerPerMessageDeflateFactory,
+)
+
+from ocpp2w.frames import OCPPMessageType, decode_header
+
+# websockets' defaults
+DEFAULT_MEMORY_LEVEL = 5
+DEFAULT_SERVER_WINDOW_BITS = 12
+
+# Payload size histogram bounds (bytes)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+SIZE_LABELS = [f"<={bound}" for bound in SIZE_BUCKETS] + [f">{SIZE_BUCKETS[-1]}"]
+# Calls waiting for their answer remembered per session, to name the answer's action
+MAX_CALLS = 100
+# Trailer of a sync flush, dropped from every frame by permessage-deflate
+_SYNC_TRAILER = b"\x00\x00\xff\xff"
+
+
+def _bounded(name: str, value: Optional[int], low: int, high: int) -> Optional[int]:
+    if value is not None and not low <= value <= high:
+        raise ValueError(f"{name} {value} not within {low}..{high}")
+    return value
+
+
+class Deflate:
+    """permessage-deflate settings of one side. None for a websockets default."""
+
+    def __init__(
+        self,
+        window_bits: int = None,
+        memory_level: int = None,
+        level: int = None,
+        no_context_takeover: bool = False,
+    ):
+        self.window_bits = _bounded("compression_window_bits", window_bits, 9, 15)
+        self.memory_level = _bounded("compression_memory_level", memory_level, 1, 9)
+        self.level = _bounded("compression_level", level, -1, 9)
+        self.no_context_takeover = no_context_takeover
+
+    @classmethod
+    def from_section(cls, section: Mapping) -> Optional["Deflate"]:
+        """Settings from a configparser section, None for compression = none. Raises
+        ValueError on a bad value."""
+        compression = section.get("compression", "deflate")
+        if compression == "none":
+            return None
+        if compression != "deflate":
+            raise ValueError(
+                f"Unknown compression '{compression}' (expected deflate or none)"
+            )
+        return cls(
+            window_bits=section.getint("compression_window_bits", None),
+            memory_level=section.getint("compression_memory_level", None),
+            level=section.getint("compression_level", None),
+            no_context_takeover=section.getboolean(
+                "compression_no_context_takeover", False
+            ),
+        )
+
+    @property
+    def default(self) -> bool:
+        return (
+            self.window_bits is None
+            and self.memory_level is None
+            and self.level is None
+            and not self.no_context_takeover
+        )
+
+    def compress_settings(self) -> dict:
+        settings = {"memLevel": self.memory_level or DEFAULT_MEMORY_LEVEL}
+        if self.level is not None:
+            settings["level"] = self.level
+        return settings
+
+    def server_extension(self) -> ServerPerMessageDeflateFactory:
+        window_bits = self.window_bits or DEFAULT_SERVER_WINDOW_BITS
+        return ServerPerMessageDeflateFactory(
+            server_no_context_takeover=self.no_context_takeover,
+            client_no_context_takeover=self.no_context_takeover,
+            server_max_window_bits=window_bits,
+            client_max_window_bits=window_bits,
+            compress_settings=self.compress_settings(),
+        )
+
+    def client_extension(self) -> ClientPerMessageDeflateFactory:
+        return ClientPerMessageDeflateFactory(
+            server_no_context_takeover=self.no_context_takeover,
+            client_no_context_takeover=self.no_context_takeover,
+            server_max_window_bits=self.window_bits,
+            client_max_window_bits=self.window_bits or True,
+            compress_settings=self.compress_settings(),
+        )
+
+    def ws_options(self, server: bool) -> dict:
+        """websockets serve() (server) or connect() options for these settings"""
+        if self.default:
+            return {"compression": "deflate"}
+        extension = self.server_extension() if server else self.client_extension()
+        return {"compression": None, "extensions": [extension]}
+
+    def compressor(self, server: bool):
+        """A zlib compressor working as the websocket's would, for the profile"""
+        window_bits = self.window_bits or (DEFAULT_SERVER_WINDOW_BITS if server else 15)
+        return zlib.compressobj(wbits=-window_bits, **self.compress_settings())
+
+
+class PayloadProfile:
+    """Payload sizes and compressed sizes per OCPP action, over the sampled sessions"""
+
+    def __init__(self, links: Mapping[str, Optional[Deflate]], sample: int = 1):
+        # Compression of each link ("charger", "upstream"), None where there is none
+        self.links = dict(links)
+        self.sample = max(sample, 1)
+        self.sessions = 0
+        self.profiled = 0
+        # Per action: [frames, bytes, count per size bucket (last is above them all)...]
+        self._sizes: dict[str, list] = {}
+        # Per (action, link): compressed bytes
+        self._compressed: dict[tuple[str, str], int] = {}
+
+    def session(self) -> Optional["SessionProfile"]:
+        """The profile of a new session, or None if it is not in the sample"""
+        self.sessions += 1
+        if (self.sessions - 1) % self.sample:
+            return None
+        self.profiled += 1
+        return SessionProfile(self)
+
+    def record(self, action: str, size: int, compressed: dict[str, int]):
+        counts = self._sizes.get(action)
+        if counts is None:
+            counts = self._sizes[action] = [0, 0] + [0] * (len(SIZE_BUCKETS) + 1)
+        counts[0] += 1
+        counts[1] += size
+        counts[2 + bisect_left(SIZE_BUCKETS, size)] += 1
+        for link, length in compressed.items():
+            key = (action, link)
+            self._compressed[key] = self._compressed.get(key, 0) + length
+
+    def report(self) -> dict:
+        actions = {}
+        for action, counts in sorted(self._sizes.items()):
+            frames, size = counts[0], counts[1]
+            actions[action] = {
+                "frames": frames,
+                "bytes": size,
+                "mean": round(size / frames),
+                "sizes": {
+                    label: count
+                    for label, count in zip(SIZE_LABELS, counts[2:])
+                    if count
+                },
+                # Compressed / payload size, per link
+                "ratio": {
+                    link: round(self._compressed.get((action, link), 0) / size, 3)
+                    for link, deflate in self.links.items()
+                    if deflate is not None and size
+                },
+            }
+        return {
+            "sessions": self.sessions,
+            "profiled": self.profiled,
+            "links": {
+                link: "none" if deflate is None else vars(deflate)
+                for link, deflate in self.links.items()
+            },
+            "actions": actions,
+        }
+
+
+class SessionProfile:
+    # Frames from the charger go charger -> proxy -> upstream, frames from the primary the other
+    # way. Compressors are per (link, origin of the frame), i.e. per link and direction.
+    LINKS = ("charger", "upstream")
+
+    __slots__ = ("profile", "calls", "_compressors")
+
+    def __init__(self, profile: PayloadProfile):
+        self.profile = profile
+        # Action of the Calls waiting for an answer, by message id
+        self.calls: dict[str, str] = {}
+        self._compressors: dict[tuple[str, str], object] = {}
+
+    def frame(self, origin: str, message):
+        """Profile a frame from origin ("charger" or "primary")"""
+        message_type, message_id, action = decode_header(message)
+        if message_type == OCPPMessageType.Call:
+            self.calls[message_id] = action
+            while len(self.calls) > MAX_CALLS:
+                del self.calls[next(iter(self.calls))]
+        else:
+            call = self.calls.pop(message_id, "Unknown")
+            suffix = (
+                "Response" if message_type == OCPPMessageType.CallResult else "Error"
+            )
+            action = f"{call}{suffix}"
+        data = message.encode() if isinstance(message, str) else message
+        compressed = {}
+        for link, deflate in self.profile.links.items():
+            if deflate is not None:
+                compressed[link] = self.compressed_size(link, origin, deflate, data)
+        self.profile.record(action, len(data), compressed)
+
+    def compressed_size(self, link: str, origin: str, deflate: Deflate, data) -> int:
+        key = (link, origin)
+        compressor = self._compressors.get(key)
+        if compressor is None or deflate.no_context_takeover:
+            # The proxy is the server on the charger link, the client on the upstream one
+            compressor = deflate.compressor(server=link == "charger")
+            self._compressors[key] = compressor
+        out = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if out.endswith(_SYNC_TRAILER):
+            return len(out) - len(_SYNC_TRAILER)
+        return len(out)
@@ -0,0 +1,103 @@
+# Edge cache: charger Calls the proxy answers itself, without waiting for the primary CSMS.
+#
+# - Heartbeat: the answer is only the CSMS's clock, so the proxy answers with its own at once.
+# - BootNotification: the last Accepted answer of the primary to this charger is kept for max_age
+#   seconds. A charger booting again within that time (a quick reconnect) gets it back at once,
+#   with a fresh currentTime.
+# The Call still goes to the primary, which therefore sees the charger as before. Its answer is
+# not sent to the charger, who has one already, but a BootNotification answer refreshes the cache.
+# If the primary no longer accepts the charger, the cached answer is dropped, so the next boot
+# waits for the primary again.
+#
+# The cache is per process: with several workers, a charger reconnecting to another worker waits
+# for the primary once.
+
+import datetime
+import logging
+import time
+from typing import Optional
+
+from ocpp2w import backends
+from ocpp2w.frames import OCPPMessageType, call_result
+
+logger = logging.getLogger("proxy")
+
+HEARTBEAT = "Heartbeat"
+BOOT_NOTIFICATION = "BootNotification"
+# Chargers whose BootNotification answer is kept, oldest dropped first
+MAX_CHARGERS = 100000
+
+
+def now_iso() -> str:
+    """The current UTC time as OCPP has it, e.g. 2024-01-31T12:00:00.000Z"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return now.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class EdgeCache:
+    def __init__(
+        self,
+        heartbeat: bool = False,
+        boot_notification: bool = False,
+        boot_max_age: float = 300,
+    ):
+        self.configure(heartbeat, boot_notification, boot_max_age)
+        # BootNotification answer payload per charger, and when it came (time.monotonic()).
+        # Refreshed entries move to the end, so the oldest is first.
+        self._boots: dict[str, tuple[float, dict]] = {}
+        # Counters
+        self.heartbeats = 0
+        self.boot_hits = 0
+        self.boot_misses = 0
+        self.boot_revoked = 0
+
+    def configure(self, heartbeat: bool, boot_notification: bool, boot_max_age: float):
+        """(Re)apply the settings. Cached answers are kept."""
+        self.heartbeat = heartbeat
+        self.boot_notification = boot_notification
+        self.boot_max_age = boot_max_age
+
+    def __bool__(self) -> bool:
+        return self.heartbeat or self.boot_notification
+
+    def answer(self, charger_id: str, action: str, message_id: str) -> Optional[str]:
+        """The CallResult to send the charger for its Call, or None to wait for the primary"""
+        if action == HEARTBEAT and self.heartbeat:
+            self.heartbeats += 1
+            return call_result(message_id, {"currentTime": now_iso()})
+        if action == BOOT_NOTIFICATION and self.boot_notification:
+            cached = self._boots.get(charger_id)
+            if cached is not None and time.monotonic() - cached[0] <= self.boot_max_age:
+                self.boot_hits += 1
+                return call_result(message_id, {**cached[1], "currentTime": now_iso()})
+            self.boot_misses += 1
+        return None
+
+    def store_boot(self, charger_id: str, message):
+        """Keep the primary's answer (CallResult or CallError frame) to a BootNotification"""
+        try:
+            frame = backends.json_loads(message)
+            payload = frame[2] if frame[0] == OCPPMessageType.CallResult else {}
+        except (ValueError, TypeError, IndexError, KeyError):
+            payload = {}
+        if isinstance(payload, dict) and payload.get("status") == "Accepted":
+            self._boots.pop(charger_id, None)
+            self._boots[charger_id] = (time.monotonic(), payload)
+            while len(self._boots) > MAX_CHARGERS:
+                del self._boots[next(iter(self._boots))]
+        elif self._boots.pop(charger_id, None) is not None:
+            self.boot_revoked += 1
+            logger.warning(
+                "%s BootNotification no longer accepted by the primary: %s",
+                charger_id,
+                payload.get("status") if isinstance(payload, dict) else payload,
+            )
+
+    def stats(self) -> dict:
+        return {
+            "heartbeats": self.heartbeats,
+            "boot_hits": self.boot_hits,
+            "boot_misses": self.boot_misses,
+            "boot_revoked": self.boot_revoked,
+            "boots_cached": len(self._boots),
+        }
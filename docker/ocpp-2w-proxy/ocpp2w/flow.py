@@ -0,0 +1,128 @@
+# Flow control between the charger and the CSMSes.
+#
+# websockets keeps what the socket did not take yet in the transport's write buffer. Once that is
+# above the connection's high watermark (write_limit), send() waits until it is drained below the
+# low one, so the buffer is bounded per connection and a slow peer throttles whoever sends to it:
+# - towards a CSMS, the outbound queue's writer task waits, and the queue policy takes over;
+# - towards the charger, the task reading from the CSMS waits, so nothing more is read from it.
+#   The CSMS then sees TCP back-pressure once websockets' incoming queue (max_queue) is full.
+#
+# Senders stamp since when their current send is waiting. One sweeper for the whole proxy looks
+# at those stamps every interval and reports the peers that kept a send waiting longer than
+# slow_after; the policy then decides: pause (keep waiting) or close (drop the connection).
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Iterable, Optional
+
+logger = logging.getLogger("proxy")
+
+POLICY_PAUSE = "pause"
+POLICY_CLOSE = "close"
+POLICIES = (POLICY_PAUSE, POLICY_CLOSE)
+
+
+def check_policy(policy: str) -> str:
+    if policy not in POLICIES:
+        raise ValueError(
+            f"Unknown slow peer policy '{policy}' (expected one of {', '.join(POLICIES)})"
+        )
+    return policy
+
+
+def write_limit(high: int, low: Optional[int] = None) -> tuple[int, int]:
+    """websockets write_limit (high, low) watermarks. low defaults to high / 4, as in websockets"""
+    if low is None:
+        low = high // 4
+    if not 0 <= low <= high:
+        raise ValueError(f"Write buffer low watermark {low} not within 0..{high}")
+    return high, low
+
+
+def buffered(connection) -> int:
+    """Bytes in a connection's write buffer, not taken by the peer yet"""
+    if connection is None or connection.transport is None:
+        return 0
+    return connection.transport.get_write_buffer_size()
+
+
+class Sender:
+    """Sends frames to one peer, stamping since when the current send is waiting"""
+
+    __slots__ = (
+        "name",
+        "peer",
+        "waiting_since",
+        "slow",
+        "sent",
+        "slow_count",
+    )
+
+    def __init__(self, name: str, peer: str):
+        self.name = name
+        self.peer = peer
+        # time.monotonic() the current send started at, None when not sending
+        self.waiting_since: Optional[float] = None
+        # Set by the sweeper once the current send is reported slow
+        self.slow = False
+        # Counters
+        self.sent = 0
+        self.slow_count = 0
+
+    async def send(self, connection, message):
+        self.waiting_since = time.monotonic()
+        try:
+            # Raw frames (passthrough mode) go out as text frames too, without re-encoding
+            await connection.send(message, text=True)
+        finally:
+            self.waiting_since = None
+            self.slow = False
+        self.sent += 1
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "slow": self.slow_count}
+
+
+class SlowPeerSweeper:
+    def __init__(
+        self,
+        senders: Callable[[], Iterable[tuple[object, object]]],
+        slow_after: float,
+        interval: float,
+        on_slow: Callable[[object, object, float], Awaitable[None]],
+    ):
+        """senders() yields the (session, sender) pairs to look at. Senders need waiting_since,
+        slow and slow_count attributes. on_slow(session, sender, waited seconds) is run once per
+        send waiting longer than slow_after."""
+        self.senders = senders
+        self.slow_after = slow_after
+        self.interval = interval
+        self.on_slow = on_slow
+        self.detected = 0
+
+    def sweep(self, now: float = None) -> list:
+        """Return the (session, sender) pairs whose send turned slow since the last sweep"""
+        if now is None:
+            now = time.monotonic()
+        if not self.slow_after:
+            return []
+        deadline = now - self.slow_after
+        slow = []
+        for session, sender in self.senders():
+            since = sender.waiting_since
+            if since is not None and since <= deadline and not sender.slow:
+                sender.slow = True
+                sender.slow_count += 1
+                slow.append((session, sender))
+        return slow
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            for session, sender in self.sweep(now):
+                self.detected += 1
+                asyncio.create_task(
+                    self.on_slow(session, sender, now - sender.waiting_since)
+                )
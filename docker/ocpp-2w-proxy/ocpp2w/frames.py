@@ -0,0 +1,74 @@
+# OCPP-J frame decoding.
+#
+# Routing a frame only needs the message type and the unique id (and, for a Call, the action),
+# all of which sit at the very start of the frame:
+#   [2, "<id>", "<Action>", {payload}]
+#   [3, "<id>", {payload}]
+#   [4, "<id>", "<ErrorCode>", "<ErrorDescription>", {details}]
+# decode_header() pulls those out of the prefix without materialising the payload. Anything the
+# prefix pattern does not recognise (escaped ids, odd spacing, garbage) is fully parsed, with the
+# JSON backend selected in ocpp2w.backends.
+#
+# In passthrough mode frames stay the raw UTF-8 bytes received from the websocket. Those are
+# matched through a memoryview of their first HEADER_PREFIX bytes, so only the id and action are
+# copied out of the frame.
+
+import re
+from enum import IntEnum
+from typing import Optional, Tuple, Union
+
+from ocpp2w import backends
+
+
+class OCPPMessageType(IntEnum):
+    Call = 2
+    CallResult = 3
+    CallError = 4
+
+
+# Ids and actions containing a backslash are left to the full parser so escapes are handled right.
+_HEADER_RE = re.compile(r'\s*\[\s*([0-9]+)\s*,\s*"([^"\\]*)"\s*(?:,\s*"([^"\\]*)")?')
+_HEADER_RE_BYTES = re.compile(_HEADER_RE.pattern.encode())
+
+# Bytes of a raw frame looked at by decode_header. Longer ids or actions go to the full parser.
+HEADER_PREFIX = 256
+
+Frame = Union[str, bytes]
+
+
+def decode_header(message: Frame) -> Tuple[int, str, Optional[str]]:
+    """Return (message_type, message_id, action) of an OCPP frame. action is None unless a Call."""
+    if isinstance(message, str):
+        m = _HEADER_RE.match(message)
+        if m is None:
+            return decode_full(message)
+        message_type = int(m.group(1))
+        action = m.group(3) if message_type == OCPPMessageType.Call else None
+        return message_type, m.group(2), action
+
+    m = _HEADER_RE_BYTES.match(memoryview(message)[:HEADER_PREFIX])
+    if m is None:
+        return decode_full(message)
+    message_type = int(m.group(1))
+    action = None
+    if message_type == OCPPMessageType.Call and m.group(3) is not None:
+        action = m.group(3).decode()
+    return message_type, m.group(2).decode(), action
+
+
+def call_result(message_id: str, payload: dict = None) -> str:
+    """A CallResult frame answering the Call message_id"""
+    return backends.json_dumps(
+        [int(OCPPMessageType.CallResult), message_id, payload or {}]
+    )
+
+
+def decode_full(message: Frame) -> Tuple[int, str, Optional[str]]:
+    """Same as decode_header, but by parsing the whole frame. Raises ValueError if malformed."""
+    j = backends.json_loads(message)
+    if not isinstance(j, list) or len(j) < 2:
+        raise ValueError(f"Not an OCPP frame: {message[:80]}")
+    action = None
+    if j[0] == OCPPMessageType.Call and len(j) > 2 and isinstance(j[2], str):
+        action = j[2]
+    return j[0], j[1], action
@@ -0,0 +1,47 @@
+# Minimal HTTP/1.0 server for the metrics and diagnostics endpoints.
+#
+# Runs in the proxy's event loop. Only GET is supported, one request per connection. A route is a
+# callable taking the query parameters and returning (content type, body).
+
+import asyncio
+import logging
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger("proxy")
+
+Route = Callable[[dict], tuple[str, str]]
+
+
+class HTTPServer:
+    def __init__(self, routes: dict[str, Route]):
+        self.routes = routes
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            method, target, _ = request.split(b"\r\n", 1)[0].decode().split(" ", 2)
+            url = urlsplit(target)
+            route = self.routes.get(url.path)
+            if method != "GET":
+                status, content_type, body = "405 Method Not Allowed", "text/plain", ""
+            elif route is None:
+                status, content_type, body = "404 Not Found", "text/plain", ""
+            else:
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                content_type, body = route(query)
+                status = "200 OK"
+            data = body.encode()
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode()
+                + data
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug("HTTP request failed: %s", e)
+        finally:
+            writer.close()
+
+    async def start(self, host: str, port: int) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port)
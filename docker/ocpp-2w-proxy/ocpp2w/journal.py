@@ -0,0 +1,306 @@
+# Store-and-forward journal of one charger's Calls towards the primary CSMS.
+#
+# While the primary is down, Calls from the charger are appended to a memory mapped file
+# <dir>/<charger_id>.journal. Once it is back they are replayed in order, and a Call's record is
+# marked acknowledged when the CSMS answers it. Acknowledged records at the head are dropped by
+# moving the head offset; the file is reset once everything is acknowledged, and compacted
+# (live records moved to the front) once the dead space at the front can hold the rest and its
+# end marker. The file stays on disk across restarts of the proxy, and is replayed when the
+# charger is back.
+#
+# File layout (little endian):
+#   header: magic "OCJ1", head offset (uint64)
+#   record: frame length (uint32), acknowledged (uint8), frame (length bytes)
+# A zero length marks the end. A record's frame and the end marker after it are written before
+# its length, so a record torn by a crash reads as the end of the journal. Compaction points the
+# header at the live records, then copies them and their end marker into the dead space in front
+# of them without reaching that head, so it stays valid until the header points elsewhere.
+#
+# Appends and acknowledgements are memory copies into the mapping. What can block - opening,
+# growing the file and fsync - runs in the default executor.
+
+import asyncio
+import fcntl
+import logging
+import mmap
+import os
+import struct
+from typing import Optional, Union
+
+from ocpp2w.frames import decode_header
+
+logger = logging.getLogger("proxy")
+
+MAGIC = b"OCJ1"
+HEADER = struct.Struct("<4sQ")
+RECORD = struct.Struct("<IB")
+# Offset of the acknowledged flag within a record
+ACKED = 4
+
+
+class Journal:
+    __slots__ = (
+        "path",
+        "max_size",
+        "initial_size",
+        "sync_interval",
+        "fd",
+        "mm",
+        "head",
+        "tail",
+        "cursor",
+        "records",
+        "_lock",
+        "_dirty",
+        "_sync_task",
+        "pending",
+        "appended",
+        "replayed",
+        "acked",
+        "dropped",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 16 * 1024 * 1024,
+        initial_size: int = 64 * 1024,
+        sync_interval: float = 1,
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.initial_size = initial_size
+        self.sync_interval = sync_interval
+        self.fd: Optional[int] = None
+        self.mm: Optional[mmap.mmap] = None
+        # Offsets of the first live record, the end marker, and the next record to replay
+        self.head = self.tail = self.cursor = HEADER.size
+        # message id -> offsets of its unacknowledged records, oldest first
+        self.records: dict[str, list[int]] = {}
+        self._lock = asyncio.Lock()
+        self._dirty = False
+        self._sync_task: Optional[asyncio.Task] = None
+        # Counters
+        self.pending = 0
+        self.appended = 0
+        self.replayed = 0
+        self.acked = 0
+        self.dropped = 0
+
+    @property
+    def unsent(self) -> bool:
+        """Records not replayed yet on the current connection"""
+        return self.cursor < self.tail
+
+    @property
+    def size(self) -> int:
+        return self.tail - self.head
+
+    async def open(self, timeout: float = 5):
+        """Open (or create) and load the journal. Waits up to timeout for another process to
+        let go of it, e.g. a worker still closing the charger's previous session."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                await loop.run_in_executor(None, self._open)
+                break
+            except BlockingIOError:
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+        if self.pending:
+            logger.warning(
+                "%s: %d journaled Call(s) to replay", self.path, self.pending
+            )
+        if self.sync_interval:
+            self._sync_task = asyncio.create_task(self._sync())
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise
+        size = os.fstat(fd).st_size
+        if size < self.initial_size:
+            os.ftruncate(fd, self.initial_size)
+        self.fd = fd
+        self.mm = mmap.mmap(fd, 0)
+        magic, head = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or not HEADER.size <= head < len(self.mm):
+            if size:
+                logger.error("%s is not a journal. Starting afresh", self.path)
+            head = HEADER.size
+            RECORD.pack_into(self.mm, head, 0, 0)
+            HEADER.pack_into(self.mm, 0, MAGIC, head)
+        self.head = self.cursor = head
+        self._load()
+
+    def _load(self):
+        mm = self.mm
+        offset = self.head
+        while offset + RECORD.size <= len(mm):
+            length, acked = RECORD.unpack_from(mm, offset)
+            start = offset + RECORD.size
+            if length == 0 or start + length > len(mm):
+                break
+            if not acked:
+                try:
+                    _, message_id, _ = decode_header(mm[start : start + length])
+                except ValueError:
+                    logger.error(
+                        "%s: unreadable record at %d. Ignoring the rest",
+                        self.path,
+                        offset,
+                    )
+                    break
+                self.records.setdefault(message_id, []).append(offset)
+                self.pending += 1
+            offset = start + length
+        self.tail = offset
+        if self.tail + RECORD.size <= len(mm):
+            RECORD.pack_into(mm, self.tail, 0, 0)
+
+    async def append(self, message_id: str, frame: Union[str, bytes]) -> bool:
+        """Journal a Call. Returns False (and drops it) if the journal is full."""
+        data = frame.encode() if isinstance(frame, str) else frame
+        async with self._lock:
+            if self.mm is None:
+                return False  # Closed
+            needed = self.tail + RECORD.size + len(data) + RECORD.size
+            if needed > len(self.mm) and not await self._grow(needed):
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 100 == 0:
+                    logger.error(
+                        "%s full (%d bytes). %d Call(s) dropped so far",
+                        self.path,
+                        self.max_size,
+                        self.dropped,
+                    )
+                return False
+            # Acknowledgements while growing can only have moved the tail to the front
+            start = self.tail + RECORD.size
+            end = start + len(data)
+            mm = self.mm
+            mm[start:end] = data
+            RECORD.pack_into(mm, end, 0, 0)
+            RECORD.pack_into(mm, self.tail, len(data), 0)
+            self.records.setdefault(message_id, []).append(self.tail)
+            self.tail = end
+            self.pending += 1
+            self.appended += 1
+            self._dirty = True
+        return True
+
+    async def _grow(self, needed: int) -> bool:
+        if needed > self.max_size:
+            return False
+        size = len(self.mm)
+        while size < needed:
+            size *= 2
+        size = min(size, self.max_size)
+        # Extending the file can wait on the disk. The remap is cheap once the file is sized.
+        await asyncio.get_running_loop().run_in_executor(
+            None, os.ftruncate, self.fd, size
+        )
+        self.mm.resize(size)
+        return True
+
+    def rewind(self):
+        """Replay from the first unacknowledged record, e.g. after reconnecting"""
+        self.cursor = self.head
+
+    def next(self) -> Optional[bytes]:
+        """The next unacknowledged frame to replay, or None when caught up (or closed)"""
+        mm = self.mm
+        while mm is not None and self.cursor < self.tail:
+            length, acked = RECORD.unpack_from(mm, self.cursor)
+            start = self.cursor + RECORD.size
+            self.cursor = start + length
+            if not acked:
+                self.replayed += 1
+                return mm[start : start + length]
+        return None
+
+    def ack(self, message_id: str) -> bool:
+        """Mark the oldest journaled Call with message_id answered. False if there is none."""
+        offsets = self.records.get(message_id)
+        if not offsets or self.mm is None:
+            return False
+        offset = offsets.pop(0)
+        if not offsets:
+            del self.records[message_id]
+        self.mm[offset + ACKED] = 1
+        self.pending -= 1
+        self.acked += 1
+        self._dirty = True
+        self._advance()
+        return True
+
+    def _advance(self):
+        mm = self.mm
+        head = self.head
+        while head < self.tail:
+            length, acked = RECORD.unpack_from(mm, head)
+            if not acked:
+                break
+            head += RECORD.size + length
+        if head == self.head:
+            return
+        if head == self.tail:
+            # All acknowledged: start over at the front
+            head = self.tail = self.cursor = HEADER.size
+            RECORD.pack_into(mm, head, 0, 0)
+        elif self.tail - head + RECORD.size <= head - HEADER.size:
+            # Live records and their end marker fit in the dead space in front of them: compact.
+            # The header points at them first, and they are copied without reaching that head,
+            # so it stays valid until the header moves to the front.
+            HEADER.pack_into(mm, 0, MAGIC, head)
+            shift = head - HEADER.size
+            live = self.tail - head
+            mm.move(HEADER.size, head, live)
+            RECORD.pack_into(mm, HEADER.size + live, 0, 0)
+            for offsets in self.records.values():
+                offsets[:] = [offset - shift for offset in offsets]
+            self.cursor = max(self.cursor, head) - shift
+            self.tail -= shift
+            head = HEADER.size
+        self.head = head
+        HEADER.pack_into(mm, 0, MAGIC, head)
+
+    async def _sync(self):
+        """Flush to disk every sync_interval, if anything changed"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            if self._dirty:
+                self._dirty = False
+                await loop.run_in_executor(None, os.fsync, self.fd)
+
+    async def close(self):
+        """Flush and close. An empty journal is deleted."""
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+        async with self._lock:
+            if self.fd is None:
+                return
+            fd, mm = self.fd, self.mm
+            self.fd = self.mm = None
+            if self.pending == 0:
+                os.unlink(self.path)
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, os.fsync, fd)
+            mm.close()
+            os.close(fd)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "bytes": self.size,
+            "appended": self.appended,
+            "replayed": self.replayed,
+            "acked": self.acked,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,189 @@
+# Logging off the event loop.
+#
+# Log records are put on a queue by the event loop and formatted and written by a
+# QueueListener thread, so a slow stderr (or disk) never stalls the chargers. Frame log lines go
+# through FrameLogger, which checks the level first and applies per-charger sampling, a rate limit
+# and payload truncation before a record is even created. FrameCapture writes every frame to a
+# rotating JSONL file, separately from the diagnostic log. Raw frames (passthrough mode) are only
+# decoded when a record is formatted, i.e. on the listener thread.
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+from typing import Union
+
+from ocpp2w import backends
+
+frames_logger = logging.getLogger("proxy.frames")
+capture_logger = logging.getLogger("proxy.capture")
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler leaving the formatting to the listener thread when it is safe.
+
+    The stock QueueHandler formats the message in the calling thread, i.e. on the event loop.
+    A record whose arguments are all immutable (LAZY_ARGS) formats the same later, so it is
+    queued as is. Any other argument (a request, a set of tasks...) may change or be read from
+    the wrong thread by then, so such a record is formatted here, as the stock handler does.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args:
+            if isinstance(args, dict):
+                args = args.values()
+            if not all(isinstance(arg, LAZY_ARGS) for arg in args):
+                record.msg = record.getMessage()
+                record.args = None
+        return record
+
+
+def start_queue_listener(
+    logger: logging.Logger, *handlers: logging.Handler
+) -> logging.handlers.QueueListener:
+    """Move handlers (default: logger's current ones) behind a queue and a listener thread"""
+    if not handlers:
+        handlers = tuple(logger.handlers)
+        for handler in handlers:
+            logger.removeHandler(handler)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+
+class Truncated:
+    """Lazy truncation of a frame, only done if the record is formatted"""
+
+    __slots__ = ("message", "max_length")
+
+    def __init__(self, message: Union[str, bytes], max_length: int):
+        self.message = message
+        self.max_length = max_length
+
+    def __str__(self) -> str:
+        message = self.message
+        truncated = self.max_length and len(message) > self.max_length
+        head = message[: self.max_length] if truncated else message
+        if isinstance(head, bytes):
+            # Raw frame (passthrough mode). A multi-byte character cut in two shows as U+FFFD.
+            head = head.decode("utf-8", "replace")
+        if truncated:
+            unit = "bytes" if isinstance(message, bytes) else "chars"
+            return f"{head}... ({len(message)} {unit})"
+        return head
+
+
+# Log argument types formatted the same on the listener thread as on the event loop
+LAZY_ARGS = (str, bytes, int, float, type(None), Truncated)
+
+
+class FrameLogger:
+    """Frame log lines of one charger: level check, 1-in-sample sampling, token bucket rate limit"""
+
+    __slots__ = (
+        "charger_id",
+        "max_length",
+        "sample",
+        "rate",
+        "burst",
+        "capture",
+        "_seen",
+        "_tokens",
+        "_refilled",
+        "suppressed",
+    )
+
+    def __init__(
+        self,
+        charger_id: str,
+        max_length: int = 1000,
+        sample: int = 1,
+        rate: float = 0,
+        burst: int = 20,
+        capture: "FrameCapture" = None,
+    ):
+        self.charger_id = charger_id
+        self.max_length = max_length
+        self.sample = max(sample, 1)
+        self.rate = rate
+        self.burst = burst
+        self.capture = capture
+        self._seen = 0
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self.suppressed = 0
+
+    def log(self, direction: str, message: Union[str, bytes]):
+        if self.capture is not None:
+            self.capture.write(self.charger_id, direction, message)
+        if not frames_logger.isEnabledFor(logging.INFO):
+            return
+        self._seen += 1
+        if self._seen % self.sample:
+            self.suppressed += 1
+            return
+        if self.rate:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._refilled) * self.rate
+            )
+            self._refilled = now
+            if self._tokens < 1:
+                self.suppressed += 1
+                return
+            self._tokens -= 1
+        if self.suppressed:
+            frames_logger.info(
+                "%s %s : %s (%d frame(s) not logged)",
+                self.charger_id,
+                direction,
+                Truncated(message, self.max_length),
+                self.suppressed,
+            )
+            self.suppressed = 0
+        else:
+            frames_logger.info(
+                "%s %s : %s",
+                self.charger_id,
+                direction,
+                Truncated(message, self.max_length),
+            )
+
+
+class JsonlFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        charger_id, direction, message = record.args
+        if isinstance(message, bytes):
+            message = message.decode("utf-8", "replace")
+        return backends.json_dumps(
+            {
+                "ts": round(record.created, 6),
+                "charger": charger_id,
+                "dir": direction,
+                "frame": message,
+            }
+        )
+
+
+class FrameCapture:
+    """Every frame as one JSON line in a size-rotated file, written by a listener thread"""
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        handler.setFormatter(JsonlFormatter())
+        capture_logger.setLevel(logging.INFO)
+        capture_logger.propagate = False
+        self.listener = start_queue_listener(capture_logger, handler)
+
+    def write(self, charger_id: str, direction: str, message: Union[str, bytes]):
+        capture_logger.info("%s %s %s", charger_id, direction, message)
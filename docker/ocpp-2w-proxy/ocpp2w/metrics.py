@@ -0,0 +1,211 @@
+# Prometheus-style metrics.
+#
+# Counters are plain dicts keyed by the label values tuple, so updating one on every frame costs
+# a dict lookup and an integer add. Everything is rendered in the Prometheus text format when
+# scraped. Gauges (and counters owned by other objects) are read through callbacks at scrape time.
+
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Iterable
+
+# Distinct label sets kept per capped counter, against peers making up label values (OCPP
+# actions). Beyond it, new label sets are counted with their last label value as OTHER.
+MAX_SERIES = 1000
+OTHER = "other"
+
+
+def _escape(value) -> str:
+    """A label value as the text format has it: backslash, double quote and newline escaped"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), max_series: int = 0):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # Max distinct label sets (0: no limit), see MAX_SERIES
+        self.max_series = max_series
+        self.values: defaultdict[tuple, float] = defaultdict(int)
+
+    def inc(self, key: tuple = (), amount: float = 1):
+        if (
+            self.max_series
+            and key not in self.values
+            and len(self.values) >= self.max_series
+        ):
+            key = key[:-1] + (OTHER,)
+        self.values[key] += amount
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, key)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # Per key: [count per bucket (last is +Inf)..., sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, key: tuple = ()):
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        for key, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {counts[-1]}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {cumulative}"
+
+
+class Callback:
+    """Gauge or counter whose values {label values tuple: value} are read at scrape time"""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        fn: Callable[[], dict],
+        labels: tuple = (),
+        kind: str = "gauge",
+    ):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = labels
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self.fn().items():
+            yield f"{self.name}{_labels(self.labels, key)} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+# Seconds. Charger answers go from a few ms (LAN) to several seconds (cellular)
+RTT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class ProxyMetrics(Registry):
+    """The proxy's own metrics. Peers: charger, primary, secondary. Directions: rx, tx"""
+
+    def __init__(self):
+        super().__init__()
+        self.frames = self.add(
+            Counter(
+                "ocpp_proxy_frames_total",
+                "Frames received from (rx) or sent to (tx) a peer",
+                ("peer", "direction"),
+            )
+        )
+        self.bytes = self.add(
+            Counter(
+                "ocpp_proxy_frame_bytes_total",
+                "Frame payload bytes (UTF-8) received from (rx) or sent to (tx) a peer",
+                ("peer", "direction"),
+            )
+        )
+        self.calls = self.add(
+            Counter(
+                "ocpp_proxy_calls_total",
+                "OCPP Calls by originating peer and action",
+                ("peer", "action"),
+                MAX_SERIES,
+            )
+        )
+        self.calls_not_routed = self.add(
+            Counter(
+                "ocpp_proxy_calls_not_routed_total",
+                "Charger Calls not sent to an upstream, as per its routing rules",
+                ("peer", "action"),
+                MAX_SERIES,
+            )
+        )
+        self.edge_answers = self.add(
+            Counter(
+                "ocpp_proxy_edge_answers_total",
+                "Charger Calls answered by the proxy's edge cache",
+                ("action",),
+            )
+        )
+        self.rtt = self.add(
+            Histogram(
+                "ocpp_proxy_call_rtt_seconds",
+                "Time for the charger to answer a CSMS Call",
+                RTT_BUCKETS,
+                ("peer",),
+            )
+        )
+        self.unknown_ids = self.add(
+            Counter(
+                "ocpp_proxy_unknown_message_id_total",
+                "CallResults/CallErrors from the charger matching no pending CSMS Call",
+            )
+        )
+        self.reconnects = self.add(
+            Counter(
+                "ocpp_proxy_upstream_reconnects_total",
+                "Reconnects to an upstream CSMS within a charger session",
+                ("peer",),
+            )
+        )
+        self.queue_dropped = self.add(
+            Counter(
+                "ocpp_proxy_queue_dropped_total",
+                "Frames dropped from a full outbound queue",
+                ("peer",),
+            )
+        )
+        self.slow_peers = self.add(
+            Counter(
+                "ocpp_proxy_slow_peers_total",
+                "Sends to a peer that waited longer than [flow] slow_peer_timeout",
+                ("peer",),
+            )
+        )
+
+    def frame(self, peer_direction: tuple, message):
+        """Count one frame. peer_direction is e.g. ("charger", "rx"). message is the raw
+        bytes (passthrough) or the decoded text, counted as its UTF-8 length."""
+        self.frames.values[peer_direction] += 1
+        if isinstance(message, str) and not message.isascii():
+            # Not one byte per character (isascii() is a flag check, encoding is not)
+            message = message.encode()
+        self.bytes.values[peer_direction] += len(message)
@@ -0,0 +1,173 @@
+# Outbound queue towards one upstream CSMS.
+#
+# The charger read loop only puts frames on the queue; a dedicated writer task drains it onto the
+# websocket. A slow upstream therefore never holds up the charger. When the queue is full the
+# policy decides: "block" waits for room (the charger is throttled, nothing is lost), "drop_oldest"
+# throws away the oldest queued frame (the charger is never throttled). The writer sends through a
+# Sender, so an upstream slow to take the frames is spotted (see flow.py).
+#
+# There is one queue per upstream and charger, so it is kept small: a list and the futures of
+# whoever waits on it, instead of an asyncio.Queue (3 deques and an Event, about 3 KiB empty).
+# There is only ever one getter (the writer task), and putters are rare: only with policy block,
+# when the queue is full.
+
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from ocpp2w.flow import Sender
+from ocpp2w.metrics import ProxyMetrics
+
+logger = logging.getLogger("proxy")
+
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST)
+
+
+class OutboundQueue:
+    __slots__ = (
+        "name",
+        "policy",
+        "maxsize",
+        "peer",
+        "metrics",
+        "sender",
+        "on_sent",
+        "bytes",
+        "dropped",
+        "high_water",
+        "_items",
+        "_getter",
+        "_putters",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        policy: str,
+        peer: str = None,
+        metrics: ProxyMetrics = None,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(
+                f"Unknown queue policy '{policy}' (expected one of {', '.join(POLICIES)})"
+            )
+        self.name = name
+        self.policy = policy
+        self.maxsize = maxsize
+        self.peer = peer
+        self.metrics = metrics
+        self.sender = Sender(name, peer)
+        # Called with each message once sent (tracing)
+        self.on_sent: Optional[Callable] = None
+        # Length of the queued messages
+        self.bytes = 0
+        # Counters
+        self.dropped = 0
+        self.high_water = 0
+        # Queued messages, oldest first, and who waits for one to come or go
+        self._items: list = []
+        self._getter: Optional[asyncio.Future] = None
+        self._putters: Optional[list[asyncio.Future]] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._items)
+
+    @property
+    def busy(self) -> bool:
+        """Messages queued or being sent"""
+        return self.sender.waiting_since is not None or bool(self._items)
+
+    @property
+    def sent(self) -> int:
+        return self.sender.sent
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self._items)
+
+    async def put(self, message):
+        """Queue a message for the upstream. Only waits when full and policy is block."""
+        if self.full() and self.policy == POLICY_DROP_OLDEST:
+            self.bytes -= len(self._items.pop(0))
+            self.dropped += 1
+            if self.metrics is not None:
+                self.metrics.queue_dropped.inc((self.peer,))
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                logger.warning(
+                    "%s queue full. %d message(s) dropped so far",
+                    self.name,
+                    self.dropped,
+                )
+        while self.full():
+            if self._putters is None:
+                self._putters = []
+            putter = asyncio.get_running_loop().create_future()
+            self._putters.append(putter)
+            try:
+                await putter
+            except asyncio.CancelledError:
+                # Pass on a wake-up this putter will not use
+                if not self.full():
+                    self._wake_putter()
+                raise
+            finally:
+                self._putters.remove(putter)
+        self._items.append(message)
+        self.bytes += len(message)
+        if len(self._items) > self.high_water:
+            self.high_water = len(self._items)
+        if self._getter is not None and not self._getter.done():
+            self._getter.set_result(None)
+
+    async def get(self):
+        """Take the oldest message, waiting for one if the queue is empty"""
+        while not self._items:
+            self._getter = asyncio.get_running_loop().create_future()
+            try:
+                await self._getter
+            finally:
+                self._getter = None
+        message = self._items.pop(0)
+        self.bytes -= len(message)
+        self._wake_putter()
+        return message
+
+    def _wake_putter(self):
+        if self._putters:
+            for putter in self._putters:
+                if not putter.done():
+                    putter.set_result(None)
+                    break
+
+    def drain(self) -> list:
+        """Take all queued messages off the queue, e.g. when the upstream is lost"""
+        messages = self._items
+        self._items = []
+        self.bytes = 0
+        for putter in self._putters or ():
+            if not putter.done():
+                putter.set_result(None)
+        return messages
+
+    async def run(self, connection):
+        """Writer task: send queued messages on connection until it fails."""
+        while True:
+            message = await self.get()
+            await self.sender.send(connection, message)
+            if self.metrics is not None:
+                self.metrics.frame((self.peer, "tx"), message)
+            if self.on_sent is not None:
+                self.on_sent(message)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "bytes": self.bytes,
+            "high_water": self.high_water,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "slow": self.sender.slow_count,
+        }
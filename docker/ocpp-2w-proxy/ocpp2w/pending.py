@@ -0,0 +1,127 @@
+# Table of Calls sent to the charger that still wait for a CallResult/CallError.
+#
+# An OCPP caller gives up on a Call after its message timeout, so an answer coming later is of no
+# use to anybody. Entries therefore expire after ttl seconds, and the table never holds more than
+# max_size entries (oldest evicted first). A response lost on the charger link no longer leaks an
+# entry for the rest of the session.
+#
+# Entries are kept in insertion (= send time) order, so expiry only ever looks at the front of
+# the table and stays O(1) amortised per Call. A plain dict keeps that order at half the size of
+# an OrderedDict; there are two tables per charger, and they hold a handful of entries at most
+# most of the time.
+
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger("proxy")
+
+
+class PendingCalls:
+    __slots__ = (
+        "name",
+        "ttl",
+        "max_size",
+        "_sent",
+        "expired",
+        "evicted",
+        "rtt_count",
+        "rtt_total",
+        "rtt_max",
+        "_unlogged",
+        "_last_log",
+    )
+
+    # Expired/evicted entries are logged as one summary line at most this often (seconds)
+    log_interval = 60
+
+    def __init__(self, name: str, ttl: float = 30, max_size: int = 1000):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sent: dict[str, float] = {}
+        # Counters
+        self.expired = 0
+        self.evicted = 0
+        self.rtt_count = 0
+        self.rtt_total = 0.0
+        self.rtt_max = 0.0
+        self._unlogged = 0
+        self._last_log = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._sent)
+
+    def __contains__(self, message_id: str) -> bool:
+        sent = self._sent.get(message_id)
+        return sent is not None and time.monotonic() - sent <= self.ttl
+
+    def add(self, message_id: str):
+        """Record a Call sent to the charger now"""
+        now = time.monotonic()
+        self.expire(now)
+        # A reused id moves to the back with a fresh timestamp
+        self._sent.pop(message_id, None)
+        self._sent[message_id] = now
+        while len(self._sent) > self.max_size:
+            del self._sent[next(iter(self._sent))]
+            self.evicted += 1
+            self._unlogged += 1
+        self._log_dropped(now)
+
+    def pop(self, message_id: str) -> Optional[float]:
+        """Remove a Call answered by the charger. Returns its round-trip time in seconds, or None
+        if it is unknown or expired."""
+        sent = self._sent.pop(message_id, None)
+        if sent is None:
+            return None
+        rtt = time.monotonic() - sent
+        if rtt > self.ttl:
+            self.expired += 1
+            self._unlogged += 1
+            return None
+        self.rtt_count += 1
+        self.rtt_total += rtt
+        if rtt > self.rtt_max:
+            self.rtt_max = rtt
+        return rtt
+
+    def expire(self, now: Optional[float] = None):
+        """Drop entries older than ttl"""
+        if now is None:
+            now = time.monotonic()
+        deadline = now - self.ttl
+        sent = self._sent
+        while sent:
+            oldest = next(iter(sent))
+            if sent[oldest] >= deadline:
+                break
+            del sent[oldest]
+            self.expired += 1
+            self._unlogged += 1
+
+    def clear(self):
+        self._sent.clear()
+
+    def _log_dropped(self, now: float):
+        if self._unlogged and now - self._last_log >= self.log_interval:
+            logger.warning(
+                "%s %d pending call(s) expired or evicted without a response"
+                " (total expired %d, evicted %d)",
+                self.name,
+                self._unlogged,
+                self.expired,
+                self.evicted,
+            )
+            self._unlogged = 0
+            self._last_log = now
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._sent),
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "rtt_count": self.rtt_count,
+            "rtt_avg": self.rtt_total / self.rtt_count if self.rtt_count else 0.0,
+            "rtt_max": self.rtt_max,
+        }
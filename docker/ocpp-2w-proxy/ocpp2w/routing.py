@@ -0,0 +1,122 @@
+# Per-upstream routing of the charger's Calls, by OCPP action.
+#
+# [routing-primary] and [routing-secondary] map an action to a rule:
+#   forward     send every Call with this action (the default)
+#   drop        send none
+#   every N     send the first and then every Nth Call, counted per charger, upstream and action
+# The option "*" sets the rule of actions not listed. A table is a dict, so finding the rule of a
+# frame is one lookup; configparser lowercases option names, so actions are matched regardless of
+# case (the lowercasing is done once per distinct action string, then cached).
+#
+# Only Calls from the charger are routed. Answers to a CSMS's own Calls always go back to it.
+#
+# The proxy answers the Calls it does not send to the primary with an empty CallResult, which is
+# only a valid answer for the actions in EMPTY_RESULT. The primary table may only drop or thin
+# those: "*" must stay forward there, and any other action is rejected when loading the config.
+
+import logging
+from typing import Mapping
+
+logger = logging.getLogger("proxy")
+
+DEFAULT = "*"
+# Actions (OCPP 1.6 and 2.0.1) whose CallResult payload has no required field
+EMPTY_RESULT = {
+    action.lower()
+    for action in (
+        "MeterValues",
+        "StatusNotification",
+        "FirmwareStatusNotification",
+        "DiagnosticsStatusNotification",
+        "SignedFirmwareStatusNotification",
+        "SecurityEventNotification",
+        "LogStatusNotification",
+        "NotifyEvent",
+        "NotifyReport",
+        "NotifyMonitoringReport",
+        "NotifyChargingLimit",
+        "ClearedChargingLimit",
+        "NotifyDisplayMessages",
+        "NotifyCustomerInformation",
+        "PublishFirmwareStatusNotification",
+        "ReportChargingProfiles",
+        "ReservationStatusUpdate",
+    )
+}
+# Distinct action strings cached per table, against chargers making up actions
+MAX_CACHED = 1000
+
+
+class Rule:
+    """1 in every Calls forwarded: 1 forwards all, 0 drops all"""
+
+    __slots__ = ("every",)
+
+    def __init__(self, every: int):
+        self.every = every
+
+    @classmethod
+    def parse(cls, text: str) -> "Rule":
+        words = text.lower().split()
+        if words == ["forward"]:
+            return FORWARD
+        if words == ["drop"]:
+            return DROP
+        if len(words) == 2 and words[0] == "every" and words[1].isdigit():
+            every = int(words[1])
+            if every == 1:
+                return FORWARD
+            if every > 1:
+                return cls(every)
+        raise ValueError(
+            f"Unknown routing rule '{text}' (expected forward, drop or every N)"
+        )
+
+    def __str__(self) -> str:
+        return {0: "drop", 1: "forward"}.get(self.every, f"every {self.every}")
+
+
+FORWARD = Rule(1)
+DROP = Rule(0)
+
+
+class RoutingTable:
+    def __init__(self, rules: Mapping[str, Rule] = None):
+        rules = dict(rules or {})
+        self.default = rules.pop(DEFAULT, FORWARD)
+        self._rules = {action.lower(): rule for action, rule in rules.items()}
+        # Lookups by the action as received
+        self._cache: dict[str, Rule] = {}
+
+    @classmethod
+    def from_section(cls, section: Mapping[str, str]) -> "RoutingTable":
+        """Table from an ini section {action: rule}. Raises ValueError on a bad rule."""
+        return cls({action: Rule.parse(text) for action, text in section.items()})
+
+    def check_empty_result(self):
+        """Raises ValueError if a Call that an empty CallResult can't answer is not forwarded"""
+        if self.default is not FORWARD:
+            raise ValueError(
+                f"'* = {self.default}' would answer every other action with an empty CallResult"
+            )
+        for action, rule in self._rules.items():
+            if rule is not FORWARD and action not in EMPTY_RESULT:
+                raise ValueError(
+                    f"'{action} = {rule}': an empty CallResult is not a valid answer to {action}"
+                )
+
+    def __bool__(self) -> bool:
+        """False if everything is forwarded, i.e. there is nothing to look up"""
+        return bool(self._rules) or self.default is not FORWARD
+
+    def rule(self, action: str) -> Rule:
+        rule = self._cache.get(action)
+        if rule is None:
+            rule = self._rules.get(action.lower(), self.default)
+            if len(self._cache) < MAX_CACHED:
+                self._cache[action] = rule
+        return rule
+
+    def describe(self) -> str:
+        rules = [f"{action}: {rule}" for action, rule in self._rules.items()]
+        return ", ".join(rules + [f"others: {self.default}"])
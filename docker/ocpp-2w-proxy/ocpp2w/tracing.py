@@ -0,0 +1,202 @@
+# Spans of the OCPP Calls going through the proxy.
+#
+# A span opens when a Call enters the proxy, from the charger or from a CSMS, and closes when its
+# answer (CallResult or CallError) leaves the proxy towards the caller. On the way it records:
+#   queue     entering the proxy -> sent to the callee (outbound queue, journal, flow control)
+#   response  sent to the callee -> its answer back at the proxy
+#   return    answer at the proxy -> answer sent to the caller
+# A charger Call is followed to the primary, whose answer is the one the charger gets. Calls the
+# proxy answers itself (edge cache, routing) close at once, and Calls without an answer within
+# timeout seconds close as "timeout", with the stages they did reach.
+#
+# Closed spans go to a ring buffer of the last size spans. The slowest ones are also kept per
+# minute, so the slowest of the last hour are known even once the ring buffer has moved on.
+
+import collections
+import datetime
+import heapq
+import time
+from typing import Optional
+
+from ocpp2w.frames import OCPPMessageType
+
+# Minutes of slowest spans kept
+SLOWEST_MINUTES = 60
+# Outcome of a span closed by its answer, by the answer's message type
+OUTCOMES = {OCPPMessageType.CallResult: "result", OCPPMessageType.CallError: "error"}
+
+
+class Span:
+    __slots__ = (
+        "charger_id",
+        "origin",
+        "message_id",
+        "action",
+        "wall",
+        "start",
+        "forwarded",
+        "answered",
+        "end",
+        "outcome",
+    )
+
+    def __init__(self, charger_id: str, origin: str, message_id: str, action: str):
+        self.charger_id = charger_id
+        self.origin = origin
+        self.message_id = message_id
+        self.action = action
+        self.wall = time.time()
+        # time.monotonic() of each stage, None until reached
+        self.start = time.monotonic()
+        self.forwarded: Optional[float] = None
+        self.answered: Optional[float] = None
+        self.end: Optional[float] = None
+        # result, error, local, not routed, timeout or evicted
+        self.outcome: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        def ms(since: Optional[float], until: Optional[float]):
+            if since is None or until is None:
+                return None
+            return round((until - since) * 1000, 1)
+
+        return {
+            "charger": self.charger_id,
+            "origin": self.origin,
+            "id": self.message_id,
+            "action": self.action,
+            "start": datetime.datetime.fromtimestamp(
+                self.wall, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "outcome": self.outcome,
+            "queue_ms": ms(self.start, self.forwarded),
+            "response_ms": ms(self.forwarded, self.answered),
+            "return_ms": ms(self.answered, self.end if self.answered else None),
+            "total_ms": ms(self.start, self.end),
+        }
+
+
+class Tracer:
+    def __init__(
+        self,
+        size: int = 10000,
+        timeout: float = 60,
+        max_open: int = 10000,
+        keep_slowest: int = 20,
+    ):
+        self.size = size
+        self.timeout = timeout
+        self.max_open = max_open
+        self.keep_slowest = keep_slowest
+        # Open spans by (charger id, origin, message id), oldest first
+        self._open: dict[tuple, Span] = {}
+        # Closed spans, oldest first
+        self._closed: collections.deque[Span] = collections.deque(maxlen=size)
+        # Per minute: (minute, heap of the slowest (total, seq, span) closed in it)
+        self._slowest: collections.deque = collections.deque(maxlen=SLOWEST_MINUTES)
+        self._seq = 0
+        # Counters
+        self.opened = 0
+        self.timed_out = 0
+        self.evicted = 0
+
+    def open(self, charger_id: str, origin: str, message_id: str, action: str):
+        now = time.monotonic()
+        self._expire(now)
+        key = (charger_id, origin, message_id)
+        # A reused id closes the span it had
+        span = self._open.pop(key, None)
+        if span is not None:
+            self._close(span, "evicted", now)
+            self.evicted += 1
+        self._open[key] = Span(charger_id, origin, message_id, action)
+        self.opened += 1
+        while len(self._open) > self.max_open:
+            self._close(self._open.pop(next(iter(self._open))), "evicted", now)
+            self.evicted += 1
+
+    def forwarded(self, charger_id: str, origin: str, message_id: str):
+        span = self._open.get((charger_id, origin, message_id))
+        if span is not None and span.forwarded is None:
+            span.forwarded = time.monotonic()
+
+    def answered(self, charger_id: str, origin: str, message_id: str):
+        span = self._open.get((charger_id, origin, message_id))
+        if span is not None and span.answered is None:
+            span.answered = time.monotonic()
+
+    def close(self, charger_id: str, origin: str, message_id: str, outcome: str):
+        span = self._open.pop((charger_id, origin, message_id), None)
+        if span is not None:
+            self._close(span, outcome, time.monotonic())
+
+    def _expire(self, now: float):
+        deadline = now - self.timeout
+        while self._open:
+            key = next(iter(self._open))
+            span = self._open[key]
+            if span.start > deadline:
+                break
+            del self._open[key]
+            # Closed as of its deadline, not as of when it is noticed
+            self._close(span, "timeout", span.start + self.timeout)
+            self.timed_out += 1
+
+    def _close(self, span: Span, outcome: str, now: float):
+        span.end = now
+        span.outcome = outcome
+        self._closed.append(span)
+        minute = int(time.time() // 60)
+        if not self._slowest or self._slowest[-1][0] != minute:
+            self._slowest.append((minute, []))
+        heap = self._slowest[-1][1]
+        self._seq += 1
+        entry = (span.end - span.start, self._seq, span)
+        if len(heap) < self.keep_slowest:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def spans(
+        self, charger_id: str = None, action: str = None, limit: int = 100
+    ) -> list[dict]:
+        """The last closed spans, newest first"""
+        self._expire(time.monotonic())
+        found = []
+        for span in reversed(self._closed):
+            if len(found) >= limit:
+                break
+            if (charger_id is None or span.charger_id == charger_id) and (
+                action is None or span.action == action
+            ):
+                found.append(span.to_dict())
+        return found
+
+    def open_spans(self, charger_id: str = None) -> list[dict]:
+        return [
+            span.to_dict()
+            for span in self._open.values()
+            if charger_id is None or span.charger_id == charger_id
+        ]
+
+    def slowest(self, n: int = 10, window: float = 3600) -> list[dict]:
+        """The n slowest spans closed in the last window seconds (at most an hour), slowest
+        first. n is at most keep_slowest."""
+        self._expire(time.monotonic())
+        since = time.time() - window
+        entries = [
+            entry
+            for minute, heap in self._slowest
+            if minute >= since // 60
+            for entry in heap
+            if entry[2].wall + entry[0] >= since
+        ]
+        return [entry[2].to_dict() for entry in heapq.nlargest(n, entries)]
+
+    def stats(self) -> dict:
+        return {
+            "opened": self.opened,
+            "open": len(self._open),
+            "timed_out": self.timed_out,
+            "evicted": self.evicted,
+        }
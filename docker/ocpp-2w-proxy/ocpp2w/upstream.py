@@ -0,0 +1,153 @@
+# Shared connection manager for the upstream CSMS connections.
+#
+# When many chargers reconnect at once (e.g. after a proxy restart) every session opens its own
+# websocket to the CSMS. Done naively that means a fresh SSL context (CA store load) per
+# connection, a DNS lookup per connection and an unbounded number of simultaneous TLS handshakes.
+# UpstreamConnector shares one client SSL context that resumes TLS sessions, caches DNS answers and
+# caps the number of handshakes in flight.
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import ssl
+import time
+from typing import Optional
+
+import websockets
+from websockets.uri import parse_uri
+
+logger = logging.getLogger("proxy")
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """Client SSL context offering the last TLS session seen for a host when connecting again"""
+
+    def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT):
+        self.sessions: dict[str, ssl.SSLSession] = {}
+
+    def wrap_bio(
+        self, incoming, outgoing, server_side=False, server_hostname=None, session=None
+    ):
+        if session is None and not server_side:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_bio(
+            incoming,
+            outgoing,
+            server_side=server_side,
+            server_hostname=server_hostname,
+            session=session,
+        )
+
+
+class UpstreamConnector:
+    def __init__(
+        self,
+        max_handshakes: int = 20,
+        dns_ttl: float = 300,
+        ca_file: Optional[str] = None,
+    ):
+        self.ssl_context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        if ca_file:
+            self.ssl_context.load_verify_locations(cafile=ca_file)
+        else:
+            self.ssl_context.load_default_certs()
+        self.handshakes = asyncio.Semaphore(max_handshakes)
+        self.dns_ttl = dns_ttl
+        self._dns: dict[tuple[str, int], tuple[float, list[str]]] = {}
+        # Counters
+        self.connects = 0
+        self.failures = 0
+        self.resumed = 0
+        self.dns_hits = 0
+        self.dns_misses = 0
+        self.in_flight = 0
+
+    async def resolve(self, host: str, port: int) -> list[str]:
+        """Resolve host to its addresses, in getaddrinfo order, caching the answer for dns_ttl
+        seconds"""
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        key = (host, port)
+        cached = self._dns.get(key)
+        if cached and cached[0] > time.monotonic():
+            self.dns_hits += 1
+            return cached[1]
+        self.dns_misses += 1
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host, port, type=socket.SOCK_STREAM
+        )
+        addrs = list(dict.fromkeys(info[4][0] for info in infos))
+        self._dns[key] = (time.monotonic() + self.dns_ttl, addrs)
+        return addrs
+
+    async def connect(self, uri: str, **kwargs) -> websockets.ClientConnection:
+        """websockets.connect(uri, **kwargs), through the shared SSL context, DNS cache and
+        handshake limit. Like websockets.connect, each address of the host is tried in turn
+        until one takes the connection."""
+        ws_uri = parse_uri(uri)
+        key = (ws_uri.host, ws_uri.port)
+        async with self.handshakes:
+            self.in_flight += 1
+            try:
+                addrs = await self.resolve(ws_uri.host, ws_uri.port)
+                if ws_uri.secure:
+                    kwargs.setdefault("ssl", self.ssl_context)
+                for i, addr in enumerate(addrs):
+                    try:
+                        connection = await websockets.connect(
+                            uri, host=addr, port=ws_uri.port, **kwargs
+                        )
+                        break
+                    except (OSError, asyncio.TimeoutError) as e:
+                        # Unreachable address: try the next one
+                        if i + 1 < len(addrs):
+                            logger.debug(
+                                "%s: %s unreachable (%s), trying %s",
+                                ws_uri.host,
+                                addr,
+                                e,
+                                addrs[i + 1],
+                            )
+                            continue
+                        self._fail(key)
+                        raise
+                    except Exception:
+                        self._fail(key)
+                        raise
+                if i and key in self._dns:
+                    # Try the address that worked first from now on
+                    expires, cached = self._dns[key]
+                    self._dns[key] = (
+                        expires,
+                        [addr] + [a for a in cached if a != addr],
+                    )
+            finally:
+                self.in_flight -= 1
+
+        self.connects += 1
+        ssl_object = connection.transport.get_extra_info("ssl_object")
+        if ssl_object is not None:
+            if ssl_object.session_reused:
+                self.resumed += 1
+            if ssl_object.session is not None:
+                self.ssl_context.sessions[ws_uri.host] = ssl_object.session
+        return connection
+
+    def _fail(self, key: tuple[str, int]):
+        # Addresses may be stale. Look them up again next time.
+        self._dns.pop(key, None)
+        self.failures += 1
+
+    def stats(self) -> dict:
+        return {
+            "connects": self.connects,
+            "failures": self.failures,
+            "resumed": self.resumed,
+            "dns_hits": self.dns_hits,
+            "dns_misses": self.dns_misses,
+            "in_flight": self.in_flight,
+        }
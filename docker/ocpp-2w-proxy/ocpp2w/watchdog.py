@@ -0,0 +1,67 @@
+# Proxy-wide stale session detection.
+#
+# One task for all chargers instead of one sleeping task each. Sessions just stamp last_seen on
+# every charger frame (O(1)). The sweeper keeps a heap of (deadline, session) and only looks at
+# entries that are due: a session that was seen since is pushed back with its new deadline, one
+# that was not is closed. Each live session is therefore looked at about once per stale period,
+# whatever its frame rate.
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable
+
+logger = logging.getLogger("proxy")
+
+
+class StaleSweeper:
+    def __init__(
+        self,
+        stale: float,
+        interval: float,
+        on_stale: Callable[[object, float], Awaitable[None]],
+    ):
+        """on_stale(session, idle seconds) is run for sessions idle longer than stale.
+        Sessions need a last_seen (time.monotonic()) and a closed attribute."""
+        self.stale = stale
+        self.interval = interval
+        self.on_stale = on_stale
+        self._heap: list[tuple[float, int, object]] = []
+        self._seq = itertools.count()
+        self.closed_stale = 0
+
+    def watch(self, session):
+        heapq.heappush(
+            self._heap, (session.last_seen + self.stale, next(self._seq), session)
+        )
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def sweep(self, now: float = None) -> list:
+        """Return the sessions gone stale, and reschedule the ones seen since"""
+        if now is None:
+            now = time.monotonic()
+        stale = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, _, session = heapq.heappop(heap)
+            if session.closed:
+                continue
+            deadline = session.last_seen + self.stale
+            if deadline > now:
+                heapq.heappush(heap, (deadline, next(self._seq), session))
+            else:
+                stale.append(session)
+        return stale
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            for session in self.sweep(now):
+                self.closed_stale += 1
+                # Closing waits on the peers, do not hold up the sweep for it
+                asyncio.create_task(self.on_stale(session, now - session.last_seen))
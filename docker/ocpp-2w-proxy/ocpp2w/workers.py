@@ -0,0 +1,127 @@
+# Multi-process mode.
+#
+# The supervisor starts N copies of the proxy ("workers"), all listening on the same port with
+# SO_REUSEPORT so the kernel spreads the chargers over them. It also runs the session registry on
+# a Unix control socket: a worker claims a charger id when the charger connects, and the registry
+# tells the worker that held it before (if another one) to evict its old session. That keeps
+# "one session per charger" true across processes, like OCPP2WProxy.proxy_list does within one.
+#
+# Protocol: one line per message. Worker -> registry: "claim <id>", "release <id>".
+# Registry -> worker: "evict <id>".
+
+import asyncio
+import logging
+import os
+import signal
+import sys
+from typing import Callable, Optional
+
+logger = logging.getLogger("proxy")
+
+
+class SessionRegistry:
+    """Runs in the supervisor. Knows which worker holds which charger."""
+
+    def __init__(self):
+        self.owner: dict[str, asyncio.StreamWriter] = {}
+        self.evictions = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                command, _, charger_id = line.decode().strip().partition(" ")
+                if command == "claim":
+                    previous = self.owner.get(charger_id)
+                    self.owner[charger_id] = writer
+                    if previous is not None and previous is not writer:
+                        self.evictions += 1
+                        previous.write(f"evict {charger_id}\n".encode())
+                elif command == "release":
+                    if self.owner.get(charger_id) is writer:
+                        del self.owner[charger_id]
+        finally:
+            # Worker gone, and its sessions with it
+            for charger_id in [c for c, w in self.owner.items() if w is writer]:
+                del self.owner[charger_id]
+            writer.close()
+
+
+class RegistryClient:
+    """Runs in a worker. Claims/releases charger ids, and evicts on the registry's request."""
+
+    def __init__(self, path: str, on_evict: Callable[[str], None]):
+        self.path = path
+        self.on_evict = on_evict
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.task = asyncio.create_task(self._receive(reader))
+
+    async def _receive(self, reader: asyncio.StreamReader):
+        while line := await reader.readline():
+            command, _, charger_id = line.decode().strip().partition(" ")
+            if command == "evict":
+                self.on_evict(charger_id)
+        logger.error("Lost connection to the session registry")
+
+    def claim(self, charger_id: str):
+        self.writer.write(f"claim {charger_id}\n".encode())
+
+    def release(self, charger_id: str):
+        self.writer.write(f"release {charger_id}\n".encode())
+
+
+async def supervise(workers: int, worker_argv: list[str], control_socket: str):
+    """Run the session registry and keep `workers` worker processes running"""
+    registry = SessionRegistry()
+    if os.path.exists(control_socket):
+        os.unlink(control_socket)
+    server = await asyncio.start_unix_server(registry.handle, control_socket)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    # Config reloads are done by the workers
+    procs: dict[int, asyncio.subprocess.Process] = {}
+
+    def reload():
+        logger.warning("Reloading config of %d worker(s)", len(procs))
+        for proc in procs.values():
+            if proc.returncode is None:
+                proc.send_signal(signal.SIGHUP)
+
+    loop.add_signal_handler(signal.SIGHUP, reload)
+
+    async def worker(index: int):
+        argv = worker_argv + [
+            "--worker-of",
+            control_socket,
+            "--worker-index",
+            str(index),
+        ]
+        while not stopping.is_set():
+            proc = await asyncio.create_subprocess_exec(sys.executable, *argv)
+            procs[index] = proc
+            logger.warning("Worker %d started (pid %d)", index, proc.pid)
+            wait = asyncio.create_task(proc.wait())
+            stop = asyncio.create_task(stopping.wait())
+            await asyncio.wait([wait, stop], return_when=asyncio.FIRST_COMPLETED)
+            if stopping.is_set():
+                # The worker drains its sessions (SIGTERM)
+                proc.terminate()
+                await wait
+                return
+            stop.cancel()
+            logger.error("Worker %d exited with %d. Restarting", index, proc.returncode)
+            await asyncio.sleep(1)
+
+    try:
+        await asyncio.gather(*(worker(i) for i in range(workers)))
+    finally:
+        server.close()
+        if os.path.exists(control_socket):
+            os.unlink(control_socket)
@@ -0,0 +1,19 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture(scope="session")
+def proxy():
+    """The ocpp-2w-proxy.py module (not importable by name)"""
+    spec = importlib.util.spec_from_file_location(
+        "ocpp_2w_proxy", ROOT / "ocpp-2w-proxy.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,24 @@
+import asyncio
+import json
+import sys
+
+from ocpp2w import backends
+
+
+def test_fallback_without_the_optional_packages(monkeypatch):
+    # None in sys.modules makes the import raise ImportError, as if not installed
+    for name in ("orjson", "ujson", "uvloop"):
+        monkeypatch.setitem(sys.modules, name, None)
+    monkeypatch.setattr(backends, "json_loads", backends.json_loads)
+    monkeypatch.setattr(backends, "json_dumps", backends.json_dumps)
+    policy = asyncio.get_event_loop_policy()
+
+    assert backends.select_loop("auto") == "asyncio"
+    assert backends.select_loop("uvloop") == "asyncio"
+    assert asyncio.get_event_loop_policy() is policy
+
+    for name in ("auto", "orjson", "ujson"):
+        assert backends.select_json(name) == "json"
+        assert backends.json_loads is json.loads
+        assert backends.json_dumps is json.dumps
+    assert backends.json_loads('[2,"1","Heartbeat",{}]') == [2, "1", "Heartbeat", {}]
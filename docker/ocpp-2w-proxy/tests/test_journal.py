@@ -0,0 +1,94 @@
+import asyncio
+import os
+from types import MethodType, SimpleNamespace
+
+import pytest
+
+from ocpp2w.journal import HEADER, MAGIC, RECORD, Journal
+from ocpp2w.outbound import POLICY_BLOCK, OutboundQueue
+
+
+def call(message_id: str, length: int) -> str:
+    frame = f'[2,"{message_id}","DataTransfer",{{"data":""}}]'
+    return frame.replace('""', '"' + "x" * (length - len(frame)) + '"')
+
+
+def heartbeat(message_id: str) -> str:
+    return f'[2,"{message_id}","Heartbeat",{{}}]'
+
+
+def meter_values(message_id: str) -> str:
+    return f'[2,"{message_id}","MeterValues",{{"connectorId":1,"meterValue":[]}}]'
+
+
+@pytest.mark.parametrize("extra", [0, RECORD.size - 1, RECORD.size])
+def test_crash_while_compacting_keeps_the_live_records(tmp_path, extra):
+    """Two acknowledged records in front of a live one as large as both, minus extra bytes. A
+    crash while compacting, before the header moves to the front, must leave the live record
+    whole where the header points."""
+    path = str(tmp_path / "charger.journal")
+
+    async def run():
+        journal = Journal(path, sync_interval=0)
+        await journal.open()
+        live = call("live", 2 * (RECORD.size + 100) - RECORD.size - extra)
+        for message_id, frame in (
+            ("a", call("a", 100)),
+            ("b", call("b", 100)),
+            ("live", live),
+        ):
+            assert await journal.append(message_id, frame)
+        assert journal.ack("a")
+        live_offset = journal.records["live"][0]
+        assert journal.ack("b")
+        # Compacted only when the live record and its end marker fit in front of it
+        assert (journal.head == HEADER.size) == (extra >= RECORD.size)
+        # The crash: the header still points where the live record was
+        HEADER.pack_into(journal.mm, 0, MAGIC, live_offset)
+        journal.mm.close()
+        os.close(journal.fd)
+        journal.fd = journal.mm = None
+
+        journal = Journal(path, sync_interval=0)
+        await journal.open()
+        assert journal.pending == 1
+        assert journal.next() == live.encode()
+        await journal.close()
+
+    asyncio.run(run())
+
+
+def test_edge_answered_calls_are_not_journaled(proxy, tmp_path):
+    """A Call the edge cache answered must not be replayed: the primary's answer would reach
+    the charger unsolicited once edge_answered forgot the id."""
+
+    async def run():
+        journal = Journal(str(tmp_path / "charger.journal"), sync_interval=0)
+        await journal.open()
+        session = SimpleNamespace(
+            charger_id="charger",
+            journal=journal,
+            primary_connection=object(),
+            primary_queue=OutboundQueue("charger prim", 100, POLICY_BLOCK),
+            edge_answered=None,
+            boot_id=None,
+        )
+        for name in ("to_primary", "journal_queued", "track_edge"):
+            setattr(
+                session, name, MethodType(getattr(proxy.OCPP2WProxy, name), session)
+            )
+
+        # Queued while the primary is up, then the primary is lost
+        await session.to_primary("q1", "Heartbeat", heartbeat("q1"), True)
+        await session.to_primary("q2", "MeterValues", meter_values("q2"), False)
+        session.primary_connection = None
+        await session.journal_queued()
+        # Received while it is down
+        await session.to_primary("d1", "Heartbeat", heartbeat("d1"), True)
+        await session.to_primary("d2", "MeterValues", meter_values("d2"), False)
+
+        assert list(journal.records) == ["q2", "d2"]
+        assert "q1" not in session.edge_answered
+        await journal.close()
+
+    asyncio.run(run())
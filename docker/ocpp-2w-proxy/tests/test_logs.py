@@ -0,0 +1,27 @@
+import logging
+import queue
+
+from ocpp2w.logs import DeferredQueueHandler, Truncated
+
+
+def queued(*args) -> logging.LogRecord:
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.emit(logging.makeLogRecord({"msg": "%s " * len(args), "args": args}))
+    return log_queue.get_nowait()
+
+
+def test_mutable_args_are_formatted_when_queued():
+    pending = {"task-1", "task-2"}
+    record = queued(len(pending), pending)
+    pending.clear()
+    assert record.args is None
+    assert record.getMessage().startswith("2 {")
+    assert "task-1" in record.getMessage()
+
+
+def test_immutable_args_are_left_to_the_listener():
+    frame = Truncated(b'[2,"1","Heartbeat",{}]', 10)
+    record = queued("charger", 1, 0.5, None, frame)
+    assert record.args == ("charger", 1, 0.5, None, frame)
+    assert record.getMessage() == 'charger 1 0.5 None [2,"1","He... (22 bytes) '
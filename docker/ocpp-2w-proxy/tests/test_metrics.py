@@ -0,0 +1,38 @@
+from ocpp2w.metrics import MAX_SERIES, OTHER, ProxyMetrics
+
+
+def test_action_label_values_are_escaped():
+    metrics = ProxyMetrics()
+    metrics.calls.inc(("charger", 'Boot"Notification\\\nx 1'))
+    lines = [
+        line
+        for line in metrics.render().splitlines()
+        if line.startswith("ocpp_proxy_calls_total")
+    ]
+    assert lines == [
+        'ocpp_proxy_calls_total{peer="charger",action="Boot\\"Notification\\\\\\nx 1"} 1'
+    ]
+
+
+def test_made_up_actions_are_capped():
+    metrics = ProxyMetrics()
+    metrics.calls.inc(("charger", "Heartbeat"))
+    for i in range(MAX_SERIES * 3):
+        metrics.calls.inc(("charger", f"Made{i}"))
+        metrics.calls_not_routed.inc(("secondary", f"Made{i}"))
+    metrics.calls.inc(("charger", "Heartbeat"))
+
+    assert len(metrics.calls.values) == MAX_SERIES + 1
+    assert metrics.calls.values[("charger", "Heartbeat")] == 2
+    assert metrics.calls.values[("charger", OTHER)] == MAX_SERIES * 2 + 1
+    assert len(metrics.calls_not_routed.values) == MAX_SERIES + 1
+
+
+def test_frame_bytes_count_utf8_bytes():
+    metrics = ProxyMetrics()
+    text = '[2,"1","DataTransfer",{"vendorId":"Bornes Électriques"}]'
+    metrics.frame(("charger", "rx"), text)
+    metrics.frame(("charger", "rx"), text.encode())
+    metrics.frame(("charger", "rx"), '[3,"1",{}]')
+    assert metrics.frames.values[("charger", "rx")] == 3
+    assert metrics.bytes.values[("charger", "rx")] == 2 * len(text.encode()) + 10
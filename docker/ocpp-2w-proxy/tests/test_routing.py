@@ -0,0 +1,45 @@
+import configparser
+from types import SimpleNamespace
+
+import pytest
+
+from ocpp2w.routing import Rule, RoutingTable
+
+
+def test_every_n_counts_per_peer(proxy, monkeypatch):
+    monkeypatch.setattr(
+        proxy,
+        "routing",
+        {
+            "primary": RoutingTable({"MeterValues": Rule.parse("every 2")}),
+            "secondary": RoutingTable({"MeterValues": Rule.parse("every 3")}),
+        },
+    )
+    session = SimpleNamespace(route_counts={})
+    forwarded = {"primary": 0, "secondary": 0}
+    for _ in range(12):
+        for peer in forwarded:
+            forwarded[peer] += proxy.OCPP2WProxy.routed(session, peer, "MeterValues")
+    assert forwarded == {"primary": 6, "secondary": 4}
+
+
+def test_primary_rejects_drops_that_need_an_answer(proxy):
+    ini = configparser.ConfigParser()
+    ini.read_dict({"routing-primary": {"MeterValues": "every 5", "Heartbeat": "drop"}})
+    with pytest.raises(ValueError, match="heartbeat"):
+        proxy.load_routing(ini)
+
+    ini.read_dict({"routing-primary": {"Heartbeat": "forward", "*": "drop"}})
+    with pytest.raises(ValueError, match=r"\*"):
+        proxy.load_routing(ini)
+
+    ini.read_dict({"routing-primary": {"*": "forward"}})
+    tables = proxy.load_routing(ini)
+    assert tables["primary"].rule("MeterValues").every == 5
+    assert tables["primary"].rule("Heartbeat").every == 1
+
+
+def test_secondary_may_drop_anything(proxy):
+    ini = configparser.ConfigParser()
+    ini.read_dict({"routing-secondary": {"Heartbeat": "drop", "*": "every 10"}})
+    assert proxy.load_routing(ini)["secondary"].rule("BootNotification").every == 10
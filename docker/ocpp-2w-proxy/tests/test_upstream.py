@@ -0,0 +1,44 @@
+import asyncio
+import socket
+
+import websockets
+
+from ocpp2w.upstream import UpstreamConnector
+
+
+async def echo(ws):
+    async for message in ws:
+        await ws.send(message)
+
+
+def test_connect_skips_a_dead_first_address():
+    async def run():
+        async with websockets.serve(echo, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            loop = asyncio.get_running_loop()
+            lookups = []
+
+            async def getaddrinfo(host, port, **kwargs):
+                lookups.append(host)
+                # Nothing listens on 127.0.0.2: refused, like an unreachable AAAA record
+                return [
+                    (socket.AF_INET, socket.SOCK_STREAM, 6, "", (addr, port))
+                    for addr in ("127.0.0.2", "127.0.0.1")
+                ]
+
+            loop.getaddrinfo = getaddrinfo
+            connector = UpstreamConnector()
+            for _ in range(2):
+                ws = await connector.connect(f"ws://csms.test:{port}/ocpp")
+                await ws.send("ping")
+                assert await ws.recv() == "ping"
+                await ws.close()
+            assert lookups == ["csms.test"]
+            assert connector.failures == 0 and connector.connects == 2
+            # The working address is tried first from then on
+            assert await connector.resolve("csms.test", port) == [
+                "127.0.0.1",
+                "127.0.0.2",
+            ]
+
+    asyncio.run(run())
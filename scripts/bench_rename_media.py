@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""Files per second of rename_media's in-process header parser against ffprobe.
+
+Writes a corpus of synthetic MKV and MP4 files: every mix of codec (HEVC, H.264), height,
+Dolby Vision and E-AC-3 with or without JOC (Atmos), half of the MP4s with their moov after the
+media data. The media data is a sparse run of zeros of --size MB, so the corpus takes little disk
+space. Each file is then probed natively, and with ffprobe (full and fast) when it is in PATH,
+and the results are checked against what each file was written with.
+
+The files are in the page cache for every method, so this measures the cost of a probe itself
+(process spawn, parsing), not of the disk.
+"""
+
+import argparse
+import itertools
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import rename_media as rm  # noqa: E402
+
+CODECS = {"hevc": ("V_MPEGH/ISO/HEVC", b"hvc1"), "h264": ("V_MPEG4/ISO/AVC", b"avc1")}
+HEIGHTS = (720, 1080, 2160)
+WIDTHS = {720: 1280, 1080: 1920, 2160: 3840}
+
+# What a file is written with: container, codec, height, DV, JOC
+Variant = Tuple[str, str, int, bool, bool]
+
+
+class BitWriter:
+    def __init__(self):
+        self.value = 0
+        self.size = 0
+
+    def write(self, n: int, value: int):
+        self.value = (self.value << n) | (value & ((1 << n) - 1))
+        self.size += n
+
+    def bytes(self) -> bytes:
+        pad = -self.size % 8
+        return (self.value << pad).to_bytes((self.size + pad) // 8, "big")
+
+
+def eac3_frame(joc: bool) -> bytes:
+    """An E-AC-3 5.1 frame header (independent substream, 48 kHz, 6 blocks), its addbsi
+    carrying the JOC flag, padded to 1536 bytes"""
+    size = 1536
+    bits = BitWriter()
+    bits.write(16, 0x0B77)
+    bits.write(2, 0)  # strmtyp
+    bits.write(3, 0)  # substreamid
+    bits.write(11, size // 2 - 1)  # frmsiz
+    bits.write(2, 0)  # fscod
+    bits.write(2, 3)  # numblkscod
+    bits.write(3, 7)  # acmod 3/2
+    bits.write(1, 1)  # lfeon
+    bits.write(5, 16)  # bsid
+    bits.write(5, 27)  # dialnorm
+    bits.write(1, 0)  # compre
+    bits.write(1, 0)  # mixmdate
+    bits.write(1, 0)  # infomdate
+    bits.write(1, int(joc))  # addbsie
+    if joc:
+        bits.write(6, 1)  # addbsil: 2 bytes
+        bits.write(8, 1)  # flag_ec3_extension_type_a
+        bits.write(8, 16)  # complexity_index_type_a
+    header = bits.bytes()
+    return header + bytes(size - len(header))
+
+
+def dovi_record() -> bytes:
+    """A Dolby Vision configuration record: profile 8.1, level 6, RPU and base layer"""
+    profile, level = 8, 6
+    fields = [1, 0, (profile << 1) | (level >> 5), ((level & 31) << 3) | 0b101, 1 << 4]
+    return bytes(fields) + bytes(19)
+
+
+def ebml_size(n: int) -> bytes:
+    for length in range(1, 9):
+        if n < (1 << (7 * length)) - 1:
+            return ((1 << (7 * length)) | n).to_bytes(length, "big")
+    raise ValueError(f"EBML size {n} too large")
+
+
+def ebml(eid: int, *children: bytes) -> bytes:
+    payload = b"".join(children)
+    return (
+        eid.to_bytes((eid.bit_length() + 7) // 8, "big")
+        + ebml_size(len(payload))
+        + payload
+    )
+
+
+def ebml_uint(eid: int, value: int) -> bytes:
+    return ebml(eid, value.to_bytes(max((value.bit_length() + 7) // 8, 1), "big"))
+
+
+def write_mkv(path: Path, codec: str, height: int, dv: bool, joc: bool, pad: int):
+    header = ebml(
+        rm.MKV.EBML,
+        ebml_uint(0x4286, 1),  # EBMLVersion
+        ebml_uint(0x42F7, 1),  # EBMLReadVersion
+        ebml_uint(0x42F2, 4),  # EBMLMaxIDLength
+        ebml_uint(0x42F3, 8),  # EBMLMaxSizeLength
+        ebml(rm.MKV.DOC_TYPE, b"matroska"),
+        ebml_uint(0x4287, 4),  # DocTypeVersion
+        ebml_uint(0x4285, 2),  # DocTypeReadVersion
+    )
+    info = ebml(
+        0x1549A966,
+        ebml_uint(0x2AD7B1, 1000000),  # TimestampScale
+        ebml(0x4D80, b"bench_rename_media"),  # MuxingApp
+        ebml(0x5741, b"bench_rename_media"),  # WritingApp
+    )
+    video = [
+        ebml_uint(rm.MKV.TRACK_NUMBER, 1),
+        ebml_uint(0x73C5, 1),  # TrackUID
+        ebml_uint(rm.MKV.TRACK_TYPE, 1),
+        ebml(rm.MKV.CODEC_ID, CODECS[codec][0].encode()),
+        ebml(
+            rm.MKV.VIDEO,
+            ebml_uint(0xB0, WIDTHS[height]),  # PixelWidth
+            ebml_uint(rm.MKV.PIXEL_HEIGHT, height),
+        ),
+    ]
+    if dv:
+        video.append(
+            ebml(
+                rm.MKV.BLOCK_ADDITION_MAPPING,
+                ebml(rm.MKV.BLOCK_ADD_ID_TYPE, b"dvcC"),
+                ebml(0x41ED, dovi_record()),  # BlockAddIDExtraData
+            )
+        )
+    audio = [
+        ebml_uint(rm.MKV.TRACK_NUMBER, 2),
+        ebml_uint(0x73C5, 2),
+        ebml_uint(rm.MKV.TRACK_TYPE, 2),
+        ebml(rm.MKV.CODEC_ID, b"A_EAC3"),
+        ebml(
+            0xE1,  # Audio
+            ebml(0xB5, struct.pack(">d", 48000.0)),  # SamplingFrequency
+            ebml_uint(0x9F, 6),  # Channels
+        ),
+    ]
+    tracks = ebml(
+        rm.MKV.TRACKS,
+        ebml(rm.MKV.TRACK_ENTRY, *video),
+        ebml(rm.MKV.TRACK_ENTRY, *audio),
+    )
+    cluster = ebml(
+        rm.MKV.CLUSTER,
+        ebml_uint(0xE7, 0),  # Timestamp
+        # Track 1 keyframe, then track 2, neither laced
+        ebml(rm.MKV.SIMPLE_BLOCK, b"\x81\x00\x00\x80" + bytes(64)),
+        ebml(rm.MKV.SIMPLE_BLOCK, b"\x82\x00\x00\x80" + eac3_frame(joc)),
+    )
+    # The media data: a Void element over pad sparse bytes
+    void = b"\xec" + ebml_size(pad)
+    body = info + tracks + cluster + void
+    segment = rm.MKV.SEGMENT.to_bytes(4, "big") + ebml_size(len(body) + pad)
+    with open(path, "wb") as f:
+        f.write(header + segment + body)
+        f.truncate(f.tell() + pad)
+
+
+def box(kind: bytes, *children: bytes) -> bytes:
+    payload = b"".join(children)
+    return struct.pack(">I", 8 + len(payload)) + kind + payload
+
+
+def full_box(kind: bytes, version: int, flags: int, *children: bytes) -> bytes:
+    return box(kind, struct.pack(">I", (version << 24) | flags), *children)
+
+
+MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+def mp4_trak(track_id: int, handler: bytes, entry: bytes, height: int = 0) -> bytes:
+    width = WIDTHS.get(height, 0)
+    tkhd = full_box(
+        b"tkhd",
+        0,
+        3,
+        struct.pack(">IIIII", 0, 0, track_id, 0, 0),
+        bytes(8),
+        struct.pack(">hhhH", 0, 0, 0 if height else 0x100, 0),
+        MATRIX,
+        struct.pack(">II", width << 16, height << 16),
+    )
+    mdhd = full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, 1000, 0, 0x55C4, 0))
+    name = b"VideoHandler\0" if height else b"SoundHandler\0"
+    hdlr = full_box(b"hdlr", 0, 0, struct.pack(">I", 0), handler, bytes(12), name)
+    header = (
+        full_box(b"vmhd", 0, 1, bytes(8))
+        if height
+        else full_box(b"smhd", 0, 0, bytes(4))
+    )
+    dinf = box(
+        b"dinf", full_box(b"dref", 0, 0, struct.pack(">I", 1), full_box(b"url ", 0, 1))
+    )
+    stbl = box(
+        b"stbl",
+        full_box(b"stsd", 0, 0, struct.pack(">I", 1), entry),
+        full_box(b"stts", 0, 0, struct.pack(">I", 0)),
+        full_box(b"stsc", 0, 0, struct.pack(">I", 0)),
+        full_box(b"stsz", 0, 0, struct.pack(">II", 0, 0)),
+        full_box(b"stco", 0, 0, struct.pack(">I", 0)),
+    )
+    return box(
+        b"trak", tkhd, box(b"mdia", mdhd, hdlr, box(b"minf", header, dinf, stbl))
+    )
+
+
+def write_mp4(
+    path: Path, codec: str, height: int, dv: bool, joc: bool, pad: int, moov_last: bool
+):
+    fourcc = CODECS[codec][1]
+    if codec == "hevc":
+        config = box(b"hvcC", bytes([1]) + bytes(20) + bytes([0x0F, 0]))
+    else:
+        config = box(b"avcC", bytes([1, 100, 0, 40, 0xFF, 0xE0, 0]))
+    video = box(
+        fourcc,
+        bytes(6),
+        struct.pack(">H", 1),  # data_reference_index
+        bytes(16),
+        struct.pack(">HHIII", WIDTHS[height], height, 0x480000, 0x480000, 0),
+        struct.pack(">H", 1),  # frame_count
+        bytes(32),  # compressorname
+        struct.pack(">Hh", 0x18, -1),
+        config,
+        box(b"dvcC", dovi_record()) if dv else b"",
+    )
+    dec3 = BitWriter()
+    dec3.write(13, 640)  # data_rate
+    dec3.write(3, 0)  # num_ind_sub - 1
+    dec3.write(2, 0)  # fscod
+    dec3.write(5, 16)  # bsid
+    dec3.write(2, 0)  # reserved, asvc
+    dec3.write(3, 0)  # bsmod
+    dec3.write(3, 7)  # acmod
+    dec3.write(1, 1)  # lfeon
+    dec3.write(3, 0)  # reserved
+    dec3.write(4, 0)  # num_dep_sub
+    dec3.write(1, 0)  # reserved
+    if joc:
+        dec3.write(7, 0)
+        dec3.write(1, 1)  # flag_ec3_extension_type_a
+        dec3.write(8, 16)  # complexity_index_type_a
+    audio = box(
+        b"ec-3",
+        bytes(6),
+        struct.pack(">H", 1),
+        bytes(8),
+        struct.pack(">HHHHI", 6, 16, 0, 0, 48000 << 16),
+        box(b"dec3", dec3.bytes()),
+    )
+    mvhd = full_box(
+        b"mvhd",
+        0,
+        0,
+        struct.pack(">IIIIIH", 0, 0, 1000, 0, 0x10000, 0x100),
+        bytes(10),
+        MATRIX,
+        bytes(24),
+        struct.pack(">I", 3),
+    )
+    moov = box(
+        b"moov",
+        mvhd,
+        mp4_trak(1, b"vide", video, height),
+        mp4_trak(2, b"soun", audio),
+    )
+    ftyp = box(b"ftyp", b"isom", struct.pack(">I", 512), b"isomiso2mp41")
+    mdat = struct.pack(">I", 8 + pad) + b"mdat"
+    with open(path, "wb") as f:
+        if moov_last:
+            f.write(ftyp + mdat)
+            f.truncate(f.tell() + pad)
+            f.seek(0, 2)
+            f.write(moov)
+        else:
+            f.write(ftyp + moov + mdat)
+            f.truncate(f.tell() + pad)
+
+
+def write_corpus(root: Path, files: int, pad: int) -> List[Tuple[Path, Variant]]:
+    variants = [
+        (container, codec, height, dv, joc)
+        for codec, height, dv, joc, container in itertools.product(
+            CODECS, HEIGHTS, (False, True), (False, True), ("mkv", "mp4")
+        )
+    ]
+    corpus = []
+    for i in range(files):
+        variant = variants[i % len(variants)]
+        container, codec, height, dv, joc = variant
+        path = root / f"bench.{i:05d}.{container}"
+        if container == "mkv":
+            write_mkv(path, codec, height, dv, joc, pad)
+        else:
+            write_mp4(path, codec, height, dv, joc, pad, moov_last=bool(i // 2 % 2))
+        corpus.append((path, variant))
+    return corpus
+
+
+def native_probe(path: Path) -> Tuple[Optional[dict], Optional[int]]:
+    return rm.parse_header(path)
+
+
+def ffprobe_full(path: Path) -> Tuple[Optional[dict], Optional[int]]:
+    return rm.run_probe(rm.probe_command(path))
+
+
+def ffprobe_fast(path: Path) -> Tuple[Optional[dict], Optional[int]]:
+    return rm.run_probe(rm.probe_command(path, fast=True))
+
+
+def bench(
+    name: str,
+    probe: Callable[[Path], Tuple[Optional[dict], Optional[int]]],
+    corpus: List[Tuple[Path, Variant]],
+    repeat: int,
+):
+    failed = wrong = 0
+    bytes_read = 0
+    start = time.monotonic()
+    for _ in range(repeat):
+        for path, (_, codec, height, dv, joc) in corpus:
+            ff, read = probe(path)
+            bytes_read += read or 0
+            if ff is None:
+                failed += 1
+            elif rm.extract_metadata(ff) != (height, rm.CODEC_MAP[codec], dv, joc):
+                wrong += 1
+    elapsed = time.monotonic() - start
+    probes = len(corpus) * repeat
+    print(
+        f"{name:<14} {probes / elapsed:10.1f} files/s "
+        f"{elapsed / probes * 1000:8.2f} ms/file "
+        f"{bytes_read / probes / 1024:9.1f} KiB read/file "
+        f"{failed:5d} failed {wrong:5d} wrong"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the in-process MKV/MP4 header parser with ffprobe on synthetic files."
+    )
+    parser.add_argument(
+        "--files", type=int, default=240, help="Files in the corpus (default: 240)"
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=1024,
+        help="Media data per file in MB, sparse (default: 1024)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Passes over the corpus per method (default: 3)",
+    )
+    parser.add_argument(
+        "--dir",
+        help="Write the corpus here and keep it (default: a temporary directory)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_rename_media.") as tmp:
+        root = Path(args.dir or tmp)
+        root.mkdir(parents=True, exist_ok=True)
+        corpus = write_corpus(root, args.files, args.size * 1_000_000)
+        print(
+            f"{len(corpus)} files of {args.size} MB in {root}, {args.repeat} pass(es)"
+        )
+        bench("native", native_probe, corpus, args.repeat)
+        if shutil.which("ffprobe"):
+            bench("ffprobe", ffprobe_full, corpus, args.repeat)
+            bench("ffprobe fast", ffprobe_fast, corpus, args.repeat)
+        else:
+            print("ffprobe not found in PATH, skipping it")
+
+
+if __name__ == "__main__":
+    main()
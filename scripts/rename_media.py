@@ -1,13 +1,20 @@
 #!/usr/bin/env python3
 import argparse
+import fnmatch
 import json
+import mmap
 import os
 import re
 import shutil
+import sqlite3
 import subprocess
 import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Callable, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
 
 VIDEO_EXTS = {".mkv", ".mp4", ".m4v", ".mov", ".avi", ".ts", ".m2ts"}
 
@@ -28,10 +35,89 @@ TOKEN_PATTERN = re.compile(
 SOURCE_TAG_PATTERN = re.compile(
     r"\b(HDTV|BluRay|Blu-ray|Bluray|WEB-DL|WEBDL|WEBRip|WEB)\b", re.IGNORECASE
 )
+# Skip obvious samples
+SAMPLE_PATTERN = re.compile(r"sample", re.IGNORECASE)
 
 # Debug printing helper
 DEBUG = False
 
+# Probes running at once on one mount (device), whatever --jobs is: a NAS disk or a network
+# mount slows down for everybody when it gets too many readers
+DEFAULT_MOUNT_JOBS = 4
+# Directories not walked into, by name (comma-separated fnmatch patterns): NAS thumbnails and
+# recycle bins
+DEFAULT_PRUNE = "@eaDir,.@__thumb,#recycle,$RECYCLE.BIN,.Trash-*"
+# Files queued for probing ahead of the oldest unfinished one, per job
+LOOKAHEAD_PER_JOB = 8
+# Seconds between progress lines
+PROGRESS_INTERVAL = 5.0
+# Probe cache location, and how many changes to it are written at once
+DEFAULT_CACHE = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "rename_media"
+    / "probes.sqlite3"
+)
+CACHE_SAVE_EVERY = 500
+
+# Fast probe: only the stream fields extract_metadata reads, from the start of the file
+FAST_ENTRIES = (
+    "stream=codec_type,codec_name,codec_long_name,profile,height"
+    ":stream_tags:stream_side_data=side_data_type"
+)
+FAST_PROBESIZE = 2_000_000
+FAST_ANALYZEDURATION = 2_000_000
+
+# Containers whose headers are read in-process instead of by ffprobe (see parse_header)
+NATIVE_EXTS = {".mkv", ".mp4", ".m4v"}
+# Bytes of Matroska clusters searched for the first frame of each E-AC-3 track
+NATIVE_CLUSTER_SCAN = 4_000_000
+# ffprobe's profile of an E-AC-3 stream with Joint Object Coding
+EAC3_ATMOS_PROFILE = "Dolby Digital Plus + Dolby Atmos"
+# ffprobe codec_name of Matroska CodecIDs, and of ISO-BMFF sample entries
+MKV_CODECS = {
+    "V_MPEGH/ISO/HEVC": "hevc",
+    "V_MPEG4/ISO/AVC": "h264",
+    "V_AV1": "av1",
+    "V_VP9": "vp9",
+    "V_VP8": "vp8",
+    "V_MPEG4/ISO/ASP": "mpeg4",
+    "V_MPEG2": "mpeg2video",
+    "A_EAC3": "eac3",
+    "A_AC3": "ac3",
+    "A_TRUEHD": "truehd",
+    "A_DTS": "dts",
+    "A_OPUS": "opus",
+    "A_FLAC": "flac",
+}
+MP4_CODECS = {
+    b"avc1": "h264",
+    b"avc3": "h264",
+    b"dva1": "h264",
+    b"dvav": "h264",
+    b"hvc1": "hevc",
+    b"hev1": "hevc",
+    b"dvh1": "hevc",
+    b"dvhe": "hevc",
+    b"av01": "av1",
+    b"vp09": "vp9",
+    b"mp4v": "mpeg4",
+    b"ec-3": "eac3",
+    b"ac-3": "ac3",
+    b"mlpa": "truehd",
+    b"mp4a": "aac",
+    b"Opus": "opus",
+    b"fLaC": "flac",
+}
+# Dolby Vision sample entries and configuration boxes (ISO-BMFF), which are also the
+# BlockAddIDType of a Matroska BlockAdditionMapping
+DV_ENTRIES = {b"dva1", b"dvav", b"dvh1", b"dvhe"}
+DV_CONFIGS = {b"dvcC", b"dvvC", b"dvwC"}
+# The same as the integers a BlockAddIDType holds
+DV_CONFIG_IDS = {int.from_bytes(config, "big") for config in DV_CONFIGS}
+
+# What a probe yields: height, codec, DV, ATMOS
+Metadata = Tuple[Optional[int], Optional[str], bool, bool]
+
 
 # ANSI color codes
 class Colors:
@@ -61,29 +147,866 @@ def dprint(*args, **kwargs):
         print(colorize("DEBUG:", Colors.CYAN), *args, **kwargs)
 
 
-def run_ffprobe(path: Path) -> Optional[dict]:
-    try:
-        # Capture streams and format with side data and tags
-        cmd = [
-            "ffprobe",
-            "-v",
-            "error",
-            "-print_format",
-            "json",
-            "-show_streams",
-            "-show_format",
-            str(path),
+def probe_command(
+    path: Path,
+    fast: bool = False,
+    probesize: int = FAST_PROBESIZE,
+    analyzeduration: int = FAST_ANALYZEDURATION,
+) -> List[str]:
+    """ffprobe command line for path. A fast probe only asks for the stream fields
+    extract_metadata reads, and reads at most probesize bytes / analyzeduration microseconds of
+    the file to find them."""
+    cmd = ["ffprobe", "-v", "error", "-print_format", "json"]
+    if fast:
+        cmd += [
+            "-probesize",
+            str(probesize),
+            "-analyzeduration",
+            str(analyzeduration),
+            "-show_entries",
+            FAST_ENTRIES,
         ]
-        dprint("Running", " ".join(cmd))
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
+    else:
+        # Capture streams and format with side data and tags
+        cmd += ["-show_streams", "-show_format"]
+    return cmd + [str(path)]
+
+
+def run_probe(cmd: List[str]) -> Tuple[Optional[dict], Optional[int]]:
+    """Run an ffprobe command. Returns its output, None if it fails, and the bytes it read
+    (from /proc/<pid>/io, None where that is not available)."""
+    dprint("Running", " ".join(cmd))
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except FileNotFoundError:
+        return None, None
+    with proc:
+        out = proc.stdout.read()
+        bytes_read = None
+        try:
+            # Wait for it to exit, but leave it unreaped so its counters can be read
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            with open(f"/proc/{proc.pid}/io") as f:
+                for line in f:
+                    if line.startswith("rchar:"):
+                        bytes_read = int(line.split()[1])
+        except (AttributeError, OSError, ValueError):
+            pass
+        returncode = proc.wait()
+    if returncode != 0:
+        return None, bytes_read
+    try:
+        return json.loads(out.decode()), bytes_read
+    except ValueError:
+        return None, bytes_read
+
+
+def run_ffprobe(path: Path) -> Optional[dict]:
+    return run_probe(probe_command(path))[0]
+
+
+def needs_full_probe(ff: dict) -> bool:
+    """Whether a fast probe left something extract_metadata needs undecided: no video stream,
+    height or codec found, or a TrueHD stream without a profile. ffprobe gives E-AC-3 a profile
+    only for JOC (Atmos), so an E-AC-3 stream without one is plain DD+; TrueHD's Atmos profile
+    comes from its substreams, which a short probe may not reach.
+    """
+    streams = ff.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    if not video or not video.get("height") or not video.get("codec_name"):
+        return True
+    return any(
+        s.get("codec_type") == "audio"
+        and s.get("codec_name") == "truehd"
+        and not s.get("profile")
+        for s in streams
+    )
+
+
+class MKV:
+    """Matroska element ids"""
+
+    EBML = 0x1A45DFA3
+    DOC_TYPE = 0x4282
+    SEGMENT = 0x18538067
+    SEEK_HEAD = 0x114D9B74
+    SEEK = 0x4DBB
+    SEEK_ID = 0x53AB
+    SEEK_POSITION = 0x53AC
+    TRACKS = 0x1654AE6B
+    TRACK_ENTRY = 0xAE
+    TRACK_NUMBER = 0xD7
+    TRACK_TYPE = 0x83
+    CODEC_ID = 0x86
+    NAME = 0x536E
+    VIDEO = 0xE0
+    PIXEL_HEIGHT = 0xBA
+    BLOCK_ADDITION_MAPPING = 0x41E4
+    BLOCK_ADD_ID_TYPE = 0x41E7
+    CONTENT_ENCODINGS = 0x6D80
+    CLUSTER = 0x1F43B675
+    SIMPLE_BLOCK = 0xA3
+    BLOCK_GROUP = 0xA0
+    BLOCK = 0xA1
+
+
+class HeaderMap:
+    """A file mapped read-only, and the pages of it read so far"""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.map)
+        self.pages: Set[int] = set()
+
+    def read(self, start: int, end: int) -> bytes:
+        end = min(end, self.size)
+        if start >= end:
+            raise ValueError(f"read past the end of the file at {start}")
+        self.pages.update(range(start // mmap.PAGESIZE, (end - 1) // mmap.PAGESIZE + 1))
+        return self.map[start:end]
+
+    def uint(self, start: int, end: int) -> int:
+        return int.from_bytes(self.read(start, end), "big")
+
+    @property
+    def bytes_read(self) -> int:
+        return len(self.pages) * mmap.PAGESIZE
+
+    def close(self):
+        self.map.close()
+
+
+class BitReader:
+    """Big-endian bit fields of a byte string"""
+
+    def __init__(self, data: bytes):
+        self.value = int.from_bytes(data, "big")
+        self.size = len(data) * 8
+        self.pos = 0
+
+    def read(self, n: int) -> int:
+        self.skip(n)
+        return (self.value >> (self.size - self.pos)) & ((1 << n) - 1)
+
+    def skip(self, n: int):
+        self.pos += n
+        if self.pos > self.size:
+            raise ValueError("bit field past the end of the data")
+
+    def remaining(self) -> int:
+        return self.size - self.pos
+
+
+def eac3_joc(frame: bytes) -> Optional[bool]:
+    """Whether an E-AC-3 frame signals Joint Object Coding (Atmos): flag_ec3_extension_type_a,
+    the last bit of the first byte of its additional bitstream info (ETSI TS 102 366 E.1.2).
+    False for an AC-3 frame, None if frame is neither."""
+    if frame[:2] != b"\x0b\x77":
+        return None
+    bits = BitReader(frame[2:128])
+    strmtyp = bits.read(2)
+    bits.skip(3 + 11)  # substreamid, frmsiz
+    fscod = bits.read(2)
+    # numblkscod, or fscod2 when fscod is 3 (always six blocks then)
+    numblkscod = bits.read(2)
+    if fscod == 3:
+        numblkscod = 3
+    acmod = bits.read(3)
+    lfeon = bits.read(1)
+    bsid = bits.read(5)
+    if bsid <= 10:
+        return False
+    if bsid > 16:
+        return None
+    # Dual mono (acmod 0) has its fields twice
+    programs = 1 if acmod else 2
+    for _ in range(programs):
+        bits.skip(5)  # dialnorm
+        if bits.read(1):
+            bits.skip(8)  # compr
+    if strmtyp == 1 and bits.read(1):
+        bits.skip(16)  # chanmap
+    if bits.read(1):  # mixmdate
+        if acmod > 2:
+            bits.skip(2)  # dmixmod
+            if acmod & 1:
+                bits.skip(6)  # center mix levels
+            if acmod & 4:
+                bits.skip(6)  # surround mix levels
+        if lfeon and bits.read(1):
+            bits.skip(5)  # lfemixlevcod
+        if strmtyp == 0:
+            for _ in range(programs):
+                if bits.read(1):
+                    bits.skip(6)  # pgmscl
+            if bits.read(1):
+                bits.skip(6)  # extpgmscl
+            mixdef = bits.read(2)
+            if mixdef == 1:
+                bits.skip(5)
+            elif mixdef == 2:
+                bits.skip(12)
+            elif mixdef == 3:
+                bits.skip((bits.read(5) + 2) * 8)
+            if acmod < 2:
+                for _ in range(programs):
+                    if bits.read(1):
+                        bits.skip(14)  # panmean, paninfo
+            if bits.read(1):  # frmmixcfginfoe
+                blocks = (1, 2, 3, 6)[numblkscod]
+                for _ in range(blocks):
+                    if blocks == 1 or bits.read(1):
+                        bits.skip(5)  # blkmixcfginfo
+    if bits.read(1):  # infomdate
+        bits.skip(3 + 1 + 1)  # bsmod, copyrightb, origbs
+        if acmod == 2:
+            bits.skip(4)  # dsurmod, dheadphonmod
+        if acmod >= 6:
+            bits.skip(2)  # dsurexmod
+        for _ in range(programs):
+            if bits.read(1):
+                bits.skip(8)  # mixlevel, roomtyp, adconvtyp
+        if fscod < 3:
+            bits.skip(1)  # sourcefscod
+    if strmtyp == 0 and numblkscod != 3:
+        bits.skip(1)  # convsync
+    if strmtyp == 2 and (numblkscod == 3 or bits.read(1)):
+        bits.skip(6)  # frmsizecod
+    if bits.read(1):  # addbsie
+        bits.skip(6)  # addbsil
+        return bool(bits.read(8) & 1)
+    return False
+
+
+def dec3_joc(data: bytes) -> bool:
+    """Whether an ISO-BMFF dec3 box (EC3SpecificBox, ETSI TS 102 366 F.6) signals Joint Object
+    Coding: flag_ec3_extension_type_a, after the independent substreams"""
+    bits = BitReader(data)
+    bits.skip(13)  # data_rate
+    for _ in range(bits.read(3) + 1):
+        # fscod, bsid, reserved, asvc, bsmod, acmod, lfeon, reserved
+        bits.skip(2 + 5 + 1 + 1 + 3 + 3 + 1 + 3)
+        bits.skip(9 if bits.read(4) else 1)  # chan_loc if num_dep_sub, else reserved
+    if bits.remaining() < 16:
+        return False
+    bits.skip(7)
+    return bool(bits.read(1))
+
+
+def ebml_vint(
+    m: HeaderMap, pos: int, marker: bool = False
+) -> Tuple[Optional[int], int]:
+    """EBML variable size integer at pos: its value (None for an unknown size) and length.
+    Element ids keep their length marker."""
+    head = m.read(pos, pos + 8)
+    length = 9 - head[0].bit_length()
+    if length > 8 or length > len(head):
+        raise ValueError(f"bad EBML integer at {pos}")
+    value = int.from_bytes(head[:length], "big")
+    if marker:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    if value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def mkv_elements(
+    m: HeaderMap, start: int, end: int
+) -> Iterator[Tuple[int, int, int, int]]:
+    """(id, position, data start, data end) of the EBML elements from start to end. An element
+    of unknown size runs to end."""
+    pos = start
+    while pos < end:
+        eid, n = ebml_vint(m, pos, marker=True)
+        size, k = ebml_vint(m, pos + n)
+        data = pos + n + k
+        data_end = end if size is None else min(data + size, end)
+        yield eid, pos, data, data_end
+        pos = data_end
+
+
+def mkv_block_frame(m: HeaderMap, start: int) -> Tuple[int, int]:
+    """Track number of a (Simple)Block, and where its first frame starts"""
+    track, n = ebml_vint(m, start)
+    pos = start + n + 2  # timecode
+    lacing = (m.read(pos, pos + 1)[0] >> 1) & 3
+    pos += 1
+    if lacing:
+        frames = m.read(pos, pos + 1)[0] + 1
+        pos += 1
+        if lacing == 1:  # Xiph: sizes as runs of 255
+            for _ in range(frames - 1):
+                while m.read(pos, pos + 1)[0] == 255:
+                    pos += 1
+                pos += 1
+        elif lacing == 3:  # EBML: first size, then differences
+            for _ in range(frames - 1):
+                pos += ebml_vint(m, pos)[1]
+    return track, pos
+
+
+def mkv_first_frames(m: HeaderMap, start: int, end: int, tracks: Set[int]) -> dict:
+    """First bytes of the first frame of each of tracks, from the clusters at start"""
+    frames = {}
+    limit = start + NATIVE_CLUSTER_SCAN
+    for eid, pos, data, data_end in mkv_elements(m, start, end):
+        if pos >= limit:
+            break
+        if eid != MKV.CLUSTER:
+            continue
+        for cid, cpos, block, block_end in mkv_elements(m, data, data_end):
+            if cpos >= limit:
+                break
+            if cid == MKV.BLOCK_GROUP:
+                block, block_end = next(
+                    (
+                        (d, e)
+                        for i, _, d, e in mkv_elements(m, block, block_end)
+                        if i == MKV.BLOCK
+                    ),
+                    (None, None),
+                )
+            elif cid != MKV.SIMPLE_BLOCK:
+                continue
+            if block is None:
+                continue
+            track, frame = mkv_block_frame(m, block)
+            if track in tracks and track not in frames:
+                frames[track] = m.read(frame, min(block_end, frame + 256))
+                if len(frames) == len(tracks):
+                    return frames
+    return frames
+
+
+def parse_matroska(m: HeaderMap) -> Optional[List[dict]]:
+    """Streams of a Matroska file, from its Tracks. The first frame of E-AC-3 tracks is read for
+    their JOC flag."""
+    eid, _, start, end = next(mkv_elements(m, 0, m.size))
+    if eid != MKV.EBML:
+        return None
+    doc_type = b""
+    for cid, _, data, data_end in mkv_elements(m, start, end):
+        if cid == MKV.DOC_TYPE:
+            doc_type = m.read(data, data_end).rstrip(b"\0")
+    if doc_type not in (b"matroska", b"webm"):
+        return None
+    segment = next(
+        (e for e in mkv_elements(m, end, m.size) if e[0] == MKV.SEGMENT), None
+    )
+    if segment is None:
+        return None
+    segment_start, segment_end = segment[2], segment[3]
+
+    # Tracks come before the first cluster, or else the seek head says where they are
+    tracks = cluster = None
+    seeks = {}
+    for eid, pos, data, data_end in mkv_elements(m, segment_start, segment_end):
+        if eid == MKV.TRACKS:
+            tracks = (data, data_end)
+        elif eid == MKV.SEEK_HEAD:
+            for sid, _, seek, seek_end in mkv_elements(m, data, data_end):
+                if sid != MKV.SEEK:
+                    continue
+                fields = {i: (d, e) for i, _, d, e in mkv_elements(m, seek, seek_end)}
+                if MKV.SEEK_ID in fields and MKV.SEEK_POSITION in fields:
+                    seeks[m.uint(*fields[MKV.SEEK_ID])] = m.uint(
+                        *fields[MKV.SEEK_POSITION]
+                    )
+        elif eid == MKV.CLUSTER:
+            cluster = pos
+            break
+    if tracks is None and MKV.TRACKS in seeks:
+        eid, _, data, data_end = next(
+            mkv_elements(m, segment_start + seeks[MKV.TRACKS], segment_end)
+        )
+        if eid == MKV.TRACKS:
+            tracks = (data, data_end)
+    if tracks is None:
+        return None
+
+    streams = []
+    # E-AC-3 streams by track number, whose Atmos flag is in their frames
+    eac3 = {}
+    for eid, _, entry, entry_end in mkv_elements(m, *tracks):
+        if eid != MKV.TRACK_ENTRY:
+            continue
+        number = kind = height = None
+        codec_id = name = ""
+        dv = encoded = False
+        for cid, _, data, data_end in mkv_elements(m, entry, entry_end):
+            if cid == MKV.TRACK_NUMBER:
+                number = m.uint(data, data_end)
+            elif cid == MKV.TRACK_TYPE:
+                kind = m.uint(data, data_end)
+            elif cid == MKV.CODEC_ID:
+                codec_id = (
+                    m.read(data, data_end).rstrip(b"\0").decode("ascii", "replace")
+                )
+            elif cid == MKV.NAME:
+                name = m.read(data, data_end).decode("utf-8", "replace")
+            elif cid == MKV.VIDEO:
+                for vid, _, vdata, vdata_end in mkv_elements(m, data, data_end):
+                    if vid == MKV.PIXEL_HEIGHT:
+                        height = m.uint(vdata, vdata_end)
+            elif cid == MKV.BLOCK_ADDITION_MAPPING:
+                for bid, _, bdata, bdata_end in mkv_elements(m, data, data_end):
+                    if bid == MKV.BLOCK_ADD_ID_TYPE:
+                        dv = dv or m.uint(bdata, bdata_end) in DV_CONFIG_IDS
+            elif cid == MKV.CONTENT_ENCODINGS:
+                encoded = True
+        tags = {"title": name} if name else {}
+        if kind == 1:
+            codec = MKV_CODECS.get(codec_id)
+            if codec is None or not height:
+                return None
+            stream = {"codec_type": "video", "codec_name": codec, "height": height}
+            if dv:
+                stream["side_data_list"] = [
+                    {"side_data_type": "DOVI configuration record"}
+                ]
+        elif kind == 2:
+            codec = MKV_CODECS.get(codec_id, codec_id.lower())
+            stream = {"codec_type": "audio", "codec_name": codec}
+            if codec == "eac3":
+                # Compressed (header stripped) frames would need decoding first
+                if encoded:
+                    return None
+                eac3[number] = stream
+        else:
+            continue
+        stream["tags"] = tags
+        streams.append(stream)
+
+    audio = [s for s in streams if s["codec_type"] == "audio"]
+    if any(has_atmos(s) for s in audio):
+        return streams
+    # TrueHD signals Atmos in its substreams, left to ffprobe
+    if any(s["codec_name"] == "truehd" for s in audio):
+        return None
+    if eac3:
+        if cluster is None:
+            return None
+        frames = mkv_first_frames(m, cluster, segment_end, set(eac3))
+        for number, stream in eac3.items():
+            joc = eac3_joc(frames[number]) if number in frames else None
+            if joc is None:
+                return None
+            if joc:
+                stream["profile"] = EAC3_ATMOS_PROFILE
+    return streams
+
+
+def mp4_boxes(m: HeaderMap, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """(type, data start, end) of the ISO-BMFF boxes from start to end"""
+    pos = start
+    while pos + 8 <= end:
+        head = m.read(pos, pos + 16)
+        size = int.from_bytes(head[:4], "big")
+        data = pos + 8
+        if size == 1:
+            size = int.from_bytes(head[8:16], "big")
+            data = pos + 16
+        elif size == 0:
+            size = end - pos
+        if size < data - pos:
+            raise ValueError(f"bad box size at {pos}")
+        yield head[4:8], data, min(pos + size, end)
+        pos += size
+
+
+def mp4_box(
+    m: HeaderMap, start: int, end: int, *path: bytes
+) -> Optional[Tuple[int, int]]:
+    """(data start, end) of the box at path (types of the box and its parents), None if missing"""
+    for kind in path:
+        found = next(
+            ((d, e) for t, d, e in mp4_boxes(m, start, end) if t == kind), None
         )
-        return json.loads(result.stdout.decode())
-    except (subprocess.CalledProcessError, FileNotFoundError):
+        if found is None:
+            return None
+        start, end = found
+    return start, end
+
+
+def parse_mp4(m: HeaderMap) -> Optional[List[dict]]:
+    """Streams of an ISO-BMFF (MP4) file, from the sample entries of its tracks"""
+    if m.read(4, 8) not in (b"ftyp", b"moov", b"free", b"mdat", b"wide", b"skip"):
         return None
+    moov = mp4_box(m, 0, m.size, b"moov")
+    if moov is None:
+        return None
+    streams = []
+    for kind, trak, trak_end in mp4_boxes(m, *moov):
+        if kind != b"trak":
+            continue
+        mdia = mp4_box(m, trak, trak_end, b"mdia")
+        hdlr = mdia and mp4_box(m, *mdia, b"hdlr")
+        stsd = mdia and mp4_box(m, *mdia, b"minf", b"stbl", b"stsd")
+        if not hdlr or not stsd:
+            return None
+        handler = m.read(hdlr[0] + 8, hdlr[0] + 12)
+        name = b""
+        if hdlr[1] > hdlr[0] + 24:
+            name = m.read(hdlr[0] + 24, hdlr[1]).split(b"\0")[0]
+        entry = next(mp4_boxes(m, stsd[0] + 8, stsd[1]), None)
+        if entry is None:
+            return None
+        fourcc, data, data_end = entry
+        tags = {"handler_name": name.decode("utf-8", "replace")} if name else {}
+        if handler == b"vide":
+            codec = MP4_CODECS.get(fourcc)
+            if codec is None:
+                return None
+            # VisualSampleEntry: height at 26, boxes after its 78 bytes
+            height = m.uint(data + 26, data + 28)
+            configs = {t for t, _, _ in mp4_boxes(m, data + 78, data_end)}
+            stream = {"codec_type": "video", "codec_name": codec, "height": height}
+            if fourcc in DV_ENTRIES or configs & DV_CONFIGS:
+                stream["side_data_list"] = [
+                    {"side_data_type": "DOVI configuration record"}
+                ]
+        elif handler == b"soun":
+            codec = MP4_CODECS.get(fourcc)
+            if codec is None or codec == "truehd":
+                return None
+            stream = {"codec_type": "audio", "codec_name": codec}
+            if codec == "eac3":
+                # AudioSampleEntry: boxes after its 28 bytes, plus 16 or 36 in QuickTime v1 or v2
+                version = m.uint(data + 8, data + 10)
+                boxes = data + 28 + {1: 16, 2: 36}.get(version, 0)
+                dec3 = mp4_box(m, boxes, data_end, b"dec3")
+                if dec3 is None:
+                    return None
+                if dec3_joc(m.read(*dec3)):
+                    stream["profile"] = EAC3_ATMOS_PROFILE
+        else:
+            continue
+        stream["tags"] = tags
+        streams.append(stream)
+    return streams
+
+
+def parse_header(path: Path) -> Tuple[Optional[dict], Optional[int]]:
+    """What extract_metadata reads, as ffprobe would output it, from the headers of a Matroska
+    or MP4 file, read in-process through a memory map. None for other containers, or when the
+    headers are damaged or leave something undecided. Also returns the bytes of the pages read
+    (the kernel may read ahead more)."""
+    try:
+        m = HeaderMap(path)
+    except (OSError, ValueError):
+        return None, None
+    try:
+        magic = m.read(0, 4)
+        parse = parse_matroska if magic == b"\x1a\x45\xdf\xa3" else parse_mp4
+        streams = parse(m)
+    except (ValueError, IndexError, StopIteration, KeyError, OverflowError):
+        streams = None
+    finally:
+        m.close()
+    return ({"streams": streams} if streams is not None else None), m.bytes_read
+
+
+class Prober:
+    """Probes files: MKV and MP4 headers in-process (native), others with ffprobe, full or
+    fast. Each falls back to the next (native, fast, full) when not conclusive. Records how each
+    probe went: modes, bytes read and time. Called from several threads.
+    """
+
+    def __init__(
+        self,
+        fast: bool = False,
+        probesize: int = FAST_PROBESIZE,
+        analyzeduration: int = FAST_ANALYZEDURATION,
+        log: Optional[TextIO] = None,
+        native: bool = True,
+    ):
+        self.fast = fast
+        self.probesize = probesize
+        self.analyzeduration = analyzeduration
+        self.native = native
+        # Optional JSON lines file with a record per probe
+        self.log = log
+        self.lock = threading.Lock()
+        # Per mode (native, full, fast, fast+full, native+full...): [files, bytes read, seconds]
+        self.totals: dict = {}
+
+    def __call__(self, path: Path) -> Optional[Metadata]:
+        start = time.monotonic()
+        modes = []
+        bytes_read = None
+        ff = None
+        if self.native and path.suffix.lower() in NATIVE_EXTS:
+            modes.append("native")
+            ff, bytes_read = parse_header(path)
+            if ff is None:
+                dprint(f"{path.name}: headers not conclusive, running ffprobe")
+        if ff is None and self.fast:
+            modes.append("fast")
+            ff, fast_read = run_probe(
+                probe_command(path, True, self.probesize, self.analyzeduration)
+            )
+            if fast_read is not None:
+                bytes_read = (bytes_read or 0) + fast_read
+            if ff is not None and needs_full_probe(ff):
+                dprint(f"{path.name}: fast probe not conclusive, probing in full")
+                ff = None
+        if ff is None:
+            modes.append("full")
+            ff, full_read = run_probe(probe_command(path))
+            if full_read is not None:
+                bytes_read = (bytes_read or 0) + full_read
+        self.record(path, "+".join(modes), bytes_read, time.monotonic() - start)
+        return extract_metadata(ff) if ff else None
+
+    def record(self, path: Path, mode: str, bytes_read: Optional[int], seconds: float):
+        with self.lock:
+            totals = self.totals.setdefault(mode, [0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += bytes_read or 0
+            totals[2] += seconds
+            if self.log is not None:
+                self.log.write(
+                    json.dumps(
+                        {
+                            "path": str(path),
+                            "mode": mode,
+                            "bytes_read": bytes_read,
+                            "seconds": round(seconds, 3),
+                        }
+                    )
+                    + "\n"
+                )
+
+    def summary(self) -> List[str]:
+        lines = []
+        for mode, (files, bytes_read, seconds) in sorted(self.totals.items()):
+            lines.append(
+                f"{mode} probes: {files} file(s), "
+                f"{bytes_read / files / 1e6:.2f} MB read per file, "
+                f"{seconds / files:.2f}s per file"
+            )
+        return lines
+
+
+def mount_key(path: Path, cache: dict) -> int:
+    """Device id of the mount holding path. One stat per directory, cached."""
+    parent = path.parent
+    dev = cache.get(parent)
+    if dev is None:
+        try:
+            dev = os.stat(parent).st_dev
+        except OSError:
+            dev = -1
+        cache[parent] = dev
+    return dev
+
+
+def probe_metadata(path: Path) -> Optional[Metadata]:
+    """(height, codec, dv, atmos) of path (see extract_metadata), None if ffprobe fails"""
+    ff = run_ffprobe(path)
+    return extract_metadata(ff) if ff else None
+
+
+def probe_files(
+    files: Iterable[Path],
+    jobs: int = 1,
+    mount_jobs: int = DEFAULT_MOUNT_JOBS,
+    cache: Optional["ProbeCache"] = None,
+    probe: Callable[[Path], Optional[Metadata]] = probe_metadata,
+) -> Iterator[Tuple[Path, Optional[Metadata]]]:
+    """Probe files with probe, up to jobs at once and at most mount_jobs at once per mount. Files found
+    unchanged in cache are not probed again. Yields (path, metadata or None) in the order of
+    files, whatever order the probes finish in."""
+    jobs = max(jobs, 1)
+    mount_jobs = max(mount_jobs, 1)
+    lookahead = jobs * LOOKAHEAD_PER_JOB
+    devices: dict = {}
+    # [path, mount, cache key, future or None until started, from cache], in the order of files
+    window: deque = deque()
+    pending = iter(files)
+    more = True
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while True:
+            while more and len(window) < lookahead:
+                path = next(pending, None)
+                if path is None:
+                    more = False
+                    break
+                key = cache.key(path) if cache is not None else None
+                future = None
+                if key is not None:
+                    hit = cache.get(key, path)
+                    if hit is not None:
+                        future = Future()
+                        future.set_result(hit)
+                mount = key[0] if key is not None else mount_key(path, devices)
+                window.append([path, mount, key, future, future is not None])
+            if not window:
+                return
+
+            # Start the oldest waiting probes whose mount has room
+            running = [e for e in window if e[3] is not None and not e[3].done()]
+            per_mount = Counter(e[1] for e in running)
+            for entry in window:
+                if len(running) >= jobs:
+                    break
+                if entry[3] is None and per_mount[entry[1]] < mount_jobs:
+                    entry[3] = pool.submit(probe, entry[0])
+                    per_mount[entry[1]] += 1
+                    running.append(entry)
+
+            # Hand out the finished probes at the head, in order
+            if window[0][3] is None or not window[0][3].done():
+                wait([e[3] for e in running], return_when=FIRST_COMPLETED)
+            while window and window[0][3] is not None and window[0][3].done():
+                path, _, key, future, cached = window.popleft()
+                metadata = future.result()
+                if key is not None and not cached and metadata is not None:
+                    cache.put(key, path, metadata)
+                yield path, metadata
+
+
+class ProbeCache:
+    """Probe results on disk (SQLite), by file identity: (device, inode, size, mtime_ns).
+    Renaming a file keeps its inode, so its entry stays valid. Failed probes are not cached.
+    """
+
+    # Bumped whenever the same file would now get other metadata: the cache is then dropped.
+    # 2: Atmos also read from ffprobe's "... + Dolby Atmos" profiles
+    VERSION = 2
+
+    def __init__(self, path: Path, rebuild: bool = False):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self.db.execute("DROP TABLE IF EXISTS probes")
+            self.db.execute(f"PRAGMA user_version = {self.VERSION}")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, path TEXT, "
+            "height INTEGER, codec TEXT, dv INTEGER, atmos INTEGER, "
+            "PRIMARY KEY (dev, ino))"
+        )
+        # Ignore what is cached, but cache the new results
+        self.rebuild = rebuild
+        # (dev, ino) of the files looked up in this run
+        self.seen: Set[Tuple[int, int]] = set()
+        self.hits = 0
+        self.misses = 0
+        self._unsaved = 0
+
+    @staticmethod
+    def key(path: Path) -> Optional[Tuple[int, int, int, int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def get(self, key: Tuple[int, int, int, int], path: Path) -> Optional[Metadata]:
+        self.seen.add(key[:2])
+        row = None
+        if not self.rebuild:
+            row = self.db.execute(
+                "SELECT height, codec, dv, atmos, path FROM probes "
+                "WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+                key,
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        height, codec, dv, atmos, cached_path = row
+        if cached_path != str(path.absolute()):
+            # Renamed by somebody else
+            self.moved(Path(cached_path), path)
+        return height, codec, bool(dv), bool(atmos)
+
+    def put(self, key: Tuple[int, int, int, int], path: Path, metadata: Metadata):
+        height, codec, dv, atmos = metadata
+        self.db.execute(
+            "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (*key, str(path.absolute()), height, codec, int(dv), int(atmos)),
+        )
+        self._changed()
+
+    def moved(self, src: Path, dst: Path):
+        self.db.execute(
+            "UPDATE probes SET path = ? WHERE path = ?",
+            (str(dst.absolute()), str(src.absolute())),
+        )
+        self._changed()
+
+    def _changed(self):
+        self._unsaved += 1
+        if self._unsaved >= CACHE_SAVE_EVERY:
+            self.save()
+
+    def save(self):
+        self.db.commit()
+        self._unsaved = 0
+
+    def evict(self, roots: List[Path]) -> int:
+        """Drop the entries under roots not seen in this run whose file is gone. Returns how
+        many."""
+        gone = []
+        for root in roots:
+            prefix = str(root.absolute())
+            rows = self.db.execute(
+                "SELECT dev, ino, path FROM probes "
+                "WHERE path = ? OR substr(path, 1, ?) = ?",
+                (prefix, len(prefix) + 1, prefix.rstrip(os.sep) + os.sep),
+            )
+            for dev, ino, path in rows.fetchall():
+                if (dev, ino) not in self.seen and not os.path.exists(path):
+                    gone.append((dev, ino))
+        self.db.executemany("DELETE FROM probes WHERE dev = ? AND ino = ?", gone)
+        self.save()
+        return len(gone)
+
+    def close(self):
+        self.save()
+        self.db.close()
+
+
+class Progress:
+    """Files probed and throughput, on stderr every PROGRESS_INTERVAL seconds"""
+
+    def __init__(self, enabled: bool = True, cache: Optional[ProbeCache] = None):
+        self.enabled = enabled
+        self.cache = cache
+        self.start = time.monotonic()
+        self.last = self.start
+        self.files = 0
+        self.changes = 0
+        self.reported = -1
+
+    def tick(self, changed: bool):
+        self.files += 1
+        self.changes += changed
+        now = time.monotonic()
+        if self.enabled and now - self.last >= PROGRESS_INTERVAL:
+            self.last = now
+            self.report(now)
+
+    def report(self, now: Optional[float] = None):
+        if self.files == self.reported:
+            return
+        self.reported = self.files
+        elapsed = (now or time.monotonic()) - self.start
+        rate = self.files / elapsed if elapsed > 0 else 0.0
+        print(
+            colorize(
+                f"Probed {self.files} file(s) in {elapsed:.0f}s ({rate:.1f}/s), "
+                f"{self.changes} to rename"
+                + (f", {self.cache.hits} from cache" if self.cache else ""),
+                Colors.CYAN,
+            ),
+            file=sys.stderr,
+            flush=True,
+        )
 
 
 def nearest_resolution(height: Optional[int], allowed: List[int]) -> Optional[int]:
@@ -124,9 +1047,10 @@ def has_dolby_vision(stream: dict) -> bool:
 
 
 def has_atmos(audio_stream: dict) -> bool:
-    # Dolby Atmos usually shows as E-AC-3 JOC profile
+    # Dolby Atmos usually shows as E-AC-3 JOC profile, which ffprobe calls
+    # "Dolby Digital Plus + Dolby Atmos" (and TrueHD's "Dolby TrueHD + Dolby Atmos")
     profile = (audio_stream.get("profile") or "").lower()
-    if "joc" in profile:  # Joint Object Coding
+    if "joc" in profile or "atmos" in profile:  # Joint Object Coding
         return True
     # Some tags or codec_long_name can contain Atmos
     for k in ("codec_long_name", "title"):
@@ -224,29 +1148,54 @@ def build_new_name(
     return f"{base}{sep}{sep.join(deduped)}"
 
 
-def safe_rename(src: Path, dst: Path) -> Path:
-    if src == dst or dst.exists():
-        if src == dst:
-            return dst
+def safe_rename(src: Path, dst: Path, claimed: Optional[Set[Path]] = None) -> Path:
+    """Target for renaming src to dst: dst itself, or dst with a numeric suffix if dst exists or
+    is claimed, i.e. the target of an earlier rename in this run (in a dry run, those do not
+    exist yet). The target returned is added to claimed."""
+    if claimed is None:
+        claimed = set()
+    if src == dst:
+        return dst
+
+    def taken(p: Path) -> bool:
+        return p in claimed or p.exists()
+
+    if taken(dst):
         # If target exists, append a numeric suffix
         stem, suffix = dst.stem, dst.suffix
         parent = dst.parent
         i = 1
-        while True:
-            candidate = parent / f"{stem}.{i}{suffix}"
-            if not candidate.exists():
-                return candidate
+        while taken(parent / f"{stem}.{i}{suffix}"):
             i += 1
+        dst = parent / f"{stem}.{i}{suffix}"
+    claimed.add(dst)
     return dst
 
 
 def process_file(
-    path: Path, allowed_res: List[int], dry_run: bool, sep: str
+    path: Path,
+    allowed_res: List[int],
+    dry_run: bool,
+    sep: str,
+    claimed: Optional[Set[Path]] = None,
 ) -> Optional[Tuple[Path, Path, bool]]:
-    ff = run_ffprobe(path)
-    if not ff:
+    return process_probed(
+        path, probe_metadata(path), allowed_res, dry_run, sep, claimed
+    )
+
+
+def process_probed(
+    path: Path,
+    metadata: Optional[Metadata],
+    allowed_res: List[int],
+    dry_run: bool,
+    sep: str,
+    claimed: Optional[Set[Path]] = None,
+) -> Optional[Tuple[Path, Path, bool]]:
+    """Rename path as per its probed metadata"""
+    if not metadata:
         return None
-    height, codec, dv, atmos = extract_metadata(ff)
+    height, codec, dv, atmos = metadata
     nearest = nearest_resolution(height, allowed_res) if height else None
 
     base = path.stem
@@ -270,27 +1219,95 @@ def process_file(
     if new_base == base:
         return None
     new_path = path.with_name(new_base + path.suffix)
-    new_path = safe_rename(path, new_path)
+    new_path = safe_rename(path, new_path, claimed)
     if not dry_run:
         path.rename(new_path)
     return (path, new_path, has_mismatch)
 
 
-def find_media_files(root: Path, recursive: bool) -> List[Path]:
-    files: List[Path] = []
+def find_media_files(
+    root: Path, recursive: bool, prune: Iterable[str] = ()
+) -> Iterator[Path]:
+    """Media files under root, one directory at a time: the files of a directory, then its
+    subdirectories, depth first. Subdirectories whose name matches one of the prune patterns are
+    skipped. File types come from the directory listing, so nothing is stat'ed on most
+    filesystems. Each directory is listed in full before its files are yielded: they may be
+    renamed meanwhile, which a listing in progress may or may not see."""
     if root.is_file():
         if root.suffix.lower() in VIDEO_EXTS:
-            files.append(root)
-        return files
-
-    it = root.rglob("*") if recursive else root.glob("*")
-    for p in it:
-        if p.is_file() and p.suffix.lower() in VIDEO_EXTS:
-            # Skip obvious samples
-            if re.search(r"sample", p.name, re.IGNORECASE):
-                continue
-            files.append(p)
-    return files
+            yield root
+        return
+
+    prune = list(prune)
+    dirs = [str(root)]
+    while dirs:
+        top = dirs.pop()
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(top) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and not any(
+                                fnmatch.fnmatch(entry.name, p) for p in prune
+                            ):
+                                subdirs.append(entry.path)
+                        elif (
+                            entry.is_file()
+                            and os.path.splitext(entry.name)[1].lower() in VIDEO_EXTS
+                            and not SAMPLE_PATTERN.search(entry.name)
+                        ):
+                            files.append(Path(entry.path))
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Warning: cannot read {top} ({e.strerror}), skipping")
+        yield from files
+        # Pop them in listing order
+        dirs.extend(reversed(subdirs))
+
+
+def iter_media_files(
+    paths: List[str], recursive: bool, prune: Iterable[str] = ()
+) -> Iterator[Path]:
+    """Media files under each of paths, in order"""
+    for p in paths:
+        root = Path(p)
+        if not root.exists():
+            print(f"Warning: {root} does not exist, skipping")
+            continue
+        yield from find_media_files(root, recursive=recursive, prune=prune)
+
+
+def print_change(res: Tuple[Path, Path, bool], apply: bool):
+    src, dst, has_mismatch = res
+    action = (
+        colorize("RENAME", Colors.GREEN) if apply else colorize("DRY-RUN", Colors.BLUE)
+    )
+
+    # Highlight the differences between src and dst
+    src_name = src.name
+    dst_name = dst.name
+
+    # Extract only the changed part (stem)
+    src_stem = src.stem
+    dst_stem = dst.stem
+
+    if src_stem != dst_stem:
+        # Show what's being added/changed - highlight only the added tokens
+        # Find the difference: what was added to the name
+        if dst_stem.startswith(src_stem):
+            # Tokens were appended
+            added_part = dst_stem[len(src_stem) :]
+            display_dst = f"{src_stem}{colorize(added_part, Colors.GREEN + Colors.BOLD)}{dst.suffix}"
+        else:
+            # More complex change, just highlight the whole new name
+            display_dst = colorize(dst_name, Colors.GREEN + Colors.BOLD)
+
+        print(f"{action}: {colorize(src_name, Colors.BOLD)} -> {display_dst}")
+    else:
+        print(f"{action}: {src} -> {dst}")
 
 
 def main():
@@ -312,9 +1329,72 @@ def main():
     parser.add_argument(
         "--recursive", action="store_true", help="Recurse into directories"
     )
+    parser.add_argument(
+        "--prune",
+        default=DEFAULT_PRUNE,
+        help=f"Comma-separated name patterns of directories not to recurse into (default: '{DEFAULT_PRUNE}', '' for none)",
+    )
     parser.add_argument(
         "--debug", action="store_true", help="Enable verbose debug output"
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of ffprobe processes to run at once (default: 1)",
+    )
+    parser.add_argument(
+        "--mount-jobs",
+        type=int,
+        default=DEFAULT_MOUNT_JOBS,
+        help=f"Max ffprobe processes at once reading from one mount (default: {DEFAULT_MOUNT_JOBS})",
+    )
+    parser.add_argument(
+        "--cache",
+        default=str(DEFAULT_CACHE),
+        help=f"Probe cache file (default: {DEFAULT_CACHE})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Probe every file, without reading or writing the cache",
+    )
+    parser.add_argument(
+        "--rebuild-cache",
+        action="store_true",
+        help="Probe every file again and refresh its cache entry",
+    )
+    parser.add_argument(
+        "--fast-probe",
+        action="store_true",
+        help="Probe only the stream fields needed, from the start of the file, and probe in full only when that is not conclusive",
+    )
+    parser.add_argument(
+        "--probesize",
+        type=int,
+        default=FAST_PROBESIZE,
+        help=f"Bytes a fast probe may read (default: {FAST_PROBESIZE})",
+    )
+    parser.add_argument(
+        "--analyzeduration",
+        type=int,
+        default=FAST_ANALYZEDURATION,
+        help=f"Microseconds of media a fast probe may analyze (default: {FAST_ANALYZEDURATION})",
+    )
+    parser.add_argument(
+        "--no-native",
+        action="store_true",
+        help="Run ffprobe on MKV and MP4 files too, instead of reading their headers in-process",
+    )
+    parser.add_argument(
+        "--probe-log",
+        help="Append a JSON line per probe (path, mode, bytes read, seconds) to this file",
+    )
+    parser.add_argument(
+        "--no-progress",
+        action="store_true",
+        help="Do not report progress and throughput on stderr",
+    )
 
     args = parser.parse_args()
 
@@ -336,47 +1416,53 @@ def main():
         raise SystemExit(2)
 
     changes: List[Tuple[Path, Path, bool]] = []
+    # Targets of this run's renames, so two files never get the same one
+    claimed: Set[Path] = set()
+    cache = None
+    if not args.no_cache:
+        cache = ProbeCache(Path(args.cache), rebuild=args.rebuild_cache)
+    progress = Progress(enabled=not args.no_progress, cache=cache)
+    probe_log = open(args.probe_log, "a") if args.probe_log else None
+    prober = Prober(
+        fast=args.fast_probe,
+        probesize=args.probesize,
+        analyzeduration=args.analyzeduration,
+        log=probe_log,
+        native=not args.no_native,
+    )
 
-    for p in args.paths:
-        root = Path(p)
-        if not root.exists():
-            print(f"Warning: {root} does not exist, skipping")
-            continue
-        for f in find_media_files(root, recursive=args.recursive):
-            res = process_file(f, allowed_res, dry_run=not args.apply, sep=args.sep)
-            if res:
-                changes.append(res)
-                src, dst, has_mismatch = res
-                action = (
-                    colorize("RENAME", Colors.GREEN)
-                    if args.apply
-                    else colorize("DRY-RUN", Colors.BLUE)
-                )
-
-                # Highlight the differences between src and dst
-                src_name = src.name
-                dst_name = dst.name
-
-                # Extract only the changed part (stem)
-                src_stem = src.stem
-                dst_stem = dst.stem
-
-                if src_stem != dst_stem:
-                    # Show what's being added/changed - highlight only the added tokens
-                    # Find the difference: what was added to the name
-                    if dst_stem.startswith(src_stem):
-                        # Tokens were appended
-                        added_part = dst_stem[len(src_stem) :]
-                        display_dst = f"{src_stem}{colorize(added_part, Colors.GREEN + Colors.BOLD)}{dst.suffix}"
-                    else:
-                        # More complex change, just highlight the whole new name
-                        display_dst = colorize(dst_name, Colors.GREEN + Colors.BOLD)
-
-                    print(
-                        f"{action}: {colorize(src_name, Colors.BOLD)} -> {display_dst}"
-                    )
-                else:
-                    print(f"{action}: {src} -> {dst}")
+    prune = [p.strip() for p in args.prune.split(",") if p.strip()]
+    files = iter_media_files(args.paths, recursive=args.recursive, prune=prune)
+    probed = probe_files(
+        files, jobs=args.jobs, mount_jobs=args.mount_jobs, cache=cache, probe=prober
+    )
+    for f, metadata in probed:
+        res = process_probed(
+            f,
+            metadata,
+            allowed_res,
+            dry_run=not args.apply,
+            sep=args.sep,
+            claimed=claimed,
+        )
+        progress.tick(res is not None)
+        if res:
+            changes.append(res)
+            print_change(res, args.apply)
+            if args.apply and cache is not None:
+                cache.moved(res[0], res[1])
+    if progress.enabled:
+        progress.report()
+        for line in prober.summary():
+            print(colorize(line, Colors.CYAN), file=sys.stderr)
+    if probe_log is not None:
+        probe_log.close()
+    if cache is not None:
+        evicted = cache.evict([Path(p) for p in args.paths if Path(p).is_dir()])
+        dprint(
+            f"Cache: {cache.hits} hit(s), {cache.misses} miss(es), {evicted} evicted"
+        )
+        cache.close()
 
     if not changes:
         print("No files needed renaming.")
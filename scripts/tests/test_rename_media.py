@@ -0,0 +1,87 @@
+from pathlib import Path
+
+import rename_media as rm
+
+
+def video(**fields) -> dict:
+    return {"codec_type": "video", "codec_name": "hevc", "height": 2160, **fields}
+
+
+def test_plain_eac3_fast_probe_is_conclusive(monkeypatch):
+    ff = {"streams": [video(), {"codec_type": "audio", "codec_name": "eac3"}]}
+    assert not rm.needs_full_probe(ff)
+
+    commands = []
+
+    def run_probe(cmd):
+        commands.append(cmd)
+        return ff, 1000
+
+    monkeypatch.setattr(rm, "run_probe", run_probe)
+    prober = rm.Prober(fast=True, native=False)
+    assert prober(Path("plain.mkv")) == (2160, "x265", False, False)
+    assert len(commands) == 1 and "-show_entries" in commands[0]
+    assert list(prober.totals) == ["fast"]
+
+
+def test_fast_probe_falls_back_when_undecided():
+    eac3_atmos = {
+        "codec_type": "audio",
+        "codec_name": "eac3",
+        "profile": rm.EAC3_ATMOS_PROFILE,
+    }
+    assert not rm.needs_full_probe({"streams": [video(), eac3_atmos]})
+    assert rm.needs_full_probe({"streams": [video(height=None), eac3_atmos]})
+    assert rm.needs_full_probe({"streams": [{"codec_type": "audio"}]})
+    truehd = {"codec_type": "audio", "codec_name": "truehd"}
+    assert rm.needs_full_probe({"streams": [video(), truehd]})
+
+
+def test_find_media_files_yields_renamed_files_once(tmp_path):
+    (tmp_path / "sub").mkdir()
+    names = [f"episode{i:03d}.mkv" for i in range(200)]
+    for name in names:
+        (tmp_path / name).touch()
+        (tmp_path / "sub" / name).touch()
+    (tmp_path / "episode.sample.mkv").touch()
+    (tmp_path / "notes.txt").touch()
+
+    seen = []
+    for path in rm.find_media_files(tmp_path, recursive=True):
+        seen.append(path)
+        # As --apply does, while the walk goes on
+        path.rename(path.with_name(path.stem + ".WEBDL.2160p" + path.suffix))
+
+    assert len(seen) == len(set(seen)) == 2 * len(names)
+    assert not any(".WEBDL." in path.name for path in seen)
+
+
+def test_cache_from_another_version_is_dropped(tmp_path):
+    path = tmp_path / "probes.sqlite3"
+    cache = rm.ProbeCache(path)
+    key = (1, 2, 3, 4)
+    cache.put(key, tmp_path / "a.mkv", (2160, "x265", False, False))
+    cache.db.execute(f"PRAGMA user_version = {rm.ProbeCache.VERSION - 1}")
+    cache.close()
+
+    cache = rm.ProbeCache(path)
+    assert cache.get(key, tmp_path / "a.mkv") is None
+    cache.close()
+
+
+def test_oversized_block_add_id_type(tmp_path, monkeypatch):
+    import bench_rename_media as bench
+
+    ebml = bench.ebml
+
+    def oversized(eid, *children):
+        if eid == rm.MKV.BLOCK_ADD_ID_TYPE:
+            children = (b"\x01" + b"dvcC" * 2,)
+        return ebml(eid, *children)
+
+    monkeypatch.setattr(bench, "ebml", oversized)
+    path = tmp_path / "oversized.mkv"
+    bench.write_mkv(path, "hevc", 2160, dv=True, joc=False, pad=1000)
+
+    ff, _ = rm.parse_header(path)
+    assert rm.extract_metadata(ff) == (2160, "x265", False, False)